@@ -0,0 +1,59 @@
+import argparse
+import time
+
+import numpy as np
+
+from bench_mission_estimator import synthetic_field
+from mav_codec import (lossy_rows, mission_items_to_plan, plan_to_mission_items, plan_to_raw,
+                       raw_to_plan)
+from mission_sync import item_table
+from plan_compiler import MAV_CMD_DO_SET_CAM_TRIGG_DIST
+
+SIZES = (1000, 10000, 100000)
+
+
+def _best(function, repeats):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return result, min(timings)
+
+
+def _same(a, b):
+    return a.shape == b.shape and bool(np.all((a == b) | (np.isnan(a) & np.isnan(b))))
+
+
+def bench(sizes=SIZES, repeats=3):
+    """
+    Times each conversion on synthetic surveys of `size` rows and checks the
+    round trips: raw -> plan -> raw must be exact, and so must
+    mission -> plan -> mission.
+    """
+    print(f"{'rows':>8} {'raw->plan':>10} {'plan->raw':>10} {'plan->miss':>10} "
+          f"{'miss->plan':>10}  round trips")
+    for size in sizes:
+        plan = synthetic_field((size - 2) // 2)
+        # Trigger once immediately, as QGC writes it, so no row is lossy.
+        plan.params[plan.command == MAV_CMD_DO_SET_CAM_TRIGG_DIST, 2] = 1.0
+        raw = plan_to_raw(plan)
+        decoded, raw_to_plan_s = _best(lambda: raw_to_plan(raw), repeats)
+        encoded, plan_to_raw_s = _best(lambda: plan_to_raw(decoded), repeats)
+        items, to_mission_s = _best(lambda: plan_to_mission_items(decoded), repeats)
+        rebuilt, from_mission_s = _best(lambda: mission_items_to_plan(items), repeats)
+
+        raw_ok = _same(item_table(raw), item_table(encoded))
+        mission_ok = _same(item_table(items), item_table(plan_to_mission_items(rebuilt)))
+        print(f"{len(raw):>8} {raw_to_plan_s * 1000:>8.1f}ms {plan_to_raw_s * 1000:>8.1f}ms "
+              f"{to_mission_s * 1000:>8.1f}ms {from_mission_s * 1000:>8.1f}ms  "
+              f"raw {'exact' if raw_ok else 'DIFFERS'}, mission {'exact' if mission_ok else 'DIFFERS'}, "
+              f"{len(items)} mission items, {len(lossy_rows(decoded))} lossy rows")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time mav_codec conversions and check round trips.")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--sizes", type=int, nargs="*", default=list(SIZES))
+    args = parser.parse_args()
+    bench(args.sizes, args.repeats)
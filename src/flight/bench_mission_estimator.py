@@ -0,0 +1,71 @@
+import argparse
+import time
+
+import numpy as np
+
+from geo import ne_to_latlon
+from mission_estimator import estimate_mission
+from plan_compiler import (MAV_CMD_DO_SET_CAM_TRIGG_DIST, MAV_CMD_NAV_RETURN_TO_LAUNCH,
+                           MAV_CMD_NAV_TAKEOFF, MAV_CMD_NAV_WAYPOINT, MAV_FRAME_GLOBAL_RELATIVE_ALT,
+                           MAV_FRAME_MISSION, CompiledPlan)
+
+SIZES = (10, 100, 1000, 10000, 100000)
+HOME = (46.7228, -116.9588, 794.0)
+
+
+def synthetic_field(waypoints, transect_m=200.0, swath_m=5.0, altitude_m=10.0, trigger_m=25.0):
+    """
+    A lawnmower survey with `waypoints` transect ends, laid out like a QGC
+    survey: each transect starts with a trigger-distance item and ends with
+    one that stops triggering.
+    """
+    transects = max(waypoints // 2, 1)
+    along = np.tile([0.0, transect_m], transects)
+    along[2::4], along[3::4] = transect_m, 0.0  # Alternate direction.
+    across = np.repeat(np.arange(transects) * swath_m, 2)
+    lat, lon = ne_to_latlon(along, across, HOME[0], HOME[1])
+
+    count = 2 * transects
+    rows = 2 + 2 * count
+    command = np.full(rows, MAV_CMD_NAV_WAYPOINT, dtype=np.uint16)
+    frame = np.full(rows, MAV_FRAME_GLOBAL_RELATIVE_ALT, dtype=np.uint8)
+    params = np.zeros((rows, 7))
+    command[0] = MAV_CMD_NAV_TAKEOFF
+    params[0, 6] = altitude_m
+
+    waypoint_rows = 1 + 2 * np.arange(count)
+    params[waypoint_rows, 4] = lat
+    params[waypoint_rows, 5] = lon
+    params[waypoint_rows, 6] = altitude_m
+    trigger_rows = waypoint_rows + 1
+    command[trigger_rows] = MAV_CMD_DO_SET_CAM_TRIGG_DIST
+    frame[trigger_rows] = MAV_FRAME_MISSION
+    params[trigger_rows, 0] = np.tile([trigger_m, 0.0], transects)
+
+    command[-1] = MAV_CMD_NAV_RETURN_TO_LAUNCH
+    frame[-1] = MAV_FRAME_MISSION
+    return CompiledPlan(command, frame, params, np.ones(rows, dtype=bool),
+                        cruise_speed=8.0, hover_speed=5.0, home=HOME)
+
+
+def bench(sizes=SIZES, repeats=5):
+    print(f"{'waypoints':>10} {'legs':>8} {'best ms':>9} {'us/leg':>8}  estimate")
+    for size in sizes:
+        plan = synthetic_field(size)
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            estimate = estimate_mission(plan)
+            timings.append(time.perf_counter() - started)
+        best = min(timings)
+        print(f"{size:>10} {len(estimate):>8} {best * 1000:>9.2f} {best * 1e6 / len(estimate):>8.2f}  "
+              f"{estimate.total_time_s / 60:.1f} min, {estimate.total_energy_wh:.0f} Wh, "
+              f"{estimate.total_spray_l:.1f} L")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time mission_estimator on synthetic fields.")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--sizes", type=int, nargs="*", default=list(SIZES))
+    args = parser.parse_args()
+    bench(args.sizes, args.repeats)
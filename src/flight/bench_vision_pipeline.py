@@ -0,0 +1,50 @@
+import argparse
+import asyncio
+import time
+
+from vision_pipeline import DummyDetector, Pose, SyntheticFrameSource, VisionPipeline
+
+CONFIGS = ((1, 1), (1, 4), (2, 1), (2, 4), (4, 8))  # (workers, batch size)
+POSE = Pose(46.7228, -116.9588, 10.0, 0.0)
+
+
+async def run_once(workers, batch_size, fps, seconds, queue_size):
+    pipeline = VisionPipeline(SyntheticFrameSource(fps=fps), DummyDetector(), lambda: POSE,
+                              queue_size=queue_size, workers=workers, batch_size=batch_size)
+    detections = 0
+    stream = pipeline.detections()
+    deadline = time.monotonic() + seconds
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(stream.__anext__(), remaining)
+            except asyncio.TimeoutError:
+                break
+            detections += 1
+    finally:
+        await stream.aclose()
+    return pipeline, detections
+
+
+def bench(configs=CONFIGS, fps=None, seconds=2.0, queue_size=4):
+    print(f"{'workers':>7} {'batch':>5} {'captured/s':>10} {'processed/s':>11} {'dropped':>8} "
+          f"{'p50 ms':>7} {'p95 ms':>7}")
+    for workers, batch_size in configs:
+        pipeline, _ = asyncio.run(run_once(workers, batch_size, fps, seconds, queue_size))
+        stats = pipeline.latency.summary().get("detection", {})
+        dropped = 100.0 * pipeline.frames_dropped / max(pipeline.frames_captured, 1)
+        print(f"{workers:>7} {batch_size:>5} {pipeline.frames_captured / seconds:>10.0f} "
+              f"{pipeline.frames_processed / seconds:>11.0f} {dropped:>7.0f}% "
+              f"{stats.get('p50_ms', float('nan')):>7.1f} {stats.get('p95_ms', float('nan')):>7.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput and latency of vision_pipeline.")
+    parser.add_argument("--fps", type=float, default=None, help="Camera rate (default: unthrottled)")
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument("--queue", type=int, default=4, help="Frame queue size")
+    args = parser.parse_args()
+    bench(fps=args.fps, seconds=args.seconds, queue_size=args.queue)
@@ -1,41 +1,17 @@
 import asyncio
-from mavsdk import System
+from connection_manager import ConnectionManager
 
 async def run():
-    drone = System()
-    
-    # Common ports: /dev/ttyACM0 (Pi/Standard), /dev/ttyUSB0 (Jetson/Adapters)
-    # command to find port on mac: (ls /dev/tty.usbmodem*) 
-    ports_to_try = [
-        "udp://:14540",
-        "udp:127.0.0.1:14540",
-        "serial:///dev/tty.usbmodem101:115200",
-        "serial:///dev/ttyACM0:115200", 
-        "serial:///dev/ttyACM1:115200",
-        "serial:///dev/ttyUSB0:115200"
-    ]
+    # All candidate ports (see connection_manager.DEFAULT_CANDIDATES) are probed
+    # at once; the winner is remembered and tried first on the next run.
+    address, drone = await ConnectionManager().connect()
 
-    connected = False
-    for port in ports_to_try:
-        print(f"Attempting to connect on {port}...")
-        try:
-            # We use a short timeout for the search
-            await asyncio.wait_for(drone.connect(system_address=port), timeout=5)
-            
-            # Check if we actually see heartbeats
-            async for state in drone.core.connection_state():
-                if state.is_connected:
-                    print(f"--> SUCCESS: Connected on {port}!")
-                    connected = True
-                    break
-            if connected: break
-        except Exception:
-            print(f"No drone found on {port}")
-
-    if not connected:
+    if drone is None:
         print("FAILED: Could not find a flight controller. See checklist below.")
         return
 
+    print(f"--> SUCCESS: Connected on {address}!")
+
     # Basic Health Check
     async for health in drone.telemetry.health():
         print(f"GPS Fix: {health.is_global_position_ok}")
@@ -0,0 +1,166 @@
+import asyncio
+import inspect
+import json
+import os
+import time
+
+# Common ports: /dev/ttyACM0 (Pi/Standard), /dev/ttyUSB0 (Jetson/Adapters)
+# command to find port on mac: (ls /dev/tty.usbmodem*)
+DEFAULT_CANDIDATES = [
+    "udp://:14540",
+    "udp:127.0.0.1:14540",
+    "serial:///dev/tty.usbmodem101:115200",
+    "serial:///dev/ttyACM0:115200",
+    "serial:///dev/ttyACM1:115200",
+    "serial:///dev/ttyUSB0:115200",
+]
+DEFAULT_STATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".last_connection.json")
+DEFAULT_BASE_PORT = 50051
+
+# SITL instance i (-I i) is forwarded to udp port FIRST_UDP_PORT + i * PORT_STRIDE.
+FIRST_UDP_PORT = 14540
+PORT_STRIDE = 10
+
+
+def vehicle_address(index):
+    """Default MAVLink address of the index-th simulated vehicle."""
+    return f"udp://:{FIRST_UDP_PORT + index * PORT_STRIDE}"
+
+
+def _serial_device(address):
+    """Returns the device path of a serial:// address, or None for other schemes."""
+    if not address.startswith("serial://"):
+        return None
+    return address[len("serial://"):].rsplit(":", 1)[0]
+
+
+def mavsdk_system(port):
+    """Creates a mavsdk.System whose embedded mavsdk_server listens on `port`."""
+    from mavsdk import System
+    return System(port=port)
+
+
+async def close_system(system):
+    """Stops a System's embedded mavsdk_server (or a stand-in's close())."""
+    close = getattr(system, "close", None) or getattr(system, "_stop_mavsdk_server", None)
+    if close is None:
+        return
+    result = close()
+    if inspect.isawaitable(result):
+        await result
+
+
+class ConnectionManager:
+    """
+    Finds the autopilot by probing every candidate endpoint at once.
+
+    Each probe gets its own System (and mavsdk_server port); the first to see
+    a heartbeat wins and the others are cancelled and shut down. The winner is
+    saved to `state_path` and tried on its own first next time, so a
+    reconnect to the same link does not wait on the other candidates.
+    Serial candidates whose device does not exist are skipped without
+    starting a probe.
+    """
+
+    def __init__(self, candidates=None, state_path=DEFAULT_STATE_PATH, timeout_s=5.0,
+                 fast_timeout_s=1.5, base_port=DEFAULT_BASE_PORT, system_factory=None):
+        self.candidates = list(candidates or DEFAULT_CANDIDATES)
+        self.state_path = state_path
+        self.timeout_s = timeout_s
+        self.fast_timeout_s = fast_timeout_s
+        self.base_port = base_port
+        self.system_factory = system_factory or mavsdk_system
+
+    def last_known_good(self):
+        """Returns the endpoint that connected last time, or None."""
+        if self.state_path is None:
+            return None
+        try:
+            with open(self.state_path) as f:
+                return json.load(f).get("address")
+        except (OSError, ValueError):
+            return None
+
+    def _remember(self, address):
+        if self.state_path is None:
+            return
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"address": address, "connected_at": time.time()}, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _available(self, addresses):
+        result = []
+        for address in addresses:
+            device = _serial_device(address)
+            if device is None or os.path.exists(device):
+                result.append(address)
+        return result
+
+    async def _probe(self, address, port):
+        system = self.system_factory(port)
+        try:
+            await system.connect(system_address=address)
+            async for state in system.core.connection_state():
+                if state.is_connected:
+                    return system
+        except BaseException:
+            await close_system(system)
+            raise
+        await close_system(system)
+        raise ConnectionError(f"Connection state stream ended on {address}")
+
+    async def _race(self, addresses, timeout_s):
+        """Probes `addresses` in parallel; returns (address, system) or None."""
+        if not addresses:
+            return None
+        tasks = {asyncio.create_task(self._probe(address, self.base_port + i)): address
+                 for i, address in enumerate(addresses)}
+        deadline = time.monotonic() + timeout_s
+        pending = set(tasks)
+        winner = None
+        try:
+            while pending and winner is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=remaining,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if winner is None and not task.cancelled() and task.exception() is None:
+                        winner = (tasks[task], task.result())
+                    elif not task.cancelled() and task.exception() is None:
+                        await close_system(task.result())
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        return winner
+
+    async def connect(self):
+        """
+        Connects to the first endpoint that produces a heartbeat.
+
+        Returns:
+            (address, system) for the winning endpoint, or (None, None) if no
+            candidate answered within the timeout.
+        """
+        started = time.monotonic()
+        last = self.last_known_good()
+        candidates = self._available(self.candidates)
+        if last is not None:
+            print(f"Trying last known endpoint {last}...")
+            result = await self._race(self._available([last]), self.fast_timeout_s)
+            if result is not None:
+                self._remember(result[0])
+                print(f"--> Connected on {result[0]} in {time.monotonic() - started:.2f}s")
+                return result
+            candidates = [address for address in candidates if address != last]
+
+        print(f"Probing {len(candidates)} endpoints in parallel...")
+        result = await self._race(candidates, self.timeout_s)
+        if result is None:
+            return None, None
+        self._remember(result[0])
+        print(f"--> Connected on {result[0]} in {time.monotonic() - started:.2f}s")
+        return result
@@ -0,0 +1,262 @@
+import json
+import math
+import os
+import sys
+
+import numpy as np
+
+from coverage_planner import clip_lines, fence_polygons
+from geo import latlon_to_ne, ne_to_latlon
+
+FORMAT_VERSION = 1
+
+# Set bits in every byte value, for counting cells in packed rows.
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _row_masks(c0, c1, first_byte, byte_count):
+    """
+    Packed (rows, byte_count) masks with cells [c0, c1) set in each row.
+
+    Cells are stored big-endian within a byte (np.packbits order), so cell
+    `c` is bit 0x80 >> (c % 8) of byte c // 8.
+    """
+    starts = (first_byte + np.arange(byte_count)) * 8
+    # minimum/maximum rather than np.clip: this runs at telemetry rate and
+    # clip's per-call overhead dominates for a few dozen rows.
+    lo = np.minimum(np.maximum(c0[:, None] - starts, 0), 8)
+    hi = np.minimum(np.maximum(c1[:, None] - starts, 0), 8)
+    return ((0xFF >> lo) & ~(0xFF >> hi) & 0xFF).astype(np.uint8)
+
+
+class CoverageDiff:
+    """Cell-by-cell comparison of two coverage maps of the same field."""
+
+    def __init__(self, only_a_m2, only_b_m2, both_m2):
+        self.only_a_m2 = only_a_m2
+        self.only_b_m2 = only_b_m2
+        self.both_m2 = both_m2
+
+    def __str__(self):
+        return (f"Both: {self.both_m2:.1f} m2, only first: {self.only_a_m2:.1f} m2, "
+                f"only second: {self.only_b_m2:.1f} m2")
+
+
+class CoverageMap:
+    """
+    As-sprayed map of a field as a bit-packed occupancy grid.
+
+    The grid covers the bounding box of the field polygon at `resolution_m`
+    per cell, eight cells per byte, with row 0 at the southern edge. While
+    the valve is open, each new position fix paints the boom swath between
+    it and the previous fix. The count of newly set in-field cells is kept
+    as it goes, so `coverage_fraction` costs nothing to read.
+    """
+
+    def __init__(self, polygon, resolution_m=0.1, boom_width_m=3.0):
+        polygon = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+        self.polygon = polygon
+        self.resolution_m = float(resolution_m)
+        self.boom_width_m = float(boom_width_m)
+        self.ref_lat = float(polygon[:, 0].min())
+        self.ref_lon = float(polygon[:, 1].min())
+
+        north, east = latlon_to_ne(polygon[:, 0], polygon[:, 1], self.ref_lat, self.ref_lon)
+        self._ring = np.column_stack((east, north)) / self.resolution_m
+        self.rows = int(math.ceil(north.max() / self.resolution_m)) + 1
+        self.cols = int(math.ceil(east.max() / self.resolution_m)) + 1
+        self.grid = np.zeros((self.rows, (self.cols + 7) // 8), dtype=np.uint8)
+        self.field = self._rasterize_field()
+        self.field_cells = int(_POPCOUNT[self.field].sum(dtype=np.int64))
+        self.covered_cells = 0
+
+        self.spraying = False
+        self._last = None
+        self._hub = None
+
+    @classmethod
+    def from_plan(cls, plan, resolution_m=0.1, boom_width_m=3.0):
+        """Builds a map over the first inclusion geofence polygon of a CompiledPlan."""
+        inclusion, _ = fence_polygons(plan)
+        if not inclusion:
+            raise ValueError("Plan has no inclusion geofence polygon to map")
+        return cls(inclusion[0], resolution_m, boom_width_m)
+
+    def _rasterize_field(self):
+        starts = self._ring
+        ends = np.roll(starts, -1, axis=0)
+        ys = np.arange(self.rows) + 0.5
+        x_in, x_out, valid = clip_lines(starts, ends, ys)
+        field = np.zeros_like(self.grid)
+        for slot in range(x_in.shape[1]):
+            c0 = np.where(valid[:, slot], np.ceil(x_in[:, slot] - 0.5), 0).astype(np.int64)
+            c1 = np.where(valid[:, slot], np.floor(x_out[:, slot] - 0.5) + 1, 0).astype(np.int64)
+            field |= _row_masks(np.clip(c0, 0, self.cols), np.clip(c1, 0, self.cols),
+                                0, field.shape[1])
+        return field
+
+    def _to_cells(self, lat, lon):
+        north, east = latlon_to_ne(lat, lon, self.ref_lat, self.ref_lon)
+        return float(east) / self.resolution_m, float(north) / self.resolution_m
+
+    def paint(self, start, end):
+        """
+        Marks the boom swath from `start` to `end` ((x, y) in cells) as sprayed.
+
+        The swath is the rectangle of boom width around the segment, extended
+        by half a cell at each end so consecutive fixes leave no gaps. Returns
+        the number of in-field cells newly covered.
+        """
+        (x0, y0), (x1, y1) = start, end
+        dx, dy = x1 - x0, y1 - y0
+        length = math.hypot(dx, dy)
+        ux, uy = (dx / length, dy / length) if length > 1e-9 else (0.0, 1.0)
+        half = 0.5 * self.boom_width_m / self.resolution_m
+        px, py = -uy * half, ux * half
+        x0, y0, x1, y1 = x0 - ux * 0.5, y0 - uy * 0.5, x1 + ux * 0.5, y1 + uy * 0.5
+        corners = np.array([(x0 + px, y0 + py), (x1 + px, y1 + py),
+                            (x1 - px, y1 - py), (x0 - px, y0 - py)])
+        ys = corners[:, 1]
+
+        r0 = max(int(math.floor(ys.min())), 0)
+        r1 = min(int(math.ceil(ys.max())), self.rows)
+        if r1 <= r0:
+            return 0
+        x_in, x_out, valid = clip_lines(corners, corners[[1, 2, 3, 0]], np.arange(r0, r1) + 0.5)
+        valid = valid[:, 0]
+        c0 = np.where(valid, np.maximum(np.ceil(x_in[:, 0] - 0.5), 0), 0).astype(np.int64)
+        c1 = np.where(valid, np.minimum(np.floor(x_out[:, 0] - 0.5) + 1, self.cols), 0).astype(np.int64)
+        if not (c1 > c0).any():
+            return 0
+
+        first_byte = int(c0[c1 > c0].min()) // 8
+        last_byte = (int(c1.max()) - 1) // 8
+        masks = _row_masks(c0, c1, first_byte, last_byte - first_byte + 1)
+        window = self.grid[r0:r1, first_byte:last_byte + 1]
+        new = masks & ~window & self.field[r0:r1, first_byte:last_byte + 1]
+        window |= masks
+        added = int(_POPCOUNT[new].sum())
+        self.covered_cells += added
+        return added
+
+    def update(self, lat, lon):
+        """Feeds one position fix; paints the swath since the last fix while spraying."""
+        cell = self._to_cells(lat, lon)
+        if self.spraying and self._last is not None:
+            self.paint(self._last, cell)
+        self._last = cell
+
+    def set_spraying(self, is_open):
+        """Valve state changes; the next fix paints from the last known position."""
+        if is_open and not self.spraying and self._last is not None:
+            self.paint(self._last, self._last)
+        self.spraying = is_open
+
+    def _on_sample(self, name, timestamp, sample):
+        if name == "position":
+            self.update(sample[0], sample[1])
+
+    def attach(self, hub):
+        """Starts painting from the position samples of a TelemetryHub."""
+        self._hub = hub
+        hub.add_listener(self._on_sample)
+        hub.subscribe("position")
+
+    def detach(self):
+        if self._hub is not None:
+            self._hub.remove_listener(self._on_sample)
+            self._hub = None
+
+    @property
+    def cell_area_m2(self) -> float:
+        return self.resolution_m * self.resolution_m
+
+    @property
+    def coverage_fraction(self) -> float:
+        """Fraction of the field's cells that have been sprayed."""
+        return self.covered_cells / self.field_cells if self.field_cells else 0.0
+
+    def uncovered_regions(self, block_m=5.0, min_fraction=0.5):
+        """
+        Coarse blocks of the field that are still mostly unsprayed.
+
+        Returns:
+            (N, 3) array of block-centre lat, lon and uncovered area in m^2
+            for blocks whose in-field area is at least `min_fraction`
+            uncovered.
+        """
+        block_bytes = max(int(round(block_m / self.resolution_m / 8)), 1)
+        block_rows = block_bytes * 8
+        rows = -(-self.rows // block_rows) * block_rows
+        cols = -(-self.grid.shape[1] // block_bytes) * block_bytes
+
+        def block_counts(packed):
+            padded = np.zeros((rows, cols), dtype=np.uint8)
+            padded[:self.rows, :packed.shape[1]] = packed
+            counts = _POPCOUNT[padded].astype(np.int32)
+            return counts.reshape(rows // block_rows, block_rows,
+                                  cols // block_bytes, block_bytes).sum(axis=(1, 3))
+
+        field = block_counts(self.field)
+        uncovered = block_counts(self.field & ~self.grid)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fraction = np.where(field > 0, uncovered / field, 0.0)
+        block_r, block_c = np.nonzero((field > 0) & (fraction >= min_fraction))
+        north = (block_r + 0.5) * block_rows * self.resolution_m
+        east = (block_c + 0.5) * block_bytes * 8 * self.resolution_m
+        lat, lon = ne_to_latlon(north, east, self.ref_lat, self.ref_lon)
+        area = uncovered[block_r, block_c] * self.cell_area_m2
+        return np.column_stack((lat, lon, area))
+
+    def save(self, path):
+        """Writes the map to a compressed .npz file atomically."""
+        meta = {
+            "version": FORMAT_VERSION,
+            "resolution_m": self.resolution_m,
+            "boom_width_m": self.boom_width_m,
+            "polygon": self.polygon.tolist(),
+        }
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, grid=self.grid, meta=np.array(json.dumps(meta)))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Reads a map written with `save`."""
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta.get("version") != FORMAT_VERSION:
+                raise ValueError(f"Coverage map {path} has version {meta.get('version')}")
+            coverage = cls(meta["polygon"], meta["resolution_m"], meta["boom_width_m"])
+            if data["grid"].shape != coverage.grid.shape:
+                raise ValueError(f"Coverage map {path} does not match its own field")
+            coverage.grid = data["grid"].copy()
+        coverage.covered_cells = int(_POPCOUNT[coverage.grid & coverage.field].sum(dtype=np.int64))
+        return coverage
+
+    def diff(self, other) -> CoverageDiff:
+        """Compares in-field coverage with another map of the same field and resolution."""
+        if self.grid.shape != other.grid.shape or self.resolution_m != other.resolution_m \
+                or not np.array_equal(self.polygon, other.polygon):
+            raise ValueError("Coverage maps cover different fields or resolutions")
+        a = self.grid & self.field
+        b = other.grid & self.field
+        area = self.cell_area_m2
+        return CoverageDiff(int(_POPCOUNT[a & ~b].sum(dtype=np.int64)) * area,
+                            int(_POPCOUNT[b & ~a].sum(dtype=np.int64)) * area,
+                            int(_POPCOUNT[a & b].sum(dtype=np.int64)) * area)
+
+    def __str__(self):
+        area = self.field_cells * self.cell_area_m2
+        return f"{self.coverage_fraction * 100:.1f}% of {area:.0f} m2 sprayed"
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python coverage_map.py first.npz second.npz")
+        sys.exit(1)
+    first, second = CoverageMap.load(sys.argv[1]), CoverageMap.load(sys.argv[2])
+    print(f"{sys.argv[1]}: {first}")
+    print(f"{sys.argv[2]}: {second}")
+    print(first.diff(second))
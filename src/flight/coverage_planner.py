@@ -0,0 +1,387 @@
+import argparse
+import math
+import time
+
+import numpy as np
+
+from geo import latlon_to_ne, ne_to_latlon
+from plan_compiler import (MAV_CMD_DO_CHANGE_SPEED, MAV_CMD_NAV_RETURN_TO_LAUNCH,
+                           MAV_CMD_NAV_TAKEOFF, MAV_CMD_NAV_WAYPOINT, MAV_FRAME_GLOBAL_RELATIVE_ALT,
+                           MAV_FRAME_MISSION, CompiledPlan, PlanError, compile_plan)
+
+DEFAULT_ANGLE_STEP_DEG = 1.0
+# Transects stay at least this far from the boundary and from holes, so
+# waypoints are not on the fence itself and a small overshoot at the turn
+# does not breach it. The field is inset by half the swath when that is
+# more, keeping the boom's spray inside.
+DEFAULT_MARGIN_M = 1.0
+
+
+def fence_polygons(plan):
+    """
+    Returns (inclusion, exclusion) lists of (N, 2) lat/lon arrays from the
+    geoFence section of a CompiledPlan.
+    """
+    inclusion, exclusion = [], []
+    for polygon in plan.geofence.get("polygons", []):
+        points = np.asarray(polygon["polygon"], dtype=np.float64).reshape(-1, 2)
+        (inclusion if polygon.get("inclusion", True) else exclusion).append(points)
+    return inclusion, exclusion
+
+
+def _edges(rings):
+    """Stacks the edges of closed (N, 2) x/y rings into (start, end) arrays."""
+    starts = np.concatenate(rings)
+    ends = np.concatenate([np.roll(ring, -1, axis=0) for ring in rings])
+    return starts, ends
+
+
+def inset_ring(ring, distance):
+    """
+    Moves every edge of a closed (N, 2) x/y ring `distance` towards its
+    inside (away from it for a negative distance, which grows a hole).
+
+    Each vertex becomes the intersection of its two offset edges. That is
+    exact at convex corners and errs inwards at reflex ones; edges shorter
+    than the offset can fold over.
+    """
+    ring = np.asarray(ring, dtype=np.float64).reshape(-1, 2)
+    ring = ring[np.hypot(*(np.roll(ring, -1, axis=0) - ring).T) > 1e-9]
+    if len(ring) < 3 or distance == 0:
+        return ring
+    direction = np.roll(ring, -1, axis=0) - ring
+    direction /= np.hypot(direction[:, 0], direction[:, 1])[:, None]
+    x, y = ring[:, 0], ring[:, 1]
+    orientation = np.sign(np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y))  # +1 counter-clockwise.
+    normal = orientation * np.column_stack((-direction[:, 1], direction[:, 0]))
+    points = ring + distance * normal  # A point on each offset edge.
+
+    prev_points, prev_direction = np.roll(points, 1, axis=0), np.roll(direction, 1, axis=0)
+    cross = prev_direction[:, 0] * direction[:, 1] - prev_direction[:, 1] * direction[:, 0]
+    delta = points - prev_points
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = (delta[:, 0] * direction[:, 1] - delta[:, 1] * direction[:, 0]) / cross
+    corner = prev_points + t[:, None] * prev_direction
+    return np.where((np.abs(cross) > 1e-9)[:, None], corner, points)
+
+
+def _crossings(a, b, starts, ends):
+    """Mask of segments a -> b ((T, 2) each) that properly cross any edge."""
+    def side(p, q, r):
+        return np.sign((q[..., 0] - p[..., 0]) * (r[..., 1] - p[..., 1])
+                       - (q[..., 1] - p[..., 1]) * (r[..., 0] - p[..., 0]))
+    a, b = a[:, None, :], b[:, None, :]
+    s, e = starts[None, :, :], ends[None, :, :]
+    crossing = (side(a, b, s) * side(a, b, e) < 0) & (side(s, e, a) * side(s, e, b) < 0)
+    return crossing.any(axis=1)
+
+
+def clip_lines(starts, ends, ys):
+    """
+    Intersects horizontal lines y = ys with polygon edges (even-odd rule).
+
+    All line/edge pairs are evaluated at once as an (L, E) matrix; edges of
+    exclusion rings passed alongside the outer ring become holes.
+
+    Returns:
+        (x_in, x_out, valid): (L, S) arrays of segment start and end x and a
+        mask of the slots that hold a segment, S being the most segments any
+        line has.
+    """
+    x1, y1 = starts[:, 0], starts[:, 1]
+    x2, y2 = ends[:, 0], ends[:, 1]
+    y = ys[:, None]
+    # Half-open test so a line through a vertex counts exactly one of its edges.
+    crosses = (y1 <= y) != (y2 <= y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+    x = np.where(crosses, x, np.inf)
+    x.sort(axis=1)
+    counts = crosses.sum(axis=1)
+    slots = max(int(counts.max(initial=0)) // 2, 1)
+    x = x[:, :2 * slots]
+    if x.shape[1] < 2 * slots:
+        x = np.pad(x, ((0, 0), (0, 2 * slots - x.shape[1])), constant_values=np.inf)
+    valid = np.arange(slots)[None, :] * 2 < counts[:, None]
+    return x[:, 0::2], x[:, 1::2], valid
+
+
+def to_track(north, east, heading_deg):
+    """Rotates N/E into (along, across) track coordinates for a sweep heading."""
+    h = math.radians(heading_deg)
+    return north * math.cos(h) + east * math.sin(h), -north * math.sin(h) + east * math.cos(h)
+
+
+def from_track(along, across, heading_deg):
+    """Inverse of `to_track`."""
+    h = math.radians(heading_deg)
+    return along * math.cos(h) - across * math.sin(h), along * math.sin(h) + across * math.cos(h)
+
+
+def _transects(starts, ends, swath_m):
+    """
+    Lines and segments for one rotation of the inset field: returns
+    (ys, x_in, x_out, valid).
+    """
+    y_min = min(starts[:, 1].min(), ends[:, 1].min())
+    y_max = max(starts[:, 1].max(), ends[:, 1].max())
+    count = max(int(math.floor((y_max - y_min) / swath_m)), 0) + 1
+    first = y_min + ((y_max - y_min) - (count - 1) * swath_m) / 2.0
+    ys = first + np.arange(count) * swath_m
+    x_in, x_out, valid = clip_lines(starts, ends, ys)
+    valid &= x_out > x_in
+    return ys, x_in, x_out, valid
+
+
+def _cells(valid):
+    """
+    Groups segments into boustrophedon cells: runs of consecutive lines with
+    the same segment count, one cell per segment slot in the run.
+
+    Returns a list of (line indices, slot) pairs.
+    """
+    counts = valid.sum(axis=1)
+    cells = []
+    line = 0
+    while line < len(counts):
+        if counts[line] == 0:
+            line += 1
+            continue
+        end = line
+        while end + 1 < len(counts) and counts[end + 1] == counts[line]:
+            end += 1
+        lines = np.arange(line, end + 1)
+        for slot in range(counts[line]):
+            cells.append((lines, slot))
+        line = end + 1
+    return cells
+
+
+def _turn_length(dx, dy, turn_radius_m):
+    """Distance to get from one transect end to the next transect start."""
+    direct = math.hypot(dx, dy)
+    if turn_radius_m <= 0:
+        return direct
+    return direct + max(math.pi * turn_radius_m - abs(dy), 0.0)
+
+
+def _route(ys, x_in, x_out, valid, turn_radius_m, start=None, boundary=None):
+    """
+    Orders every segment into one path.
+
+    Cells are taken greedily by the nearest entry corner; inside a cell the
+    lines alternate direction. With `boundary` (edge starts and ends of the
+    field and its holes), an entry reached without crossing an edge beats
+    any that crosses one. Returns (points (2S, 2) in along/across
+    coordinates, transect length, turn count, total length, number of
+    transitions that cross the boundary).
+    """
+    remaining = _cells(valid)
+    position = start
+    points = []
+    transect_m = 0.0
+    transition_m = 0.0
+    turns = 0
+    while remaining:
+        candidates = []
+        for index, (lines, slot) in enumerate(remaining):
+            for reverse_lines in (False, True):
+                line = lines[-1] if reverse_lines else lines[0]
+                for forward in (True, False):
+                    x = x_in[line, slot] if forward else x_out[line, slot]
+                    candidates.append((x, ys[line], index, reverse_lines, forward))
+        entries = np.array([candidate[:2] for candidate in candidates])
+        if position is None:
+            cost = np.zeros(len(candidates))
+        else:
+            cost = np.hypot(entries[:, 0] - position[0], entries[:, 1] - position[1])
+            if boundary is not None and points:
+                crosses = _crossings(np.tile(position, (len(entries), 1)), entries, *boundary)
+                if not crosses.all():
+                    cost[crosses] = np.inf
+        _, _, index, reverse_lines, forward = candidates[int(np.argmin(cost))]
+        lines, slot = remaining.pop(index)
+        if reverse_lines:
+            lines = lines[::-1]
+        for line in lines:
+            a, b = x_in[line, slot], x_out[line, slot]
+            if not forward:
+                a, b = b, a
+            if points:
+                turns += 1
+            if position is not None:
+                transition_m += _turn_length(a - position[0], ys[line] - position[1], turn_radius_m)
+            points.append((a, ys[line]))
+            points.append((b, ys[line]))
+            transect_m += abs(b - a)
+            position = (b, ys[line])
+            forward = not forward
+    points = np.array(points).reshape(-1, 2)
+    crossings = 0
+    if boundary is not None and len(points) > 2:
+        crossings = int(_crossings(points[1:-1:2], points[2::2], *boundary).sum())
+    return points, transect_m, turns, transect_m + transition_m, crossings
+
+
+class CoveragePlan:
+    """
+    A generated survey: the chosen sweep heading, the ordered transect end
+    points and the statistics the heading was chosen on.
+    """
+
+    def __init__(self, heading_deg, waypoints, turns, transect_m, length_m, altitude_m, speed_m_s,
+                 home=None, geofence=None, planning_s=0.0, crossings=0):
+        self.heading_deg = heading_deg
+        self.waypoints = waypoints
+        self.turns = turns
+        self.crossings = crossings  # Transitions cutting across the boundary or a hole.
+        self.transect_m = transect_m
+        self.length_m = length_m
+        self.altitude_m = altitude_m
+        self.speed_m_s = speed_m_s
+        self.home = home
+        self.geofence = geofence
+        self.planning_s = planning_s
+
+    def __str__(self):
+        crossings = (f", WARNING: {self.crossings} transitions cross the boundary or a hole"
+                     if self.crossings else "")
+        return (f"{len(self.waypoints) // 2} transects at {self.heading_deg:.1f} deg, "
+                f"{self.turns} turns, {self.length_m:.0f} m path "
+                f"({self.transect_m:.0f} m spraying), planned in {self.planning_s * 1000:.1f} ms"
+                f"{crossings}")
+
+    def to_compiled_plan(self) -> CompiledPlan:
+        """
+        Builds takeoff, speed, one waypoint per transect end and RTL, ready
+        for Drone.upload_mission.
+        """
+        count = len(self.waypoints)
+        rows = count + 3
+        command = np.full(rows, MAV_CMD_NAV_WAYPOINT, dtype=np.uint16)
+        frame = np.full(rows, MAV_FRAME_GLOBAL_RELATIVE_ALT, dtype=np.uint8)
+        params = np.zeros((rows, 7))
+
+        command[0] = MAV_CMD_NAV_TAKEOFF
+        params[0, 3] = np.nan
+        params[0, 6] = self.altitude_m
+
+        command[1] = MAV_CMD_DO_CHANGE_SPEED
+        frame[1] = MAV_FRAME_MISSION
+        params[1, :3] = (1, self.speed_m_s, -1)  # Ground speed, no throttle change.
+
+        params[2:2 + count, 3] = np.nan
+        params[2:2 + count, 4:6] = self.waypoints
+        params[2:2 + count, 6] = self.altitude_m
+
+        command[-1] = MAV_CMD_NAV_RETURN_TO_LAUNCH
+        frame[-1] = MAV_FRAME_MISSION
+        return CompiledPlan(command, frame, params, np.ones(rows, dtype=bool),
+                            cruise_speed=self.speed_m_s, hover_speed=self.speed_m_s,
+                            home=self.home, geofence=self.geofence)
+
+
+def plan_coverage(polygon, swath_m, heading_deg=None, turn_radius_m=0.0, altitude_m=10.0,
+                  speed_m_s=5.0, exclusions=(), margin_m=DEFAULT_MARGIN_M,
+                  angle_step_deg=DEFAULT_ANGLE_STEP_DEG, home=None, geofence=None) -> CoveragePlan:
+    """
+    Plans boustrophedon transects covering a lat/lon polygon.
+
+    Args:
+        polygon: (N, 2) lat/lon vertices of the inclusion polygon.
+        swath_m: Spacing between transects (the sprayed width).
+        heading_deg: Transect heading in degrees from north. When None every
+            heading in [0, 180) is tried in `angle_step_deg` steps. The one
+            whose transitions cross the boundary or a hole least often wins,
+            then the one with the fewest turns, then the shortest path.
+        turn_radius_m: Turn radius used to cost the change between transects.
+        exclusions: Lat/lon polygons inside `polygon` to leave out.
+        margin_m: Least distance kept from the boundary and from holes. The
+            field is inset (and holes grown) by this or half the swath,
+            whichever is more, before the transects are clipped.
+
+    Transitions are straight lines. One that still has to cross the
+    boundary or a hole is counted in CoveragePlan.crossings.
+
+    Raises:
+        PlanError: If the polygon is degenerate or no transect fits inside it.
+    """
+    started = time.perf_counter()
+    if swath_m <= 0:
+        raise PlanError("Swath width must be positive")
+    polygon = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+    if len(polygon) < 3:
+        raise PlanError("Coverage polygon needs at least three vertices")
+    ref_lat, ref_lon = polygon[:, 0].mean(), polygon[:, 1].mean()
+
+    rings = [polygon] + [np.asarray(ring, dtype=np.float64).reshape(-1, 2) for ring in exclusions]
+    ne_rings = [np.column_stack(latlon_to_ne(ring[:, 0], ring[:, 1], ref_lat, ref_lon)) for ring in rings]
+    inset = max(margin_m, swath_m / 2.0)
+    inset_rings = [inset_ring(ring, inset if i == 0 else -inset) for i, ring in enumerate(ne_rings)]
+    ne_starts, ne_ends = _edges(inset_rings)
+    boundary_starts, boundary_ends = _edges(ne_rings)
+    start = None
+    if home is not None:
+        start = np.array(latlon_to_ne(home[0], home[1], ref_lat, ref_lon), dtype=np.float64)
+
+    headings = [heading_deg] if heading_deg is not None else np.arange(0.0, 180.0, angle_step_deg)
+    best = None
+    for heading in headings:
+        starts = np.column_stack(to_track(ne_starts[:, 0], ne_starts[:, 1], heading))
+        ends = np.column_stack(to_track(ne_ends[:, 0], ne_ends[:, 1], heading))
+        ys, x_in, x_out, valid = _transects(starts, ends, swath_m)
+        if not valid.any():
+            continue
+        boundary = (np.column_stack(to_track(boundary_starts[:, 0], boundary_starts[:, 1], heading)),
+                    np.column_stack(to_track(boundary_ends[:, 0], boundary_ends[:, 1], heading)))
+        origin = None if start is None else to_track(start[0], start[1], heading)
+        points, transect_m, turns, length_m, crossings = _route(ys, x_in, x_out, valid, turn_radius_m,
+                                                                origin, boundary)
+        key = (crossings, turns, round(length_m, 3))
+        if best is None or key < best[0]:
+            best = (key, float(heading), points, transect_m, turns, length_m, crossings)
+    if best is None:
+        raise PlanError("No transect fits inside the coverage polygon")
+
+    _, heading, points, transect_m, turns, length_m, crossings = best
+    north, east = from_track(points[:, 0], points[:, 1], heading)
+    lat, lon = ne_to_latlon(north, east, ref_lat, ref_lon)
+    return CoveragePlan(heading, np.column_stack((lat, lon)), turns, transect_m, length_m,
+                        altitude_m, speed_m_s, home=home, geofence=geofence,
+                        planning_s=time.perf_counter() - started, crossings=crossings)
+
+
+def replan(plan, swath_m, heading_deg=None, turn_radius_m=0.0, altitude_m=None, speed_m_s=None,
+           margin_m=DEFAULT_MARGIN_M) -> CoveragePlan:
+    """
+    Plans a fresh survey over the inclusion fence of an existing CompiledPlan,
+    keeping its altitude, cruise speed, home and geofence unless overridden.
+    Exclusion fences become holes in the coverage.
+    """
+    inclusion, exclusion = fence_polygons(plan)
+    if not inclusion:
+        raise PlanError("Plan has no inclusion geofence polygon to cover")
+    if altitude_m is None:
+        waypoints = plan.waypoints()
+        altitude_m = float(np.median(waypoints[:, 2])) if len(waypoints) else 10.0
+    return plan_coverage(inclusion[0], swath_m, heading_deg, turn_radius_m, altitude_m,
+                         speed_m_s or plan.cruise_speed, exclusion, margin_m,
+                         home=plan.home, geofence=plan.geofence)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan spray transects over a plan's geofence.")
+    parser.add_argument("plan", help="QGroundControl .plan file with an inclusion geofence")
+    parser.add_argument("--swath", type=float, default=5.0, help="Transect spacing in metres")
+    parser.add_argument("--heading", type=float, default=None, help="Fixed transect heading in degrees")
+    parser.add_argument("--turn-radius", type=float, default=0.0, help="Turn radius in metres")
+    parser.add_argument("--margin", type=float, default=DEFAULT_MARGIN_M, help="Boundary margin in metres")
+    args = parser.parse_args()
+
+    coverage = replan(compile_plan(args.plan), args.swath, args.heading, args.turn_radius,
+                      margin_m=args.margin)
+    print(coverage)
+
+
+if __name__ == "__main__":
+    main()
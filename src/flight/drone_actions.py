@@ -1,11 +1,21 @@
 import asyncio
 import os
 import json
+from connection_manager import ConnectionManager
 from dotenv import load_dotenv
 from mavsdk import System
-from mavsdk.mission import MissionItem, MissionPlan
+from mavsdk.mission import MissionItem
 from mavsdk.mission_raw import MissionItem as MissionRawItem
-from mavsdk.telemetry import MAV_CMD
+from instrumentation import metrics_from_env, timed
+from telemetry_hub import TelemetryHub
+
+# Plans, missions, parameters, geofences and flight logs are imported in the
+# methods that use them, so short scripts that only arm, take off or read
+# telemetry do not load them.
+
+# How long the vehicle gets to report a set_current_mission_item in its
+# mission progress before the mission is started anyway.
+SET_CURRENT_TIMEOUT_S = 3.0
 
 def convert_mission_raw_item_to_mission_item(raw_item: MissionRawItem) -> MissionItem:
     """
@@ -15,155 +25,285 @@ def convert_mission_raw_item_to_mission_item(raw_item: MissionRawItem) -> Missio
         raw_item: The mission_raw.MissionItem object to convert.
 
     Returns:
-        A new mavsdk.mission.MissionItem object.
+        A new mavsdk.mission.MissionItem object. A DO item on its own comes
+        back as an item with a NaN position carrying only the DO fields.
+        Convert whole missions with mav_codec.raw_to_mission_items, which
+        folds each DO item into the nav item it follows.
     """
-
-    # Initialize with default values or values that can be directly mapped
-    mission_item = MissionItem(
-        latitude_deg=raw_item.x / 1e7,  # x is latitude scaled by 1e7
-        longitude_deg=raw_item.y / 1e7, # y is longitude scaled by 1e7
-        relative_altitude_m=raw_item.z, # z is altitude in meters
-        speed_m_s=float('nan'),         # Default to NaN, will be set if command specifies
-        is_fly_through=False,           # Default, will be set if command specifies
-        gimbal_pitch_deg=float('nan'),  # Default to NaN
-        gimbal_yaw_deg=float('nan'),    # Default to NaN
-        camera_action=MissionItem.CameraAction.NONE,
-        loiter_time_s=float('nan'),
-        camera_photo_interval_s=float('nan'),
-        acceptance_radius_m=float('nan'),
-        yaw_deg=float('nan'),
-        camera_photo_distance_m=float('nan'),
-        vehicle_action=MissionItem.VehicleAction.NONE
-    )
-
-    # Interpret MAVLink command and parameters
-    if raw_item.command == MAV_CMD.MAV_CMD_NAV_WAYPOINT:
-        mission_item.is_fly_through = (raw_item.param3 == 0)
-        mission_item.acceptance_radius_m = raw_item.param2
-        mission_item.yaw_deg = raw_item.param4
-
-    elif raw_item.command == MAV_CMD.MAV_CMD_DO_CHANGE_SPEED:
-        mission_item.speed_m_s = raw_item.param2
-
-    elif raw_item.command == MAV_CMD.MAV_CMD_NAV_LOITER_TIME:
-        mission_item.loiter_time_s = raw_item.param1
-        mission_item.acceptance_radius_m = raw_item.param2
-        mission_item.yaw_deg = raw_item.param4
-
-    elif raw_item.command == MAV_CMD.MAV_CMD_IMAGE_START_CAPTURE:
-        mission_item.camera_action = CameraAction.TAKE_PHOTO
-
-    elif raw_item.command == MAV_CMD.MAV_CMD_DO_MOUNT_CONTROL:
-        mission_item.gimbal_pitch_deg = raw_item.param1
-        mission_item.gimbal_yaw_deg = raw_item.param3
-
-    return mission_item
+    from mav_codec import raw_to_mission_items
+    return raw_to_mission_items([raw_item], home=False)[0]
 
 
 class Drone:
-    def __init__(self):
+    def __init__(self, system=None, connection_string=None, metrics=None):
+        """
+        Args:
+            system: Optional mavsdk.System (or a stand-in such as
+                fake_system.FakeSystem) to use as-is.
+            connection_string: Address to connect to, overriding
+                CONNECTION_STRING (used when one script flies several drones).
+            metrics: Optional instrumentation.Metrics. Every Drone call is
+                timed under "drone.<method>", every telemetry wait under
+                "wait_for.<stream>", and telemetry messages are counted per
+                stream. Defaults to METRICS_FILE from the .env file (a .jsonl
+                or .prom path); unset disables instrumentation.
+
+        Without `system`, CONNECTION_STRING from the .env file decides how to
+        connect: a single address is used directly, a comma-separated list is
+        probed in parallel, and a missing value probes the default endpoints
+        (see connection_manager.DEFAULT_CANDIDATES).
+        """
         load_dotenv()
-        self.connection_string = os.getenv("CONNECTION_STRING")
-        if not self.connection_string:
-            raise ValueError("CONNECTION_STRING not found in .env file")
-        self.system = System()
+        self.metrics = metrics if metrics is not None else metrics_from_env()
+        if self.metrics is not None:
+            self.metrics.add_collector(self._telemetry_counts)
+        self.connection_string = connection_string or os.getenv("CONNECTION_STRING")
+        self.candidates = None
+        if system is None and (not self.connection_string or "," in self.connection_string):
+            self.candidates = ([address.strip() for address in self.connection_string.split(",")]
+                               if self.connection_string else None)
+            self.connection_string = None
+        self._bind(system if system is not None or self.connection_string is None else System())
+
+    def _bind(self, system):
+        self.system = system
+        self.telemetry = TelemetryHub(system, metrics=self.metrics) if system is not None else None
+        self.recorder = None
+        self._mission_sync = None
+        self._params = None
+
+    @property
+    def mission_sync(self):
+        """The vehicle's MissionSync, created on first use."""
+        if self._mission_sync is None and self.system is not None:
+            from mission_sync import MissionSync
+            self._mission_sync = MissionSync(self.system)
+        return self._mission_sync
 
+    @property
+    def params(self):
+        """The vehicle's ParamSync, created on first use."""
+        if self._params is None and self.system is not None:
+            from params import ParamSync
+            self._params = ParamSync(self.system)
+        return self._params
+
+    def _telemetry_counts(self):
+        if self.telemetry is None:
+            return {}
+        return {f"telemetry_messages.{name}": count
+                for name, count in self.telemetry.message_counts.items()}
+
+    @timed("drone.connect")
     async def connect(self):
         """Connects to the drone using the connection string from the .env file."""
-        print(f"--- Connecting to drone on {self.connection_string} ---")
-        await self.system.connect(system_address=self.connection_string)
+        if self.system is None:
+            print("--- Searching for drone ---")
+            address, system = await ConnectionManager(self.candidates).connect()
+            if system is None:
+                print("--> No drone found")
+                return False
+            self.connection_string = address
+            self._bind(system)
+        else:
+            print(f"--- Connecting to drone on {self.connection_string} ---")
+            await self.system.connect(system_address=self.connection_string)
 
-        async for state in self.system.core.connection_state():
-            if state.is_connected:
-                print("--> Drone Connected")
-                return True
-        return False
+        await self.telemetry.wait_for("connection_state", lambda state: state.is_connected)
+        print("--> Drone Connected")
+        return True
 
+    @timed("drone.wait_for_readiness")
     async def wait_for_readiness(self):
         """Waits for the drone to be ready (passes health checks)."""
         print("--- Waiting for drone to be ready ---")
-        async for health in self.system.telemetry.health():
-            if health.is_armable and health.is_global_position_ok:
-                print("--> System Ready")
-                break
+        await self.telemetry.wait_for(
+            "health", lambda health: health.is_armable and health.is_global_position_ok)
+        print("--> System Ready")
 
+    @timed("drone.sync_params")
+    async def sync_params(self, parm_file, apply=True):
+        """
+        Compares the drone's parameters with a .parm file and, if `apply`,
+        writes only the values that differ.
+
+        Returns:
+            The ParamDiff when `apply` is False, otherwise a ParamWriteReport.
+        """
+        print(f"--- Checking parameters against {parm_file} ---")
+        changes = await self.params.diff(parm_file)
+        print(f"--> {len(changes)} parameters differ")
+        if not apply or len(changes) == 0:
+            return changes
+        report = await self.params.apply(parm_file)
+        print(f"--> {report}")
+        return report
+
+    @timed("drone.arm")
     async def arm(self):
         """Arms the drone."""
         print("--- Arming ---")
         await self.system.action.arm()
-        async for is_armed in self.system.telemetry.armed():
-            if is_armed:
-                print("--> Drone Armed")
-                break
+        await self.telemetry.wait_for("armed", lambda is_armed: is_armed)
+        print("--> Drone Armed")
 
+    @timed("drone.takeoff")
     async def takeoff(self, altitude=10.0):
         """Takes off to a specific altitude."""
         print(f"--- Taking off to {altitude}m ---")
         await self.system.action.set_takeoff_altitude(altitude)
         await self.system.action.takeoff()
-        async for position in self.system.telemetry.position():
-            if position.relative_altitude_m > altitude * 0.95:
-                print(f"--> Altitude Reached: {round(position.relative_altitude_m, 1)}m")
-                break
+        position = await self.telemetry.wait_for(
+            "position", lambda position: position.relative_altitude_m > altitude * 0.95)
+        print(f"--> Altitude Reached: {round(position.relative_altitude_m, 1)}m")
+
+    @timed("drone.upload_mission")
+    async def upload_mission(self, mission, current_index=None):
+        """
+        Uploads a mission to the drone, skipping the transfer if the vehicle
+        already holds the same mission.
+
+        `mission` may be a QGroundControl plan file path, a CompiledPlan, or a
+        list of mission or mission_raw items. Plans go through mission_raw so
+        every item (RTL, trigger distance, ...) is uploaded as written, after
+        the seq 0 home item; mission items go through the mission plugin,
+        which adds home itself. Pass the item the drone is flying as
+        `current_index` after an in-field replan to send only the changed
+        tail; the vehicle's current item is then set to the tail's first
+        item. Plans are checked against their own geoFence first and raise
+        GeofenceError if any waypoint or leg breaches it.
+        """
+        from geofence import Geofence
+        from plan_compiler import CompiledPlan, compile_plan
 
-    async def upload_mission(self, mission_file_path: str):
-        """Uploads a mission to the drone from a QGroundControl plan file."""
-        print(f"--- Importing QGC Plan from {mission_file_path} ---")
-        mission_raw_result = await self.system.mission_raw.import_qgroundcontrol_mission(mission_file_path)
-        converted_mission_items = [convert_mission_raw_item_to_mission_item(item) for item in mission_raw_result.mission_items]
-        mission_plan = MissionPlan(converted_mission_items)
-        print(f"--- Uploading {len(converted_mission_items)} items ---")
-        await self.system.mission.upload_mission(mission_plan)
-        print("--> Mission Uploaded")
-
-    async def start_mission(self):
-        """Starts the uploaded mission."""
-        print("--- Starting mission ---")
-        await self.system.mission.set_current_mission_item(0)
-        await asyncio.sleep(1)
+        if isinstance(mission, str):
+            print(f"--- Compiling QGC Plan from {mission} ---")
+            mission = compile_plan(mission)
+        if isinstance(mission, CompiledPlan):
+            Geofence.from_plan(mission).validate(mission)
+            mission_items = mission.to_mission_raw_items()
+        else:
+            mission_items = list(mission)
+        print(f"--- Uploading {len(mission_items)} items ---")
+        report = await self.mission_sync.upload(mission_items, current_index)
+        print(f"--> {report}")
+        if report.tail_only:
+            # The tail is renumbered from 0; point the vehicle at its start.
+            await self.system.mission.set_current_mission_item(0)
+        return report
+
+    @timed("drone.start_mission")
+    async def start_mission(self, start_index=0):
+        """
+        Starts the uploaded mission at item `start_index` (0: from the
+        beginning), once mission progress shows the vehicle has taken the
+        new current item.
+        """
+        print("--- Starting mission ---" if start_index == 0 else f"--- Starting mission at item {start_index} ---")
+        await self.system.mission.set_current_mission_item(start_index)
+        try:
+            await self.telemetry.wait_for("mission_progress",
+                                          lambda progress: progress.current == start_index,
+                                          SET_CURRENT_TIMEOUT_S)
+        except asyncio.TimeoutError:
+            print(f"--> Mission progress did not reach item {start_index} "
+                  f"within {SET_CURRENT_TIMEOUT_S:.0f}s, starting anyway")
         await self.system.mission.start_mission()
 
-    async def monitor_mission_progress(self):
-        """Monitors the mission progress and returns when complete."""
-        async for progress in self.system.mission.mission_progress():
+    async def _follow_mission_progress(self):
+        async for progress in self.telemetry.stream("mission_progress"):
             print(f"   [Mission] Waypoint {progress.current}/{progress.total}")
             if progress.current == progress.total:
                 print("-- Mission Complete")
                 break
 
+    @timed("drone.monitor_mission_progress")
+    async def monitor_mission_progress(self, fence=None):
+        """
+        Monitors the mission progress and returns when complete.
+
+        With a Geofence, live positions are checked against it as well and the
+        first BreachEvent is returned as soon as the drone leaves the allowed
+        area (None when the mission completes inside it).
+        """
+        if fence is None or len(fence) == 0:
+            await self._follow_mission_progress()
+            return None
+
+        from geofence import GeofenceMonitor
+        monitor = GeofenceMonitor(fence, self.telemetry)
+        progress = asyncio.create_task(self._follow_mission_progress())
+        breach = asyncio.create_task(monitor.wait_for_breach())
+        try:
+            await asyncio.wait({progress, breach}, return_when=asyncio.FIRST_COMPLETED)
+            return breach.result() if breach.done() else None
+        finally:
+            monitor.close()
+            for task in (progress, breach):
+                task.cancel()
+            await asyncio.gather(progress, breach, return_exceptions=True)
+
     async def is_mission_finished(self) -> bool:
         """Checks if the mission is finished."""
         return await self.system.mission.is_mission_finished()
 
+    @timed("drone.return_to_launch")
     async def return_to_launch(self):
         """Commands the drone to return to the launch position."""
         print("--- Returning to Launch ---")
         await self.system.action.return_to_launch()
 
+    @timed("drone.hold")
     async def hold(self):
         """Sets the drone to hold mode."""
         print("--- Setting to Hold Mode ---")
         await self.system.action.hold()
         print("--> Drone in Hold Mode")
 
+    @timed("drone.land")
     async def land(self):
         """Lands the drone."""
         print("--- Landing ---")
         await self.system.action.land()
-        async for in_air in self.system.telemetry.in_air():
-            if not in_air:
-                print("--> Drone Landed")
-                break
+        await self.wait_for_landed()
+        print("--> Drone Landed")
+
+    @timed("drone.wait_for_landed")
+    async def wait_for_landed(self):
+        """Waits until the drone reports it is on the ground."""
+        await self.telemetry.wait_for("in_air", lambda in_air: not in_air)
 
+    @timed("drone.disarm")
     async def disarm(self):
         """Disarms the drone."""
         print("--- Disarming ---")
         await self.system.action.disarm()
 
+    def start_recording(self, path):
+        """Starts writing position, attitude, velocity, battery and mission progress to a flight log."""
+        from flight_recorder import FlightRecorder
+        print(f"--- Recording flight to {path} ---")
+        self.recorder = FlightRecorder(path)
+        self.recorder.attach(self.telemetry)
+        return self.recorder
+
+    async def stop_recording(self):
+        """Flushes and closes the flight log, if one is open."""
+        if self.recorder is not None:
+            await self.recorder.close()
+            print(f"--> Recorded {self.recorder.samples_written} samples")
+            self.recorder = None
+
     async def shutdown(self):
         """Shuts down the connection to the drone."""
         print("--- Shutting down ---")
         # This is not a standard MAVSDK function, but represents disconnecting
         # The 'await self.system.connect()' doesn't have a clean disconnect,
         # the object just gets destroyed.
-        pass
+        await self.stop_recording()
+        if self.system is not None:
+            if self._mission_sync is not None:
+                await self._mission_sync.close()
+            await self.telemetry.close()
+        if self.metrics is not None:
+            self.metrics.flush()
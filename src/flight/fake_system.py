@@ -0,0 +1,699 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+import types
+from enum import Enum
+
+import numpy as np
+
+from geo import latlon_to_ne, ne_to_latlon
+from mav_codec import HOME_ITEMS, plan_to_raw
+from plan_compiler import (MAV_CMD_DO_CHANGE_SPEED, MAV_CMD_NAV_LAND, MAV_CMD_NAV_LOITER_TIME,
+                           MAV_CMD_NAV_RETURN_TO_LAUNCH, MAV_CMD_NAV_TAKEOFF,
+                           NAV_POSITION_COMMANDS, compile_plan)
+from params import ParamTable
+
+# ArduPilot SITL default home (CMAC), used when no home is given.
+DEFAULT_HOME = (-35.363262, 149.165237, 584.0)
+DEFAULT_PARM_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mav.parm")
+
+
+class FlightMode(Enum):
+    """Subset of mavsdk.telemetry.FlightMode with the same member names."""
+    UNKNOWN = 0
+    READY = 1
+    TAKEOFF = 2
+    HOLD = 3
+    MISSION = 4
+    RETURN_TO_LAUNCH = 5
+    LAND = 6
+
+
+class VehicleModel:
+    """Kinematic parameters of the simulated multicopter."""
+
+    def __init__(self, max_speed_m_s=10.0, max_accel_m_s2=3.0, climb_rate_m_s=3.0,
+                 descent_rate_m_s=1.5, land_rate_m_s=0.7, acceptance_radius_m=2.0,
+                 rtl_altitude_m=15.0, endurance_s=1200.0):
+        self.max_speed_m_s = max_speed_m_s
+        self.max_accel_m_s2 = max_accel_m_s2
+        self.climb_rate_m_s = climb_rate_m_s
+        self.descent_rate_m_s = descent_rate_m_s
+        self.land_rate_m_s = land_rate_m_s
+        self.acceptance_radius_m = acceptance_radius_m
+        self.rtl_altitude_m = rtl_altitude_m
+        self.endurance_s = endurance_s
+
+
+class VirtualClock:
+    """
+    Simulated time. Timers fire when the physics loop advances past them, and
+    the loop is paced so that simulated time runs `speedup` times faster than
+    wall time (`float('inf')` runs as fast as the event loop allows).
+    """
+
+    def __init__(self, speedup=100.0):
+        self.speedup = speedup
+        self.now = 0.0
+        self._timers = []
+        self._counter = itertools.count()
+        self._wall_start = None
+
+    async def sleep(self, seconds):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._timers, (self.now + seconds, next(self._counter), future))
+        await future
+
+    def advance(self, dt):
+        self.now += dt
+        while self._timers and self._timers[0][0] <= self.now:
+            _, _, future = heapq.heappop(self._timers)
+            if not future.done():
+                future.set_result(None)
+
+    async def pace(self):
+        """Yields to the event loop, sleeping if simulated time is ahead of schedule."""
+        if self._wall_start is None:
+            self._wall_start = time.monotonic()
+        if math.isinf(self.speedup):
+            await asyncio.sleep(0)
+            return
+        ahead = self._wall_start + self.now / self.speedup - time.monotonic()
+        await asyncio.sleep(max(ahead, 0.0))
+
+
+class FakeMissionRawItem:
+    """Same fields as mavsdk.mission_raw.MissionItem."""
+
+    def __init__(self, seq, frame, command, current, autocontinue, param1, param2, param3,
+                 param4, x, y, z, mission_type=0):
+        self.seq = seq
+        self.frame = frame
+        self.command = command
+        self.current = current
+        self.autocontinue = autocontinue
+        self.param1 = param1
+        self.param2 = param2
+        self.param3 = param3
+        self.param4 = param4
+        self.x = x
+        self.y = y
+        self.z = z
+        self.mission_type = mission_type
+
+    def __eq__(self, other):
+        return vars(self) == vars(other)
+
+
+class _Step:
+    """One mission item as the simulator executes it."""
+
+    def __init__(self, command, lat=float("nan"), lon=float("nan"), alt=float("nan"),
+                 speed=float("nan"), fly_through=True, acceptance=float("nan"), loiter_s=0.0):
+        self.command = command
+        self.lat = lat
+        self.lon = lon
+        self.alt = alt
+        self.speed = speed
+        self.fly_through = fly_through
+        self.acceptance = acceptance
+        self.loiter_s = loiter_s
+
+
+def _step_from_raw(item):
+    command = item.command
+    if command in NAV_POSITION_COMMANDS:
+        return _Step(command, item.x / 1e7, item.y / 1e7, item.z,
+                     fly_through=item.param1 == 0 and command != MAV_CMD_NAV_LOITER_TIME,
+                     acceptance=item.param2 if item.param2 > 0 else float("nan"),
+                     loiter_s=item.param1 if command == MAV_CMD_NAV_LOITER_TIME else 0.0)
+    if command == MAV_CMD_NAV_TAKEOFF:
+        return _Step(command, alt=item.z)
+    if command == MAV_CMD_DO_CHANGE_SPEED:
+        return _Step(command, speed=item.param2)
+    return _Step(command)
+
+
+def _step_from_mission_item(item):
+    action = getattr(item.vehicle_action, "name", str(item.vehicle_action))
+    if action == "TAKEOFF":
+        return _Step(MAV_CMD_NAV_TAKEOFF, alt=item.relative_altitude_m)
+    if action == "LAND":
+        return _Step(MAV_CMD_NAV_LAND, item.latitude_deg, item.longitude_deg, 0.0)
+    loiter = item.loiter_time_s if not math.isnan(item.loiter_time_s) else 0.0
+    return _Step(16, item.latitude_deg, item.longitude_deg, item.relative_altitude_m,
+                 speed=item.speed_m_s, fly_through=item.is_fly_through and loiter == 0.0,
+                 acceptance=item.acceptance_radius_m, loiter_s=loiter)
+
+
+class _Vehicle:
+    """Point-mass multicopter state in metres north/east/up of home."""
+
+    def __init__(self, home, model):
+        self.home = home
+        self.model = model
+        self.pos = np.zeros(3)
+        self.vel = np.zeros(3)
+        self.armed = False
+        self.in_air = False
+        self.mode = FlightMode.READY
+        self.battery = 1.0
+        self.takeoff_altitude = 2.5
+        self.target = None          # (north, east, up) or None to stop in place
+        self.target_speed = model.max_speed_m_s
+        self.fly_through = False
+        self.corner_speed = 0.0     # Speed to pass a fly-through target at
+        self.corner_step = None     # Mission step corner_speed was computed for
+        self.actuators = {}
+
+        self.steps = []
+        self.current = 0
+        self.mission_speed = float("nan")
+        self.loiter_left = None
+        self.rtl_after_mission = False
+
+    def target_from_latlon(self, lat, lon, alt):
+        north, east = latlon_to_ne(lat, lon, self.home[0], self.home[1])
+        return np.array([float(north), float(east), alt])
+
+    def reached(self, acceptance):
+        if self.target is None:
+            return True
+        horizontal = math.hypot(*(self.target[:2] - self.pos[:2]))
+        return horizontal <= acceptance and abs(self.target[2] - self.pos[2]) < 1.0
+
+    def step(self, dt):
+        model = self.model
+        if self.in_air:
+            self.battery = max(self.battery - dt / model.endurance_s, 0.0)
+
+        if not self.in_air:
+            self.vel[:] = 0.0
+            return
+
+        if self.target is None:
+            desired_h = np.zeros(2)
+            desired_up = 0.0
+        else:
+            delta = self.target[:2] - self.pos[:2]
+            distance = math.hypot(*delta)
+            speed = self.target_speed
+            corner = self.corner_speed if self.fly_through else 0.0
+            speed = min(speed, math.sqrt(corner * corner + 2.0 * model.max_accel_m_s2 * distance))
+            desired_h = delta / distance * speed if distance > 1e-6 else np.zeros(2)
+            climb = self.target[2] - self.pos[2]
+            desired_up = float(np.clip(climb * 1.5, -model.descent_rate_m_s, model.climb_rate_m_s))
+
+        if self.mode == FlightMode.LAND:
+            desired_up = -model.land_rate_m_s if self.pos[2] > 5 else -model.land_rate_m_s * 0.5
+
+        change = desired_h - self.vel[:2]
+        limit = model.max_accel_m_s2 * dt
+        norm = math.hypot(*change)
+        if norm > limit:
+            change *= limit / norm
+        self.vel[:2] += change
+        self.vel[2] = desired_up
+        self.pos += self.vel * dt
+
+        if self.pos[2] <= 0.0 and self.vel[2] <= 0.0 and self.mode in (FlightMode.LAND,
+                                                                       FlightMode.RETURN_TO_LAUNCH):
+            self.pos[2] = 0.0
+            self.vel[:] = 0.0
+            self.in_air = False
+            self.armed = False  # ArduPilot disarms automatically after landing.
+            self.mode = FlightMode.READY
+            self.target = None
+
+
+class _Core:
+    def __init__(self, system):
+        self._system = system
+
+    async def connection_state(self):
+        while True:
+            yield types.SimpleNamespace(uuid=1, is_connected=self._system._running)
+            await self._system.clock.sleep(1.0)
+
+
+class _Info:
+    def __init__(self, system):
+        self._system = system
+
+    async def get_identification(self):
+        return types.SimpleNamespace(hardware_uid=self._system.hardware_uid, legacy_uid=0)
+
+
+class _Action:
+    def __init__(self, system):
+        self._system = system
+        self._vehicle = system.vehicle
+
+    async def arm(self):
+        self._vehicle.armed = True
+
+    async def disarm(self):
+        if self._vehicle.in_air:
+            raise RuntimeError("Cannot disarm in air")
+        self._vehicle.armed = False
+
+    async def set_takeoff_altitude(self, altitude):
+        self._vehicle.takeoff_altitude = altitude
+
+    async def get_takeoff_altitude(self):
+        return self._vehicle.takeoff_altitude
+
+    async def set_maximum_speed(self, speed):
+        self._vehicle.model.max_speed_m_s = speed
+
+    async def takeoff(self):
+        vehicle = self._vehicle
+        if not vehicle.armed:
+            raise RuntimeError("Takeoff requires the vehicle to be armed")
+        vehicle.in_air = True
+        vehicle.mode = FlightMode.TAKEOFF
+        vehicle.target = np.array([vehicle.pos[0], vehicle.pos[1], vehicle.takeoff_altitude])
+        vehicle.fly_through = False
+
+    async def land(self):
+        vehicle = self._vehicle
+        vehicle.mode = FlightMode.LAND
+        vehicle.target = np.array([vehicle.pos[0], vehicle.pos[1], 0.0])
+
+    async def hold(self):
+        vehicle = self._vehicle
+        vehicle.mode = FlightMode.HOLD
+        vehicle.target = None
+
+    async def return_to_launch(self):
+        self._system._start_rtl()
+
+    async def set_actuator(self, index, value):
+        self._vehicle.actuators[index] = value
+
+
+class _Telemetry:
+    def __init__(self, system, rate_hz):
+        self._system = system
+        self._vehicle = system.vehicle
+        self._period = 1.0 / rate_hz
+
+    async def _periodic(self, make_value, period=None):
+        period = self._period if period is None else period
+        while True:
+            yield make_value()
+            await self._system.clock.sleep(period)
+
+    def health(self):
+        return self._periodic(lambda: types.SimpleNamespace(
+            is_gyrometer_calibration_ok=True, is_accelerometer_calibration_ok=True,
+            is_magnetometer_calibration_ok=True, is_local_position_ok=True,
+            is_global_position_ok=True, is_home_position_ok=True, is_armable=True), 1.0)
+
+    def armed(self):
+        return self._periodic(lambda: self._vehicle.armed)
+
+    def in_air(self):
+        return self._periodic(lambda: self._vehicle.in_air)
+
+    def flight_mode(self):
+        return self._periodic(lambda: self._vehicle.mode)
+
+    def position(self):
+        return self._periodic(self._system._position)
+
+    def home(self):
+        home = self._system.home
+        return self._periodic(lambda: types.SimpleNamespace(
+            latitude_deg=home[0], longitude_deg=home[1],
+            absolute_altitude_m=home[2], relative_altitude_m=0.0), 1.0)
+
+    def velocity_ned(self):
+        vel = self._vehicle.vel
+        return self._periodic(lambda: types.SimpleNamespace(
+            north_m_s=float(vel[0]), east_m_s=float(vel[1]), down_m_s=float(-vel[2])))
+
+    def attitude_euler(self):
+        return self._periodic(self._system._attitude)
+
+    def battery(self):
+        return self._periodic(lambda: types.SimpleNamespace(
+            id=0, temperature_degc=float("nan"),
+            voltage_v=13.2 + 3.6 * self._vehicle.battery,
+            current_battery_a=float("nan"), capacity_consumed_ah=float("nan"),
+            remaining_percent=100.0 * self._vehicle.battery), 1.0)
+
+
+class _Mission:
+    """Shared mission state behind both the mission and mission_raw plugins."""
+
+    def __init__(self, system):
+        self._system = system
+        self._vehicle = system.vehicle
+        self.raw_items = []
+
+    async def start_mission(self):
+        vehicle = self._vehicle
+        if not vehicle.armed:
+            raise RuntimeError("Mission start requires the vehicle to be armed")
+        vehicle.mode = FlightMode.MISSION
+        vehicle.target = None
+
+    async def pause_mission(self):
+        await self._system.action.hold()
+
+    async def clear_mission(self):
+        self._system._load_steps([], [])
+
+    async def set_current_mission_item(self, index):
+        self._vehicle.current = index
+        self._vehicle.loiter_left = None
+        self._vehicle.corner_step = None
+
+    async def is_mission_finished(self):
+        vehicle = self._vehicle
+        return len(vehicle.steps) > 0 and vehicle.current >= len(vehicle.steps)
+
+    async def set_return_to_launch_after_mission(self, enable):
+        self._vehicle.rtl_after_mission = enable
+
+    async def mission_progress(self):
+        last = None
+        while True:
+            progress = (self._vehicle.current, len(self._vehicle.steps))
+            if progress != last:
+                last = progress
+                yield types.SimpleNamespace(current=progress[0], total=progress[1])
+            await self._system.clock.sleep(self._system.telemetry._period)
+
+    async def mission_changed(self):
+        last = self._system._mission_version
+        while True:
+            await self._system.clock.sleep(self._system.telemetry._period)
+            if self._system._mission_version != last:
+                last = self._system._mission_version
+                yield True
+
+
+class _MissionPlugin(_Mission):
+    async def upload_mission(self, mission_plan):
+        items = list(mission_plan.mission_items)
+        self._system._load_steps([_step_from_mission_item(item) for item in items], [])
+        self.mission_items = items
+
+    async def download_mission(self):
+        return types.SimpleNamespace(mission_items=list(getattr(self, "mission_items", [])))
+
+
+class _MissionRawPlugin(_Mission):
+    async def upload_mission(self, mission_items):
+        self._system._load_raw(mission_items)
+
+    async def download_mission(self):
+        return list(self._system._raw_items)
+
+    async def import_qgroundcontrol_mission(self, qgc_plan_path):
+        plan = compile_plan(qgc_plan_path)
+        return types.SimpleNamespace(mission_items=compiled_plan_raw_items(plan),
+                                     geofence_items=[], rally_items=[])
+
+
+class _Param:
+    """Parameter store seeded from a .parm file (the repo's mav.parm by default)."""
+
+    def __init__(self, system, parm_file):
+        self._system = system
+        self.values = {}
+        self.is_int = {}
+        if parm_file is not None:
+            for name, value in ParamTable.from_file(parm_file).items():
+                self.values[name] = value
+                self.is_int[name] = isinstance(value, int)
+
+    async def _round_trip(self):
+        await self._system.clock.sleep(self._system.telemetry._period)
+
+    async def get_all_params(self):
+        await self._round_trip()
+        params = [types.SimpleNamespace(name=name, value=value) for name, value in self.values.items()]
+        return types.SimpleNamespace(
+            int_params=[p for p in params if self.is_int[p.name]],
+            float_params=[p for p in params if not self.is_int[p.name]],
+            custom_params=[])
+
+    async def _get(self, name, is_int):
+        await self._round_trip()
+        if name not in self.values or self.is_int[name] != is_int:
+            raise KeyError(name)
+        return self.values[name]
+
+    async def _set(self, name, value, is_int):
+        await self._round_trip()
+        if name not in self.values or self.is_int[name] != is_int:
+            raise KeyError(name)
+        self.values[name] = value
+
+    async def get_param_int(self, name):
+        return await self._get(name, True)
+
+    async def get_param_float(self, name):
+        return await self._get(name, False)
+
+    async def set_param_int(self, name, value):
+        await self._set(name, int(value), True)
+
+    async def set_param_float(self, name, value):
+        await self._set(name, float(value), False)
+
+
+def compiled_plan_raw_items(plan):
+    """Like CompiledPlan.to_mission_raw_items, but returns FakeMissionRawItem objects."""
+    return plan_to_raw(plan, FakeMissionRawItem)
+
+
+class FakeSystem:
+    """
+    In-process stand-in for mavsdk.System backed by a point-mass vehicle.
+
+    Covers the core, info, action, telemetry, mission, mission_raw and param
+    calls used by this repo. Like ArduPilot, a raw mission's seq 0 is home,
+    and mission progress counts the items after it. Physics is integrated
+    every `dt` simulated seconds on a VirtualClock, so missions run `speedup`
+    times faster than real time without SITL, MAVProxy or mavsdk_server.
+    """
+
+    _uids = itertools.count(1)
+
+    def __init__(self, home=DEFAULT_HOME, speedup=100.0, dt=0.05, telemetry_rate_hz=10.0,
+                 model=None, parm_file=DEFAULT_PARM_FILE, hardware_uid=None):
+        self.home = tuple(home)
+        # Each instance is a different autopilot unless told otherwise.
+        self.hardware_uid = hardware_uid or f"fake{os.getpid():08x}{next(self._uids):020x}"
+        self.dt = dt
+        self.clock = VirtualClock(speedup)
+        self.vehicle = _Vehicle(self.home, model or VehicleModel())
+        self._running = False
+        self._task = None
+        self._raw_items = []
+        self._mission_version = 0
+
+        self.core = _Core(self)
+        self.info = _Info(self)
+        self.action = _Action(self)
+        self.telemetry = _Telemetry(self, telemetry_rate_hz)
+        self.mission = _MissionPlugin(self)
+        self.mission_raw = _MissionRawPlugin(self)
+        self.param = _Param(self, parm_file)
+
+    async def connect(self, system_address=None, **kwargs):
+        if self._task is None:
+            self._running = True
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        self._running = False
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            self._advance_mission()
+            self.vehicle.step(self.dt)
+            self.clock.advance(self.dt)
+            await self.clock.pace()
+
+    def _load_steps(self, steps, raw_items):
+        vehicle = self.vehicle
+        vehicle.steps = steps
+        vehicle.current = 0
+        vehicle.loiter_left = None
+        vehicle.corner_step = None
+        vehicle.mission_speed = float("nan")
+        self._raw_items = raw_items
+
+    def _load_raw(self, raw_items):
+        """
+        Loads raw items as ArduPilot does: seq 0 is home and is not flown,
+        and is replaced by the vehicle's own home.
+        """
+        items = list(raw_items)
+        if items:
+            home = items[0]
+            items[0] = FakeMissionRawItem(home.seq, home.frame, home.command, home.current,
+                                          home.autocontinue, home.param1, home.param2,
+                                          home.param3, home.param4, round(self.home[0] * 1e7),
+                                          round(self.home[1] * 1e7), self.home[2],
+                                          home.mission_type)
+        self._load_steps([_step_from_raw(item) for item in items[HOME_ITEMS:]], items)
+
+    def external_upload(self, raw_items):
+        """Replaces the mission as another ground station would, firing mission_changed."""
+        self._load_raw(raw_items)
+        self._mission_version += 1
+
+    def _start_rtl(self):
+        vehicle = self.vehicle
+        vehicle.mode = FlightMode.RETURN_TO_LAUNCH
+        vehicle.target = np.array([0.0, 0.0, max(vehicle.pos[2], vehicle.model.rtl_altitude_m)])
+        vehicle.target_speed = vehicle.model.max_speed_m_s
+        vehicle.fly_through = False
+
+    def _corner_speed(self, speed):
+        """
+        Speed to pass the current target at. Each fly-through corner ahead
+        is slowed in proportion to its turn (the rule mission_estimator
+        uses) and to no more than lets the turn finish within the acceptance
+        radius, as ArduCopter rounds corners instead of overshooting them;
+        corners too close ahead to brake for lower the speed here as well.
+        """
+        vehicle = self.vehicle
+        model = vehicle.model
+        points = [vehicle.pos[:2], vehicle.target[:2]]
+        stops = [True]
+        braking_m = speed * speed / (2.0 * model.max_accel_m_s2)
+        ahead_m = 0.0
+        for step in vehicle.steps[vehicle.current + 1:]:
+            if step.command not in NAV_POSITION_COMMANDS:
+                if step.command in (MAV_CMD_NAV_TAKEOFF, MAV_CMD_NAV_RETURN_TO_LAUNCH, MAV_CMD_NAV_LAND):
+                    break
+                continue  # DO items run without stopping.
+            point = vehicle.target_from_latlon(step.lat, step.lon, step.alt)[:2]
+            ahead_m += math.hypot(*(point - points[-1]))
+            points.append(point)
+            stops.append(not step.fly_through)
+            if stops[-1] or ahead_m > braking_m:
+                break
+        allowed = 0.0 if len(points) == 2 or stops[-1] else speed
+        for i in range(len(points) - 2, 0, -1):
+            before, after = points[i] - points[i - 1], points[i + 1] - points[i]
+            corner = speed
+            if math.hypot(*before) > 1e-6 and math.hypot(*after) > 1e-6:
+                turn = abs((math.atan2(after[1], after[0]) - math.atan2(before[1], before[0]) + math.pi)
+                           % (2 * math.pi) - math.pi)
+                if turn > 1e-6:
+                    rounded = math.sqrt(model.acceptance_radius_m * model.max_accel_m_s2
+                                        / math.sin(turn / 2))
+                    corner = min(speed * (1.0 - turn / math.pi), rounded)
+            reachable = math.sqrt(allowed * allowed + 2.0 * model.max_accel_m_s2 * math.hypot(*after))
+            allowed = min(corner, reachable)
+        return allowed
+
+    def _advance_mission(self):
+        vehicle = self.vehicle
+        model = vehicle.model
+
+        if vehicle.mode == FlightMode.TAKEOFF and vehicle.reached(model.acceptance_radius_m):
+            vehicle.mode = FlightMode.HOLD
+        elif vehicle.mode == FlightMode.RETURN_TO_LAUNCH and vehicle.target[2] > 0:
+            if vehicle.reached(model.acceptance_radius_m):
+                vehicle.target = np.array([0.0, 0.0, 0.0])
+                vehicle.mode = FlightMode.LAND
+        if vehicle.mode != FlightMode.MISSION:
+            return
+
+        # Run through DO items and reached nav items within a single tick.
+        while vehicle.current < len(vehicle.steps):
+            step = vehicle.steps[vehicle.current]
+            if step.command == MAV_CMD_DO_CHANGE_SPEED:
+                vehicle.mission_speed = step.speed
+            elif step.command == MAV_CMD_NAV_TAKEOFF:
+                if not vehicle.in_air:
+                    vehicle.in_air = True
+                vehicle.target = np.array([vehicle.pos[0], vehicle.pos[1], step.alt])
+                vehicle.fly_through = False
+                if vehicle.pos[2] < step.alt * 0.95:
+                    return
+            elif step.command == MAV_CMD_NAV_RETURN_TO_LAUNCH:
+                vehicle.current += 1
+                self._start_rtl()
+                return
+            elif step.command in NAV_POSITION_COMMANDS or step.command == MAV_CMD_NAV_LAND:
+                vehicle.in_air = True
+                if step.command == MAV_CMD_NAV_LAND:
+                    vehicle.current += 1
+                    vehicle.mode = FlightMode.LAND
+                    vehicle.target = vehicle.target_from_latlon(step.lat, step.lon, 0.0)
+                    return
+                vehicle.target = vehicle.target_from_latlon(step.lat, step.lon, step.alt)
+                speed = step.speed if not math.isnan(step.speed) else vehicle.mission_speed
+                vehicle.target_speed = speed if not math.isnan(speed) else model.max_speed_m_s
+                vehicle.fly_through = step.fly_through
+                if vehicle.corner_step != vehicle.current:
+                    vehicle.corner_step = vehicle.current
+                    vehicle.corner_speed = self._corner_speed(vehicle.target_speed) if step.fly_through else 0.0
+                acceptance = (step.acceptance if not math.isnan(step.acceptance)
+                              else model.acceptance_radius_m)
+                if not vehicle.reached(acceptance):
+                    return
+                if step.loiter_s > 0:
+                    if vehicle.loiter_left is None:
+                        vehicle.loiter_left = step.loiter_s
+                    vehicle.loiter_left -= self.dt
+                    if vehicle.loiter_left > 0:
+                        return
+                    vehicle.loiter_left = None
+            vehicle.current += 1
+
+        # Mission complete: hover at the last waypoint like ArduPilot AUTO does.
+        vehicle.fly_through = False
+        if vehicle.rtl_after_mission and vehicle.steps:
+            self._start_rtl()
+
+    def _position(self):
+        vehicle = self.vehicle
+        lat, lon = ne_to_latlon(vehicle.pos[0], vehicle.pos[1], self.home[0], self.home[1])
+        return types.SimpleNamespace(latitude_deg=float(lat), longitude_deg=float(lon),
+                                     absolute_altitude_m=self.home[2] + float(vehicle.pos[2]),
+                                     relative_altitude_m=float(vehicle.pos[2]))
+
+    def _attitude(self):
+        vel = self.vehicle.vel
+        yaw = math.degrees(math.atan2(vel[1], vel[0])) if math.hypot(vel[0], vel[1]) > 0.1 else 0.0
+        return types.SimpleNamespace(roll_deg=0.0, pitch_deg=0.0, yaw_deg=yaw,
+                                     timestamp_us=int(self.clock.now * 1e6))
+
+
+if __name__ == "__main__":
+    import sys
+
+    import missionPlan_flight
+
+    async def main(plan_file, speedup):
+        plan = compile_plan(plan_file)
+        system = FakeSystem(home=plan.home or DEFAULT_HOME, speedup=speedup)
+        started = time.monotonic()
+        await missionPlan_flight.run(plan_file, system=system)
+        wall = time.monotonic() - started
+        print(f"Simulated {system.clock.now:.1f}s of flight in {wall:.2f}s "
+              f"({system.clock.now / wall:.0f}x real time)")
+        await system.close()
+
+    if len(sys.argv) < 2:
+        print("usage: python fake_system.py <file.plan> [speedup]")
+        sys.exit(1)
+    asyncio.run(main(sys.argv[1], float(sys.argv[2]) if len(sys.argv) > 2 else float("inf")))
@@ -0,0 +1,277 @@
+import argparse
+import asyncio
+import time
+
+import numpy as np
+
+from connection_manager import DEFAULT_BASE_PORT, mavsdk_system, vehicle_address
+from coverage_planner import clip_lines, fence_polygons, from_track, plan_coverage, to_track
+from drone_actions import Drone
+from geo import latlon_to_ne, ne_to_latlon
+from plan_compiler import PlanError, compile_plan
+from sprayer_controller import LatencyStats
+
+# Samples used to integrate area across the field when choosing cut lines.
+AREA_SAMPLES = 2048
+
+# Altitude added per vehicle, so transit and return legs never share a height.
+DEFAULT_ALTITUDE_STEP_M = 3.0
+
+# Spacing of fake vehicles' launch points, east of the plan home.
+FAKE_LAUNCH_SPACING_M = 5.0
+
+
+def _clip_half_plane(ring, keep_above, limit):
+    """Sutherland-Hodgman clip of an (N, 2) ring to y >= limit (or y <= limit)."""
+    out = []
+    count = len(ring)
+    for i in range(count):
+        (x1, y1), (x2, y2) = ring[i], ring[(i + 1) % count]
+        in1 = y1 >= limit if keep_above else y1 <= limit
+        in2 = y2 >= limit if keep_above else y2 <= limit
+        if in1:
+            out.append((x1, y1))
+        if in1 != in2:
+            t = (limit - y1) / (y2 - y1)
+            out.append((x1 + t * (x2 - x1), limit))
+    return np.array(out).reshape(-1, 2)
+
+
+def split_field(polygon, count, heading_deg=0.0):
+    """
+    Splits a lat/lon polygon into `count` strips of equal area.
+
+    The cuts run parallel to `heading_deg`, the transect direction, so each
+    strip is flown as whole transects. Cut positions come from the
+    cumulative chord length of the polygon sampled across track in one
+    vectorized clip.
+
+    Returns:
+        A list of `count` (N, 2) lat/lon polygons.
+    """
+    polygon = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+    if count < 1:
+        raise ValueError("Need at least one vehicle")
+    if count == 1:
+        return [polygon]
+    ref_lat, ref_lon = polygon[:, 0].mean(), polygon[:, 1].mean()
+    north, east = latlon_to_ne(polygon[:, 0], polygon[:, 1], ref_lat, ref_lon)
+    along, across = to_track(north, east, heading_deg)
+    ring = np.column_stack((along, across))
+
+    ys = np.linspace(across.min(), across.max(), AREA_SAMPLES)
+    x_in, x_out, valid = clip_lines(ring, np.roll(ring, -1, axis=0), ys)
+    with np.errstate(invalid="ignore"):
+        chord = np.where(valid, x_out - x_in, 0.0).sum(axis=1)
+    area = np.concatenate(([0.0], np.cumsum(0.5 * (chord[1:] + chord[:-1]) * np.diff(ys))))
+    cuts = np.interp(area[-1] * np.arange(1, count) / count, area, ys)
+
+    strips = []
+    bounds = [None] + list(cuts) + [None]
+    for low, high in zip(bounds[:-1], bounds[1:]):
+        strip = ring
+        if low is not None:
+            strip = _clip_half_plane(strip, True, low)
+        if high is not None:
+            strip = _clip_half_plane(strip, False, high)
+        n, e = from_track(strip[:, 0], strip[:, 1], heading_deg)
+        lat, lon = ne_to_latlon(n, e, ref_lat, ref_lon)
+        strips.append(np.column_stack((lat, lon)))
+    return strips
+
+
+def plan_fleet(plan, count, swath_m, heading_deg=None, turn_radius_m=0.0,
+               altitude_step_m=DEFAULT_ALTITUDE_STEP_M, homes=None):
+    """
+    Plans one coverage mission per vehicle over a CompiledPlan's inclusion fence.
+
+    The sweep heading is chosen once for the whole field (unless given) and
+    every strip is planned at that heading, so the strips' transects line up.
+
+    Strips do not overlap, but the legs from the launch area to each strip
+    and the returns do cross. Vehicle i therefore flies at the plan's
+    altitude plus i * `altitude_step_m`, and no two vehicles share a height.
+    Keep the step small next to the spray altitude, since it changes each
+    vehicle's sprayed width a little. RTL_ALT on each vehicle decides the
+    return height and should be staggered the same way.
+
+    Each vehicle launches from its own entry in `homes` (lat, lon, alt),
+    which is where its route starts. By default they all start from the
+    plan home, which assumes the vehicles are laid out a few metres apart
+    there.
+
+    Returns:
+        A list of CoveragePlan, one per vehicle.
+    """
+    inclusion, exclusion = fence_polygons(plan)
+    if not inclusion:
+        raise PlanError("Plan has no inclusion geofence polygon to split")
+    if homes is None:
+        homes = [plan.home] * count
+    elif len(homes) != count:
+        raise ValueError(f"{len(homes)} homes for {count} vehicles")
+    waypoints = plan.waypoints()
+    altitude_m = float(np.median(waypoints[:, 2])) if len(waypoints) else 10.0
+    if heading_deg is None:
+        heading_deg = plan_coverage(inclusion[0], swath_m, turn_radius_m=turn_radius_m,
+                                    altitude_m=altitude_m, exclusions=exclusion).heading_deg
+    strips = split_field(inclusion[0], count, heading_deg)
+    return [plan_coverage(strip, swath_m, heading_deg, turn_radius_m,
+                          altitude_m + i * altitude_step_m, plan.cruise_speed, exclusion,
+                          home=home, geofence=plan.geofence)
+            for i, (strip, home) in enumerate(zip(strips, homes))]
+
+
+def launch_points(home, count, spacing_m=FAKE_LAUNCH_SPACING_M):
+    """`count` (lat, lon, alt) launch points in a row east of `home`."""
+    lat, lon = ne_to_latlon(np.zeros(count), spacing_m * np.arange(count), home[0], home[1])
+    return [(float(a), float(o), home[2]) for a, o in zip(lat, lon)]
+
+
+class Fleet:
+    """
+    Several Drones driven from one asyncio loop.
+
+    Each vehicle gets its own System and mavsdk_server port (base_port + i)
+    and its own address. Commands go to every vehicle at once with
+    asyncio.gather, and how long each one took is recorded per vehicle in
+    `latency`.
+    """
+
+    def __init__(self, addresses=None, count=None, base_port=DEFAULT_BASE_PORT,
+                 system_factory=None, systems=None):
+        if systems is not None:
+            count = len(systems)
+        elif addresses is not None:
+            count = len(addresses)
+        if not count:
+            raise ValueError("Fleet needs addresses, systems or a vehicle count")
+        addresses = list(addresses) if addresses is not None else [vehicle_address(i) for i in range(count)]
+        system_factory = system_factory or mavsdk_system
+        if systems is None:
+            systems = [system_factory(base_port + i) for i in range(count)]
+        self.drones = [Drone(system=system, connection_string=address)
+                       for system, address in zip(systems, addresses)]
+        self.latency = [LatencyStats() for _ in self.drones]
+        self.progress = [None] * len(self.drones)
+
+    def __len__(self):
+        return len(self.drones)
+
+    async def _timed(self, index, kind, coro):
+        started = time.monotonic()
+        try:
+            return await coro
+        finally:
+            self.latency[index].record(kind, (time.monotonic() - started) * 1000.0)
+
+    async def _each(self, kind, action):
+        """Runs action(drone) on every drone at once and returns the results in order."""
+        return await asyncio.gather(*(self._timed(i, kind, action(drone))
+                                      for i, drone in enumerate(self.drones)))
+
+    async def connect(self):
+        """Connects every drone; returns True only if all of them connected."""
+        print(f"--- Connecting {len(self)} drones ---")
+        return all(await self._each("connect", lambda drone: drone.connect()))
+
+    async def wait_for_readiness(self):
+        await self._each("ready", lambda drone: drone.wait_for_readiness())
+
+    async def upload(self, missions):
+        """Uploads one mission per drone (anything Drone.upload_mission accepts)."""
+        if len(missions) != len(self):
+            raise ValueError(f"{len(missions)} missions for {len(self)} drones")
+        pairs = dict(zip(self.drones, missions))
+        return await self._each("upload", lambda drone: drone.upload_mission(pairs[drone]))
+
+    async def start(self):
+        """Arms every drone and starts its mission."""
+        await self._each("arm", lambda drone: drone.arm())
+        await self._each("start", lambda drone: drone.start_mission())
+
+    async def _follow(self, index):
+        async for progress in self.drones[index].telemetry.stream("mission_progress"):
+            self.progress[index] = progress
+            if progress.total > 0 and progress.current >= progress.total:
+                return
+
+    async def monitor(self, report_interval_s=2.0):
+        """Prints combined progress until every drone has finished its mission."""
+        started = time.monotonic()
+        tasks = [asyncio.create_task(self._follow(i)) for i in range(len(self))]
+        try:
+            while not all(task.done() for task in tasks):
+                await asyncio.wait(tasks, timeout=report_interval_s)
+                print(f"   [Fleet] {self.summary()}")
+            for task in tasks:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        print(f"-- Fleet mission complete in {time.monotonic() - started:.1f}s")
+
+    def summary(self):
+        done = sum(p.current for p in self.progress if p is not None)
+        total = sum(p.total for p in self.progress if p is not None)
+        per_vehicle = " ".join(f"{p.current}/{p.total}" if p is not None else "-/-"
+                               for p in self.progress)
+        percent = 100.0 * done / total if total else 0.0
+        return f"{done}/{total} items ({percent:.0f}%) [{per_vehicle}]"
+
+    async def return_to_launch(self):
+        await self._each("rtl", lambda drone: drone.return_to_launch())
+        await self._each("landed", lambda drone: drone.wait_for_landed())
+        await self._each("disarm", lambda drone: drone.disarm())
+
+    async def shutdown(self):
+        await self._each("shutdown", lambda drone: drone.shutdown())
+
+    def report(self):
+        for i, stats in enumerate(self.latency):
+            for kind, values in stats.summary().items():
+                print(f"   [Drone {i}] {kind}: n={values['count']} p50={values['p50_ms']:.1f}ms "
+                      f"max={values['max_ms']:.1f}ms")
+
+
+async def run(plan_file, count, swath_m, addresses=None, systems=None, homes=None):
+    """Splits a plan's field across `count` drones and flies them together."""
+    plan = compile_plan(plan_file)
+    missions = plan_fleet(plan, count, swath_m, homes=homes)
+    for i, coverage in enumerate(missions):
+        print(f"Drone {i}: {coverage}, flying at {coverage.altitude_m:g}m")
+
+    fleet = Fleet(addresses, count, systems=systems)
+    if not await fleet.connect():
+        print("Failed to connect to every drone. Exiting.")
+        return
+    await fleet.wait_for_readiness()
+    await fleet.upload([coverage.to_compiled_plan() for coverage in missions])
+    await fleet.start()
+    await fleet.monitor()
+    await fleet.return_to_launch()
+    fleet.report()
+    await fleet.shutdown()
+    return fleet
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fly one field with several drones.")
+    parser.add_argument("plan", help="QGroundControl .plan file with an inclusion geofence")
+    parser.add_argument("--vehicles", type=int, default=2)
+    parser.add_argument("--swath", type=float, default=5.0, help="Transect spacing in metres")
+    parser.add_argument("--fake", action="store_true", help="Fly fake_system vehicles instead of SITL")
+    parser.add_argument("--speedup", type=float, default=100.0, help="Fake vehicle speedup")
+    args = parser.parse_args()
+
+    systems, homes = None, None
+    if args.fake:
+        from fake_system import DEFAULT_HOME, FakeSystem
+        homes = launch_points(compile_plan(args.plan).home or DEFAULT_HOME, args.vehicles)
+        systems = [FakeSystem(home=home, speedup=args.speedup) for home in homes]
+    asyncio.run(run(args.plan, args.vehicles, args.swath, systems=systems, homes=homes))
+
+
+if __name__ == "__main__":
+    main()
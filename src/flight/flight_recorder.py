@@ -0,0 +1,293 @@
+import asyncio
+import json
+import math
+import struct
+import time
+import types
+from enum import Enum
+
+import numpy as np
+
+from telemetry_hub import STREAMS, sample_fields
+
+# File layout:
+#   b"SPRAYLOG" | u32 header length | JSON header
+#   then any number of chunks:
+#   b"CHNK" | u16 stream id | u16 width | u32 count | float64[width + 1][count]
+# Chunk payloads are column-major: the timestamp column first, then one column
+# per field, so a reader can view every column in place.
+MAGIC = b"SPRAYLOG"
+FORMAT_VERSION = 1
+CHUNK_HEADER = struct.Struct("<4sHHI")
+CHUNK_MAGIC = b"CHNK"
+
+RECORDED_STREAMS = ("position", "attitude_euler", "velocity_ned", "battery", "mission_progress",
+                    "flight_mode", "armed", "in_air")
+
+# mavsdk.telemetry.FlightMode in value order; flight_mode is recorded by value
+# and replayed as a member of FlightMode below, so `.name` reads the same.
+FLIGHT_MODE_NAMES = ("UNKNOWN", "READY", "TAKEOFF", "HOLD", "MISSION", "RETURN_TO_LAUNCH", "LAND",
+                     "OFFBOARD", "FOLLOW_ME", "MANUAL", "ALTCTL", "POSCTL", "ACRO", "STABILIZED",
+                     "RATTITUDE")
+FlightMode = Enum("FlightMode", FLIGHT_MODE_NAMES, start=0)
+
+# Non-telemetry events recorded alongside the streams.
+EVENT_FIELDS = {
+    "spray": ("valve", "latitude_deg", "longitude_deg"),
+}
+
+# Fields that are integers on the MAVSDK side and are restored as such on replay.
+INTEGER_FIELDS = frozenset(("current", "total"))
+
+
+class _ChunkBuffer:
+    def __init__(self, stream_id, width, size):
+        self.stream_id = stream_id
+        self.columns = np.empty((width + 1, size))
+        self.count = 0
+
+
+class FlightRecorder:
+    """
+    Append-only columnar flight log.
+
+    Samples are copied into preallocated per-stream chunks; a chunk is written
+    when it fills up, and partial chunks are flushed every `flush_interval_s`
+    so a crash loses at most that much data.
+    """
+
+    def __init__(self, path, streams=RECORDED_STREAMS, chunk_size=1024, flush_interval_s=2.0):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.flush_interval_s = flush_interval_s
+        self.samples_written = 0
+
+        names = list(streams) + list(EVENT_FIELDS)
+        self._buffers = {}
+        header_streams = {}
+        for stream_id, name in enumerate(names):
+            fields = EVENT_FIELDS.get(name) or sample_fields(name)
+            header_streams[name] = {"id": stream_id, "fields": list(fields)}
+            self._buffers[name] = _ChunkBuffer(stream_id, len(fields), chunk_size)
+
+        header = json.dumps({
+            "version": FORMAT_VERSION,
+            "start_time": time.time(),
+            "start_monotonic": time.monotonic(),
+            "streams": header_streams,
+        }).encode()
+        self._file = open(path, "wb")
+        self._file.write(MAGIC + struct.pack("<I", len(header)) + header)
+        self._hub = None
+        self._flush_task = None
+
+    def record(self, name, timestamp, sample):
+        """Appends one sample; unknown stream names are ignored."""
+        buffer = self._buffers.get(name)
+        if buffer is None or self._file is None:
+            return
+        column = buffer.count
+        buffer.columns[0, column] = timestamp
+        buffer.columns[1:, column] = sample
+        buffer.count += 1
+        if buffer.count == self.chunk_size:
+            self._write_chunk(buffer)
+
+    def record_event(self, name, values):
+        """Records a non-telemetry event (see EVENT_FIELDS) stamped now."""
+        self.record(name, time.monotonic(), values)
+
+    def _write_chunk(self, buffer):
+        if buffer.count == 0:
+            return
+        columns = buffer.columns[:, :buffer.count]
+        self._file.write(CHUNK_HEADER.pack(CHUNK_MAGIC, buffer.stream_id,
+                                           columns.shape[0] - 1, buffer.count))
+        self._file.write(np.ascontiguousarray(columns).tobytes())
+        self.samples_written += buffer.count
+        buffer.count = 0
+
+    def flush(self):
+        """Writes every partial chunk and flushes the file."""
+        for buffer in self._buffers.values():
+            self._write_chunk(buffer)
+        self._file.flush()
+
+    def attach(self, hub):
+        """Starts recording every numeric sample published by a TelemetryHub."""
+        self._hub = hub
+        hub.add_listener(self.record)
+        for name in self._buffers:
+            if name in STREAMS:
+                hub.subscribe(name)
+        self._flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval_s)
+            self.flush()
+
+    async def close(self):
+        """Detaches from the hub, writes remaining samples and closes the file."""
+        if self._hub is not None:
+            self._hub.remove_listener(self.record)
+            self._hub = None
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+
+class FlightLog:
+    """
+    Read-only view of a recorded flight.
+
+    The file is memory-mapped and every chunk column is a zero-copy view;
+    `columns()` concatenates them only when asked for a whole stream.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._mmap = np.memmap(path, dtype=np.uint8, mode="r")
+        data = self._mmap
+        if bytes(data[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} is not a flight log")
+        header_len = struct.unpack_from("<I", data, len(MAGIC))[0]
+        offset = len(MAGIC) + 4
+        self.header = json.loads(bytes(data[offset:offset + header_len]))
+        offset += header_len
+
+        self.streams = self.header["streams"]
+        names_by_id = {info["id"]: name for name, info in self.streams.items()}
+        self._chunks = {name: [] for name in self.streams}
+        while offset + CHUNK_HEADER.size <= len(data):
+            magic, stream_id, width, count = CHUNK_HEADER.unpack_from(data, offset)
+            if magic != CHUNK_MAGIC:
+                raise ValueError(f"Corrupt chunk header at byte {offset} of {path}")
+            offset += CHUNK_HEADER.size
+            nbytes = (width + 1) * count * 8
+            if offset + nbytes > len(data):
+                break  # Truncated final chunk from an interrupted flight.
+            view = np.frombuffer(data, dtype=np.float64, count=(width + 1) * count, offset=offset)
+            self._chunks[names_by_id[stream_id]].append(view.reshape(width + 1, count))
+            offset += nbytes
+
+    @property
+    def start_monotonic(self) -> float:
+        return self.header["start_monotonic"]
+
+    def fields(self, name):
+        return tuple(self.streams[name]["fields"])
+
+    def chunks(self, name):
+        """Zero-copy (width + 1, count) column blocks for a stream, in order."""
+        return self._chunks.get(name, [])
+
+    def columns(self, name):
+        """Returns (timestamps, samples[count, width]) for a whole stream."""
+        chunks = self.chunks(name)
+        if not chunks:
+            return np.empty(0), np.empty((0, len(self.streams.get(name, {}).get("fields", ()))))
+        data = np.concatenate(chunks, axis=1)
+        return data[0], data[1:].T
+
+    def __len__(self):
+        return sum(chunk.shape[1] for chunks in self._chunks.values() for chunk in chunks)
+
+
+class _ReplayClock:
+    def __init__(self, log, speed):
+        self.speed = speed
+        chunks = [log.chunks(name) for name in log.streams if log.chunks(name)]
+        self.log_start = min(c[0][0, 0] for c in chunks) if chunks else 0.0
+        self.log_end = max(c[-1][0, -1] for c in chunks) if chunks else 0.0
+        self.wall_start = None
+
+    async def wait_until(self, log_time):
+        if self.wall_start is None:
+            self.wall_start = time.monotonic()
+        if math.isinf(self.speed):
+            await asyncio.sleep(0)
+            return
+        due = self.wall_start + (log_time - self.log_start) / self.speed
+        await asyncio.sleep(max(due - time.monotonic(), 0.0))
+
+
+class _ReplayPlugin:
+    """
+    Recorded streams of one plugin. Every stream ends with the log; a stream
+    the log does not have is empty, and any other call is a vehicle command,
+    which is accepted and logged in `commands` since the recorded flight
+    cannot react to it.
+    """
+
+    def __init__(self, log, clock, names, commands):
+        self._commands = commands
+        for name in names:
+            setattr(self, name, self._make_stream(log, clock, name))
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name in STREAMS:
+            async def stream():
+                return
+                yield
+            return stream
+
+        async def command(*args):
+            self._commands.append((name, args))
+        return command
+
+    @staticmethod
+    def _make_stream(log, clock, name):
+        fields = log.fields(name)
+        scalar = fields == ("value",)
+        integer = [field in INTEGER_FIELDS for field in fields]
+        convert = FlightMode if name == "flight_mode" else bool
+
+        async def stream():
+            for chunk in log.chunks(name):
+                for column in chunk.T:
+                    await clock.wait_until(column[0])
+                    if scalar:
+                        yield convert(int(column[1]))
+                    else:
+                        values = [int(v) if is_int else v
+                                  for v, is_int in zip(column[1:].tolist(), integer)]
+                        yield types.SimpleNamespace(**dict(zip(fields, values)))
+        return stream
+
+
+class ReplaySystem:
+    """
+    Plays a FlightLog back through the same async stream interfaces as
+    mavsdk.System (`telemetry.position()`, `mission.mission_progress()`, ...),
+    paced at `speed` times real time (`float('inf')` for as fast as possible).
+    It can be handed to a TelemetryHub or SprayerController for offline tuning.
+
+    Streams end when the log does, which ends TelemetryHub.stream() and a
+    SprayerController run; `wait_until_finished()` waits for the end of the
+    log itself. Commands sent to the vehicle are collected in `commands`.
+    """
+
+    def __init__(self, log, speed=1.0):
+        if isinstance(log, str):
+            log = FlightLog(log)
+        self.log = log
+        self.commands = []
+        self._clock = _ReplayClock(log, speed)
+        by_plugin = {}
+        for name in log.streams:
+            plugin = STREAMS[name][0] if name in STREAMS else "events"
+            by_plugin.setdefault(plugin, []).append(name)
+        for plugin in ("core", "telemetry", "mission", "action", "events"):
+            setattr(self, plugin, _ReplayPlugin(log, self._clock, by_plugin.get(plugin, ()), self.commands))
+
+    async def wait_until_finished(self):
+        """Returns once replay time reaches the last sample in the log."""
+        await self._clock.wait_until(self._clock.log_end)
@@ -0,0 +1,34 @@
+import numpy as np
+
+# Flat-earth conversions matching ArduPilot's Location class, so offsets agree
+# with what the autopilot computes on board over field-sized distances.
+LOCATION_SCALING_FACTOR = 0.011131884502145034  # metres per 1e-7 degree
+METERS_PER_DEGREE = LOCATION_SCALING_FACTOR * 1e7
+
+
+def longitude_scale(lat_deg):
+    """Cosine of latitude, clamped like ArduPilot to avoid blowing up at the poles."""
+    return np.maximum(np.cos(np.radians(lat_deg)), 0.01)
+
+
+def latlon_to_ne(lat, lon, ref_lat, ref_lon):
+    """
+    Converts lat/lon (degrees, scalars or arrays) to north/east metres from a reference.
+
+    Returns:
+        A (north, east) tuple of arrays with the broadcast shape of the inputs.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    north = (lat - ref_lat) * METERS_PER_DEGREE
+    east = (lon - ref_lon) * METERS_PER_DEGREE * longitude_scale((lat + ref_lat) * 0.5)
+    return north, east
+
+
+def ne_to_latlon(north, east, ref_lat, ref_lon):
+    """Inverse of `latlon_to_ne`: offsets a reference by north/east metres."""
+    north = np.asarray(north, dtype=np.float64)
+    east = np.asarray(east, dtype=np.float64)
+    lat = ref_lat + north / METERS_PER_DEGREE
+    lon = ref_lon + east / METERS_PER_DEGREE / longitude_scale((lat + ref_lat) * 0.5)
+    return lat, lon
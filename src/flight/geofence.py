@@ -0,0 +1,349 @@
+import asyncio
+import math
+import time
+
+import numpy as np
+
+from geo import METERS_PER_DEGREE, latlon_to_ne
+from plan_compiler import PlanError
+
+# Live positions may stray this far outside the allowed area (corner
+# overshoot, GPS noise) before they count as a breach.
+DEFAULT_BREACH_MARGIN_M = 1.0
+# Consecutive breached (or recovered) samples needed before an event is queued.
+DEFAULT_BREACH_SAMPLES = 3
+
+
+class GeofenceError(PlanError):
+    """Raised when a mission leaves its inclusion fences or enters an exclusion fence."""
+
+
+class _Polygon:
+    """Edge table of one fence polygon in local east/north metres."""
+
+    def __init__(self, east, north, inclusion, label):
+        self.inclusion = inclusion
+        self.label = label
+        self.x1, self.y1 = east, north
+        self.x2, self.y2 = np.roll(east, -1), np.roll(north, -1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # x of the edge per metre of y; horizontal edges are never crossed.
+            self.slope = np.where(self.y2 != self.y1, (self.x2 - self.x1) / (self.y2 - self.y1), 0.0)
+        self.bounds = (east.min(), east.max(), north.min(), north.max())
+        # Plain tuples for the scalar path, which is faster than numpy per point.
+        self.edges = list(zip(self.x1.tolist(), self.y1.tolist(), self.y2.tolist(), self.slope.tolist()))
+        self.segments = list(zip(self.x1.tolist(), self.y1.tolist(), self.x2.tolist(), self.y2.tolist()))
+
+    def edge_distance(self, x, y):
+        """(P,) distance in metres from each point to the nearest edge."""
+        x, y = x[:, None], y[:, None]
+        ex, ey = self.x2 - self.x1, self.y2 - self.y1
+        length_sq = ex * ex + ey * ey
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.clip(((x - self.x1) * ex + (y - self.y1) * ey) / length_sq, 0.0, 1.0)
+        t = np.where(length_sq > 0, t, 0.0)
+        return np.hypot(self.x1 + t * ex - x, self.y1 + t * ey - y).min(axis=1)
+
+    def edge_distance_point(self, x, y):
+        best = math.inf
+        for x1, y1, x2, y2 in self.segments:
+            ex, ey = x2 - x1, y2 - y1
+            length_sq = ex * ex + ey * ey
+            t = 0.0 if length_sq == 0 else min(max(((x - x1) * ex + (y - y1) * ey) / length_sq, 0.0), 1.0)
+            best = min(best, math.hypot(x1 + t * ex - x, y1 + t * ey - y))
+        return best
+
+    def contains(self, x, y):
+        """Even-odd test of (P,) points against every edge at once."""
+        x = x[:, None]
+        y = y[:, None]
+        crosses = (self.y1 <= y) != (self.y2 <= y)
+        hit = crosses & (x < self.x1 + (y - self.y1) * self.slope)
+        return (hit.sum(axis=1) & 1).astype(bool)
+
+    def contains_point(self, x, y):
+        x_min, x_max, y_min, y_max = self.bounds
+        if x < x_min or x > x_max or y < y_min or y > y_max:
+            return False
+        inside = False
+        for x1, y1, y2, slope in self.edges:
+            if (y1 <= y) != (y2 <= y) and x < x1 + (y - y1) * slope:
+                inside = not inside
+        return inside
+
+    def crossed_by(self, ax, ay, bx, by):
+        """(S,) mask of segments a->b that cross any edge."""
+        ax, ay, bx, by = ax[:, None], ay[:, None], bx[:, None], by[:, None]
+        ex, ey = self.x2 - self.x1, self.y2 - self.y1
+        dx, dy = bx - ax, by - ay
+        denom = dx * ey - dy * ex
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = ((self.x1 - ax) * ey - (self.y1 - ay) * ex) / denom
+            u = ((self.x1 - ax) * dy - (self.y1 - ay) * dx) / denom
+        return ((denom != 0) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)).any(axis=1)
+
+
+class _Circle:
+    def __init__(self, east, north, radius, inclusion, label):
+        self.x = float(east)
+        self.y = float(north)
+        self.radius = float(radius)
+        self.radius_sq = self.radius * self.radius
+        self.inclusion = inclusion
+        self.label = label
+
+    def contains(self, x, y):
+        return (x - self.x) ** 2 + (y - self.y) ** 2 <= self.radius_sq
+
+    def contains_point(self, x, y):
+        dx = x - self.x
+        dy = y - self.y
+        return dx * dx + dy * dy <= self.radius_sq
+
+    def edge_distance(self, x, y):
+        return np.abs(np.hypot(x - self.x, y - self.y) - self.radius)
+
+    def edge_distance_point(self, x, y):
+        return abs(math.hypot(x - self.x, y - self.y) - self.radius)
+
+    def crossed_by(self, ax, ay, bx, by):
+        """(S,) mask of segments that pass within the radius."""
+        dx, dy = bx - ax, by - ay
+        length_sq = dx * dx + dy * dy
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.clip(((self.x - ax) * dx + (self.y - ay) * dy) / length_sq, 0.0, 1.0)
+        t = np.where(length_sq > 0, t, 0.0)
+        return (ax + t * dx - self.x) ** 2 + (ay + t * dy - self.y) ** 2 <= self.radius_sq
+
+
+class FenceReport:
+    """Result of checking a mission against a Geofence."""
+
+    def __init__(self, rows, outside, crossing, labels, near_edge=None, margin_m=0.0):
+        self.rows = rows
+        self.outside = outside
+        self.crossing = crossing
+        self.labels = labels
+        self.near_edge = near_edge if near_edge is not None else np.zeros(len(rows), dtype=bool)
+        self.margin_m = margin_m
+
+    @property
+    def ok(self) -> bool:
+        return not self.outside.any() and not self.crossing.any()
+
+    def __str__(self):
+        if self.ok:
+            near = int(self.near_edge.sum())
+            if near:
+                return (f"All {len(self.rows)} waypoints inside the geofence, {near} within "
+                        f"{self.margin_m:g} m of its edge")
+            return f"All {len(self.rows)} waypoints inside the geofence"
+        lines = []
+        for i in np.flatnonzero(self.outside):
+            lines.append(f"Item {self.rows[i]} breaches {self.labels[i]}")
+        for i in np.flatnonzero(self.crossing):
+            lines.append(f"Leg from item {self.rows[i]} to item {self.rows[i + 1]} crosses the geofence")
+        return "\n".join(lines)
+
+
+class Geofence:
+    """
+    Inclusion and exclusion polygons and circles from a .plan geoFence.
+
+    Everything is converted once to east/north metres around the fence
+    centroid. A position is allowed when it is inside every inclusion fence
+    and outside every exclusion fence, as ArduPilot enforces it.
+    `check_mission` tests a whole mission in one call; `breach` tests a
+    single live sample in a few microseconds.
+    """
+
+    def __init__(self, geofence):
+        polygons = geofence.get("polygons", []) if geofence else []
+        circles = geofence.get("circles", []) if geofence else []
+        points = [np.asarray(p["polygon"], dtype=np.float64).reshape(-1, 2) for p in polygons]
+        centers = [np.asarray(c["circle"]["center"], dtype=np.float64) for c in circles]
+        all_points = np.concatenate(points + [c.reshape(1, 2) for c in centers] or [np.zeros((1, 2))])
+        self.ref_lat = float(all_points[:, 0].mean())
+        self.ref_lon = float(all_points[:, 1].mean())
+        self._lon_scale = METERS_PER_DEGREE * math.cos(math.radians(self.ref_lat))
+
+        self.fences = []
+        for i, (polygon, ring) in enumerate(zip(polygons, points)):
+            inclusion = polygon.get("inclusion", True)
+            north, east = latlon_to_ne(ring[:, 0], ring[:, 1], self.ref_lat, self.ref_lon)
+            kind = "inclusion" if inclusion else "exclusion"
+            self.fences.append(_Polygon(east, north, inclusion, f"{kind} polygon {i}"))
+        for i, (circle, center) in enumerate(zip(circles, centers)):
+            inclusion = circle.get("inclusion", True)
+            north, east = latlon_to_ne(center[0], center[1], self.ref_lat, self.ref_lon)
+            kind = "inclusion" if inclusion else "exclusion"
+            self.fences.append(_Circle(east, north, circle["circle"]["radius"], inclusion,
+                                       f"{kind} circle {i}"))
+
+    @classmethod
+    def from_plan(cls, plan):
+        """Builds the fence of a CompiledPlan."""
+        return cls(plan.geofence)
+
+    def __len__(self):
+        return len(self.fences)
+
+    def to_local(self, lat, lon):
+        """Vectorized lat/lon to (east, north) metres in the fence frame."""
+        north, east = latlon_to_ne(lat, lon, self.ref_lat, self.ref_lon)
+        return east, north
+
+    def contains(self, lat, lon):
+        """Boolean mask of the lat/lon arrays that are inside the allowed area."""
+        x, y = self.to_local(np.atleast_1d(lat), np.atleast_1d(lon))
+        allowed = np.ones(x.shape, dtype=bool)
+        for fence in self.fences:
+            inside = fence.contains(x, y)
+            allowed &= inside if fence.inclusion else ~inside
+        return allowed
+
+    def breach(self, lat, lon, margin_m=0.0):
+        """
+        Checks one position; returns the label of the first breached fence or
+        None. A position on the wrong side of a fence by at most `margin_m`
+        metres is not a breach. Uses a fixed longitude scale at the fence
+        centroid, which differs from `contains` by millimetres over a field.
+        """
+        x = (lon - self.ref_lon) * self._lon_scale
+        y = (lat - self.ref_lat) * METERS_PER_DEGREE
+        for fence in self.fences:
+            if fence.contains_point(x, y) != fence.inclusion:
+                if margin_m > 0 and fence.edge_distance_point(x, y) <= margin_m:
+                    continue
+                return fence.label
+        return None
+
+    def check_mission(self, plan, margin_m=DEFAULT_BREACH_MARGIN_M) -> FenceReport:
+        """
+        Checks every positional item of a CompiledPlan and every leg between
+        consecutive ones. Waypoints inside the fence but within `margin_m`
+        of an edge are reported in `near_edge`: the vehicle may overshoot
+        them by about that much in flight.
+        """
+        rows = np.flatnonzero(plan.waypoint_mask)
+        x, y = self.to_local(plan.lat[rows], plan.lon[rows])
+        labels = np.full(len(rows), "", dtype=object)
+        outside = np.zeros(len(rows), dtype=bool)
+        near_edge = np.zeros(len(rows), dtype=bool)
+        crossing = np.zeros(max(len(rows) - 1, 0), dtype=bool)
+        for fence in self.fences:
+            inside = fence.contains(x, y)
+            bad = inside != fence.inclusion
+            labels[bad & ~outside] = fence.label
+            outside |= bad
+            if margin_m > 0 and len(rows):
+                near_edge |= fence.edge_distance(x, y) <= margin_m
+            if len(rows) > 1:
+                crossing |= fence.crossed_by(x[:-1], y[:-1], x[1:], y[1:])
+        if len(rows) > 1:
+            # A leg that crosses an inclusion edge with both ends inside
+            # leaves and re-enters a concave fence; legs touching a bad end
+            # are already reported through that waypoint.
+            crossing &= ~outside[:-1] & ~outside[1:]
+        return FenceReport(rows, outside, crossing, labels, near_edge & ~outside, margin_m)
+
+    def validate(self, plan):
+        """Raises GeofenceError if any waypoint or leg of `plan` breaches the fence."""
+        report = self.check_mission(plan)
+        if not report.ok:
+            raise GeofenceError(str(report))
+        return report
+
+
+class BreachEvent:
+    """A change of fence state seen on live telemetry."""
+
+    def __init__(self, timestamp, latitude_deg, longitude_deg, fence):
+        self.timestamp = timestamp
+        self.latitude_deg = latitude_deg
+        self.longitude_deg = longitude_deg
+        self.fence = fence
+
+    @property
+    def breached(self) -> bool:
+        return self.fence is not None
+
+    def __str__(self):
+        where = f"{self.latitude_deg:.7f}, {self.longitude_deg:.7f}"
+        return f"Breached {self.fence} at {where}" if self.breached else f"Back inside the geofence at {where}"
+
+
+class GeofenceMonitor:
+    """
+    Checks every position sample published by a TelemetryHub against a
+    Geofence and queues a BreachEvent whenever the vehicle leaves or
+    re-enters the allowed area.
+
+    A sample up to `margin_m` outside a fence is still inside, and the
+    state only changes after `samples` consecutive samples agree, so
+    transects that ride the field edge and single GPS outliers do not abort
+    a mission. Edge-riding waypoints are reported at plan time by
+    Geofence.check_mission instead.
+    """
+
+    def __init__(self, fence, hub, queue_size=16, margin_m=DEFAULT_BREACH_MARGIN_M,
+                 samples=DEFAULT_BREACH_SAMPLES):
+        self.fence = fence
+        self.hub = hub
+        self.margin_m = margin_m
+        self.samples = max(int(samples), 1)
+        self.current = None
+        self.checks = 0
+        self._queue = asyncio.Queue(queue_size)
+        self._last = None
+        self._pending = None
+        self._pending_count = 0
+        hub.add_listener(self._on_sample)
+        hub.subscribe("position")
+
+    def _on_sample(self, name, timestamp, sample):
+        if name != "position":
+            return
+        self.checks += 1
+        breached = self.fence.breach(sample[0], sample[1], self.margin_m)
+        if breached == self._last:
+            self._pending_count = 0
+            return
+        if breached != self._pending:
+            self._pending = breached
+            self._pending_count = 0
+        self._pending_count += 1
+        if self._pending_count < self.samples:
+            return
+        self._pending_count = 0
+        self._last = breached
+        self.current = breached
+        if self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait(BreachEvent(timestamp, sample[0], sample[1], breached))
+
+    async def events(self):
+        """Async iterator over breach and recovery events."""
+        while True:
+            yield await self._queue.get()
+
+    async def wait_for_breach(self):
+        """Returns the next event that reports a breach."""
+        async for event in self.events():
+            if event.breached:
+                return event
+
+    def close(self):
+        self.hub.remove_listener(self._on_sample)
+
+
+def benchmark(fence, samples=100000):
+    """Returns the mean seconds per `breach` call over random points near the fence."""
+    rng = np.random.default_rng(0)
+    lat = fence.ref_lat + rng.uniform(-0.002, 0.002, samples)
+    lon = fence.ref_lon + rng.uniform(-0.002, 0.002, samples)
+    points = list(zip(lat.tolist(), lon.tolist()))
+    started = time.perf_counter()
+    for point_lat, point_lon in points:
+        fence.breach(point_lat, point_lon)
+    return (time.perf_counter() - started) / samples
@@ -0,0 +1,232 @@
+import bisect
+import functools
+import json
+import os
+import time
+
+# Histogram bucket upper bounds in milliseconds, from sub-millisecond
+# callbacks to minute-long waits for takeoff or landing.
+DEFAULT_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500,
+                     1000, 2500, 5000, 10000, 30000, 60000, 120000, 300000)
+METRIC_PREFIX = "sprayer"
+
+
+class Histogram:
+    """Fixed-bucket latency histogram in milliseconds (the last bucket is +Inf)."""
+
+    def __init__(self, bounds=DEFAULT_BOUNDS_MS):
+        self.bounds = tuple(bounds)
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, ms):
+        self.buckets[bisect.bisect_left(self.bounds, ms)] += 1
+        self.count += 1
+        self.sum += ms
+        if ms < self.min:
+            self.min = ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th percentile, capped at the maximum."""
+        if self.count == 0:
+            return 0.0
+        rank = q / 100.0 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum_ms": self.sum,
+            "min_ms": self.min if self.count else 0.0,
+            "max_ms": self.max,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "bounds_ms": list(self.bounds),
+            "buckets": list(self.buckets),
+        }
+
+
+class _Timer:
+    __slots__ = ("metrics", "name", "started")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, (time.monotonic() - self.started) * 1000.0)
+        return False
+
+
+class Metrics:
+    """
+    Latency histograms and counters, written to pluggable sinks on flush().
+
+    Names are "<family>.<name>", e.g. "drone.arm" or "wait_for.armed".
+    Collectors are callables returning {counter name: value}, read at each
+    snapshot, so counters kept elsewhere (the TelemetryHub's per-stream
+    message counts) cost nothing until they are exported.
+    """
+
+    def __init__(self, sinks=(), bounds=DEFAULT_BOUNDS_MS):
+        self.sinks = list(sinks)
+        self.bounds = bounds
+        self.histograms = {}
+        self.counters = {}
+        self._collectors = []
+
+    def observe(self, name, ms):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(self.bounds)
+        histogram.observe(ms)
+
+    def timer(self, name):
+        """Context manager recording the time spent inside it under `name`."""
+        return _Timer(self, name)
+
+    def increment(self, name, count=1):
+        self.counters[name] = self.counters.get(name, 0) + count
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def snapshot(self):
+        counters = dict(self.counters)
+        for collector in self._collectors:
+            counters.update(collector())
+        return {
+            "time": time.time(),
+            "histograms": {name: h.to_dict() for name, h in sorted(self.histograms.items())},
+            "counters": dict(sorted(counters.items())),
+        }
+
+    def flush(self):
+        """Writes a snapshot to every sink."""
+        snapshot = self.snapshot()
+        for sink in self.sinks:
+            sink.write(snapshot)
+        return snapshot
+
+    def report(self):
+        snapshot = self.snapshot()
+        for name, h in snapshot["histograms"].items():
+            print(f"   [Timing] {name}: n={h['count']} p50<={h['p50_ms']:.1f}ms "
+                  f"p95<={h['p95_ms']:.1f}ms max={h['max_ms']:.1f}ms")
+        for name, value in snapshot["counters"].items():
+            print(f"   [Count] {name}: {value}")
+
+
+class MemorySink:
+    """Keeps every snapshot in `snapshots`."""
+
+    def __init__(self):
+        self.snapshots = []
+
+    def write(self, snapshot):
+        self.snapshots.append(snapshot)
+
+
+class JsonLinesSink:
+    """Appends one JSON object per snapshot to a file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, snapshot):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(snapshot) + "\n")
+
+
+def _split(name):
+    family, _, label = name.partition(".")
+    return f"{METRIC_PREFIX}_{family}", label
+
+
+class PrometheusSink:
+    """
+    Rewrites a Prometheus text-format file (for node_exporter's textfile
+    collector) with the latest snapshot. The file is replaced atomically so
+    a scrape never sees a half-written file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, snapshot):
+        lines = []
+        families = {}
+        for name, h in snapshot["histograms"].items():
+            families.setdefault(_split(name)[0], []).append((name, h))
+        for family, members in families.items():
+            lines.append(f"# TYPE {family}_ms histogram")
+            for name, h in members:
+                label = _split(name)[1]
+                cumulative = 0
+                for bound, count in zip(h["bounds_ms"] + ["+Inf"], h["buckets"]):
+                    cumulative += count
+                    lines.append(f'{family}_ms_bucket{{name="{label}",le="{bound}"}} {cumulative}')
+                lines.append(f'{family}_ms_sum{{name="{label}"}} {h["sum_ms"]}')
+                lines.append(f'{family}_ms_count{{name="{label}"}} {h["count"]}')
+        families = {}
+        for name, value in snapshot["counters"].items():
+            families.setdefault(_split(name)[0], []).append((name, value))
+        for family, members in families.items():
+            lines.append(f"# TYPE {family}_total counter")
+            for name, value in members:
+                lines.append(f'{family}_total{{name="{_split(name)[1]}"}} {value}')
+
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temporary, self.path)
+
+
+def sink_for_path(path):
+    """MemorySink for "memory", PrometheusSink for *.prom, else JsonLinesSink."""
+    if path == "memory":
+        return MemorySink()
+    if path.endswith(".prom"):
+        return PrometheusSink(path)
+    return JsonLinesSink(path)
+
+
+def metrics_from_env():
+    """Metrics writing to $METRICS_FILE, or None (disabled) when it is unset."""
+    path = os.getenv("METRICS_FILE")
+    return Metrics([sink_for_path(path)]) if path else None
+
+
+def timed(name):
+    """
+    Decorator timing an async method under `name` in `self.metrics`.
+
+    When `self.metrics` is None the only cost is one attribute lookup.
+    """
+    def decorate(method):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            metrics = self.metrics
+            if metrics is None:
+                return await method(self, *args, **kwargs)
+            started = time.monotonic()
+            try:
+                return await method(self, *args, **kwargs)
+            finally:
+                metrics.observe(name, (time.monotonic() - started) * 1000.0)
+        return wrapper
+    return decorate
@@ -0,0 +1,397 @@
+from operator import attrgetter
+
+import numpy as np
+
+from plan_compiler import (MAV_CMD_DO_CHANGE_SPEED, MAV_CMD_DO_JUMP, MAV_CMD_DO_SET_CAM_TRIGG_DIST,
+                           MAV_CMD_NAV_LAND, MAV_CMD_NAV_LOITER_TIME, MAV_CMD_NAV_TAKEOFF,
+                           MAV_CMD_NAV_WAYPOINT, MAV_FRAME_GLOBAL_RELATIVE_ALT, MAV_FRAME_MISSION,
+                           CompiledPlan)
+
+MAV_CMD_NAV_DELAY = 93
+MAV_CMD_CONDITION_DELAY = 112
+MAV_CMD_DO_SET_HOME = 179
+MAV_CMD_DO_SET_RELAY = 181
+MAV_CMD_DO_SET_SERVO = 183
+MAV_CMD_DO_SET_ROI_LOCATION = 195
+MAV_CMD_DO_DIGICAM_CONTROL = 203
+MAV_CMD_DO_MOUNT_CONTROL = 205
+MAV_CMD_DO_GIMBAL_MANAGER_PITCHYAW = 1000
+MAV_CMD_IMAGE_START_CAPTURE = 2000
+MAV_CMD_IMAGE_STOP_CAPTURE = 2001
+MAV_CMD_VIDEO_START_CAPTURE = 2500
+MAV_CMD_VIDEO_STOP_CAPTURE = 2501
+MAV_CMD_DO_VTOL_TRANSITION = 3000
+
+# Frames whose x/y are latitude/longitude in degE7 on the wire.
+GLOBAL_FRAMES = (0, 3, 5, 6, 10, 11)
+MAV_FRAME_GLOBAL = 0
+
+# ArduPilot keeps home at seq 0 of the mission and flies from seq 1, so raw
+# missions carry one home item ahead of the plan rows: row r is seq r + 1.
+# The autopilot overwrites that item with its own home, and mission
+# progress as this repo sees it counts plan rows, home excluded.
+HOME_ITEMS = 1
+
+RAW_FIELDS = ("seq", "frame", "command", "current", "autocontinue", "param1", "param2", "param3",
+              "param4", "x", "y", "z", "mission_type")
+
+# mavsdk.mission.MissionItem fields, in constructor order. Camera and
+# vehicle actions are held as indexes into the name tuples below.
+MISSION_FIELDS = ("latitude_deg", "longitude_deg", "relative_altitude_m", "speed_m_s",
+                  "is_fly_through", "gimbal_pitch_deg", "gimbal_yaw_deg", "camera_action",
+                  "loiter_time_s", "camera_photo_interval_s", "acceptance_radius_m", "yaw_deg",
+                  "camera_photo_distance_m", "vehicle_action")
+CAMERA_ACTIONS = ("NONE", "TAKE_PHOTO", "START_PHOTO_INTERVAL", "STOP_PHOTO_INTERVAL",
+                  "START_VIDEO", "STOP_VIDEO", "START_PHOTO_DISTANCE", "STOP_PHOTO_DISTANCE")
+VEHICLE_ACTIONS = ("NONE", "TAKEOFF", "LAND", "TRANSITION_TO_FW", "TRANSITION_TO_MC")
+_FIELD = {name: i for i, name in enumerate(MISSION_FIELDS)}
+_CAMERA = {name: i for i, name in enumerate(CAMERA_ACTIONS)}
+_VEHICLE = {name: i for i, name in enumerate(VEHICLE_ACTIONS)}
+
+# Hold time written for waypoints that are not fly-through.
+STOP_HOLD_S = 0.5
+
+
+class CommandSpec:
+    """
+    How one MAV_CMD maps onto mavsdk.mission.MissionItem fields.
+
+    `fields` maps a mission field to a param index (0-6) or to a function
+    of the (N, 7) params of every row with this command. `carried` lists the
+    params those fields preserve; `fixed` gives the values the encoder
+    writes for the other params it sets. Any other non-zero param is lost
+    in a MissionItem. `mission` is False for commands the mission plugin
+    cannot express at all.
+    """
+
+    def __init__(self, command, name, nav=False, fields=None, carried=(), fixed=None,
+                 mission=True):
+        self.command = command
+        self.name = name
+        self.nav = nav
+        self.fields = fields or {}
+        self.carried = tuple(carried) + ((4, 5, 6) if nav else ())
+        self.fixed = fixed or {}
+        self.mission = mission
+
+
+def _positive(index):
+    return lambda params: np.where(params[:, index] > 0, params[:, index], np.nan)
+
+
+def _constant(value):
+    return lambda params: np.full(len(params), value, dtype=np.float64)
+
+
+COMMANDS = {spec.command: spec for spec in (
+    CommandSpec(MAV_CMD_NAV_WAYPOINT, "NAV_WAYPOINT", nav=True, fields={
+        "is_fly_through": lambda params: (params[:, 0] == 0).astype(np.float64),
+        "acceptance_radius_m": _positive(1), "yaw_deg": 3},
+                carried=(1, 3), fixed={0: (0.0, STOP_HOLD_S)}),
+    CommandSpec(17, "NAV_LOITER_UNLIM", nav=True, mission=False),
+    CommandSpec(18, "NAV_LOITER_TURNS", nav=True, mission=False),
+    CommandSpec(MAV_CMD_NAV_LOITER_TIME, "NAV_LOITER_TIME", nav=True, fields={
+        "loiter_time_s": 0, "is_fly_through": _constant(0.0),
+        "acceptance_radius_m": _positive(1), "yaw_deg": 3}, carried=(0, 1, 3)),
+    CommandSpec(20, "NAV_RETURN_TO_LAUNCH", nav=True, mission=False),
+    CommandSpec(MAV_CMD_NAV_LAND, "NAV_LAND", nav=True, fields={
+        "vehicle_action": _constant(_VEHICLE["LAND"]), "is_fly_through": _constant(0.0),
+        "yaw_deg": 3}, carried=(3,)),
+    CommandSpec(MAV_CMD_NAV_TAKEOFF, "NAV_TAKEOFF", nav=True, fields={
+        "vehicle_action": _constant(_VEHICLE["TAKEOFF"]), "is_fly_through": _constant(0.0),
+        "yaw_deg": 3}, carried=(3,)),
+    CommandSpec(31, "NAV_LOITER_TO_ALT", nav=True, mission=False),
+    CommandSpec(MAV_CMD_NAV_DELAY, "NAV_DELAY", mission=False),
+    CommandSpec(MAV_CMD_CONDITION_DELAY, "CONDITION_DELAY", mission=False),
+    CommandSpec(MAV_CMD_DO_JUMP, "DO_JUMP", mission=False),
+    CommandSpec(MAV_CMD_DO_CHANGE_SPEED, "DO_CHANGE_SPEED", fields={"speed_m_s": 1},
+                carried=(1,), fixed={0: (1.0,), 2: (-1.0,)}),
+    CommandSpec(MAV_CMD_DO_SET_HOME, "DO_SET_HOME", mission=False),
+    CommandSpec(MAV_CMD_DO_SET_RELAY, "DO_SET_RELAY", mission=False),
+    CommandSpec(MAV_CMD_DO_SET_SERVO, "DO_SET_SERVO", mission=False),
+    CommandSpec(MAV_CMD_DO_SET_ROI_LOCATION, "DO_SET_ROI_LOCATION", mission=False),
+    CommandSpec(MAV_CMD_DO_DIGICAM_CONTROL, "DO_DIGICAM_CONTROL", mission=False),
+    CommandSpec(MAV_CMD_DO_MOUNT_CONTROL, "DO_MOUNT_CONTROL",
+                fields={"gimbal_pitch_deg": 0, "gimbal_yaw_deg": 2}, carried=(0, 2),
+                fixed={6: (2.0,)}),
+    CommandSpec(MAV_CMD_DO_SET_CAM_TRIGG_DIST, "DO_SET_CAM_TRIGG_DIST", fields={
+        "camera_photo_distance_m": _positive(0),
+        "camera_action": lambda params: np.where(params[:, 0] > 0, _CAMERA["START_PHOTO_DISTANCE"],
+                                                 _CAMERA["STOP_PHOTO_DISTANCE"])},
+                carried=(0,), fixed={2: (1.0,)}),
+    CommandSpec(MAV_CMD_DO_GIMBAL_MANAGER_PITCHYAW, "DO_GIMBAL_MANAGER_PITCHYAW", mission=False),
+    CommandSpec(MAV_CMD_IMAGE_START_CAPTURE, "IMAGE_START_CAPTURE", fields={
+        "camera_photo_interval_s": _positive(1),
+        "camera_action": lambda params: np.where(params[:, 2] == 1, _CAMERA["TAKE_PHOTO"],
+                                                 _CAMERA["START_PHOTO_INTERVAL"])},
+                carried=(1,), fixed={2: (0.0, 1.0)}),
+    CommandSpec(MAV_CMD_IMAGE_STOP_CAPTURE, "IMAGE_STOP_CAPTURE",
+                fields={"camera_action": _constant(_CAMERA["STOP_PHOTO_INTERVAL"])}),
+    CommandSpec(MAV_CMD_VIDEO_START_CAPTURE, "VIDEO_START_CAPTURE",
+                fields={"camera_action": _constant(_CAMERA["START_VIDEO"])}),
+    CommandSpec(MAV_CMD_VIDEO_STOP_CAPTURE, "VIDEO_STOP_CAPTURE",
+                fields={"camera_action": _constant(_CAMERA["STOP_VIDEO"])}),
+    CommandSpec(MAV_CMD_DO_VTOL_TRANSITION, "DO_VTOL_TRANSITION", fields={
+        "vehicle_action": lambda params: np.where(params[:, 0] == 4, _VEHICLE["TRANSITION_TO_FW"],
+                                                  _VEHICLE["TRANSITION_TO_MC"])},
+                fixed={0: (3.0, 4.0)}),
+)}
+
+
+def command_name(command):
+    spec = COMMANDS.get(int(command))
+    return spec.name if spec is not None else f"MAV_CMD_{int(command)}"
+
+
+def raw_to_plan(raw_items, home=True, **plan_kwargs) -> CompiledPlan:
+    """
+    Decodes mission_raw items into a CompiledPlan in one pass.
+
+    With `home`, the first item is the seq 0 home item (see HOME_ITEMS): it
+    is dropped, its position becomes the plan's home unless one is passed
+    and DO_JUMP targets are shifted back to rows. Lossless: plan_to_raw() of the result gives back the same
+    items, field for field (seq and current are renumbered from 0,
+    mission_type is always 0).
+    """
+    raw_items = list(raw_items)
+    if home and raw_items:
+        item, raw_items = raw_items[0], raw_items[HOME_ITEMS:]
+        if "home" not in plan_kwargs and (item.x, item.y, item.z) != (0, 0, 0):
+            plan_kwargs["home"] = (item.x / 1e7, item.y / 1e7, item.z)
+    rows = list(map(attrgetter(*RAW_FIELDS), raw_items))
+    table = np.array(rows, dtype=np.float64).reshape(len(rows), len(RAW_FIELDS))
+    frame = table[:, 1].astype(np.uint8)
+    params = np.empty((len(rows), 7))
+    params[:, :4] = table[:, 5:9]
+    scale = np.where(np.isin(frame, GLOBAL_FRAMES), 1e7, 1.0)
+    params[:, 4] = table[:, 9] / scale
+    params[:, 5] = table[:, 10] / scale
+    params[:, 6] = table[:, 11]
+    if home:
+        params[table[:, 2] == MAV_CMD_DO_JUMP, 0] -= HOME_ITEMS
+    return CompiledPlan(table[:, 2], frame, params, table[:, 4] != 0, **plan_kwargs)
+
+
+def plan_to_raw(plan, item_class=None, home=True):
+    """
+    Encodes a CompiledPlan as mission_raw items (mavsdk.mission_raw.MissionItem
+    unless `item_class` is given). NaN params are sent as 0, which ArduPilot
+    requires for most commands.
+
+    With `home`, the items start with the seq 0 home item at the plan's
+    home (zeros when it has none) and the plan rows follow from seq 1;
+    DO_JUMP targets are shifted to match.
+    """
+    if item_class is None:
+        from mavsdk.mission_raw import MissionItem as item_class
+
+    params = np.nan_to_num(plan.params, nan=0.0)
+    if home:
+        params[plan.command == MAV_CMD_DO_JUMP, 0] += HOME_ITEMS
+        lat, lon, alt = plan.home if plan.home is not None else (0.0, 0.0, 0.0)
+        home_row = np.array([[0.0, 0.0, 0.0, 0.0, lat, lon, alt]])
+        params = np.concatenate((home_row, params))
+        plan = CompiledPlan(np.concatenate(([MAV_CMD_NAV_WAYPOINT], plan.command)),
+                            np.concatenate(([MAV_FRAME_GLOBAL], plan.frame)), params,
+                            np.concatenate(([True], plan.autocontinue)))
+    positional = np.isin(plan.frame, GLOBAL_FRAMES)
+    x = np.where(positional, np.round(params[:, 4] * 1e7), params[:, 4]).astype(np.int64).tolist()
+    y = np.where(positional, np.round(params[:, 5] * 1e7), params[:, 5]).astype(np.int64).tolist()
+    frame = plan.frame.tolist()
+    command = plan.command.tolist()
+    autocontinue = plan.autocontinue.astype(int).tolist()
+    p = params.tolist()
+    return [item_class(seq, frame[seq], command[seq], int(seq == 0), autocontinue[seq],
+                       p[seq][0], p[seq][1], p[seq][2], p[seq][3], x[seq], y[seq], p[seq][6], 0)
+            for seq in range(len(command))]
+
+
+def lossy_rows(plan):
+    """
+    Rows a trip through mavsdk.mission.MissionItem would change or drop:
+    commands the mission plugin cannot express, frames other than
+    relative-altitude (nav) or mission (DO), and params no field carries.
+    """
+    lossy = np.ones(len(plan), dtype=bool)
+    for command, spec in COMMANDS.items():
+        rows = plan.command == command
+        if not spec.mission or not rows.any():
+            continue
+        frame = MAV_FRAME_GLOBAL_RELATIVE_ALT if spec.nav else MAV_FRAME_MISSION
+        params = plan.params[rows]
+        ok = plan.frame[rows] == frame
+        for index in range(7):
+            if index in spec.carried:
+                continue
+            values = np.nan_to_num(params[:, index])
+            ok &= np.isin(values, spec.fixed.get(index, (0.0,)))
+        lossy[rows] = ~ok
+    return np.flatnonzero(lossy)
+
+
+def _field_table(plan):
+    """(N, F) MissionItem field values per row; NaN where a row sets nothing."""
+    table = np.full((len(plan), len(MISSION_FIELDS)), np.nan)
+    for command, spec in COMMANDS.items():
+        rows = np.flatnonzero(plan.command == command)
+        if len(rows) == 0:
+            continue
+        params = plan.params[rows]
+        for field, source in spec.fields.items():
+            table[rows, _FIELD[field]] = params[:, source] if isinstance(source, int) else source(params)
+    return table
+
+
+def plan_to_mission_items(plan, default_speed=None):
+    """
+    Converts a CompiledPlan to mavsdk.mission.MissionItem objects.
+
+    Each nav row starts an item; the DO rows after it (speed, camera,
+    gimbal, VTOL transition) fill that item's fields, and DO rows before the
+    first nav row fill the first item. A speed change holds until the next
+    one; before any, items fly at `default_speed` (the plan's cruise speed
+    by default) and takeoffs at NaN. Rows listed by lossy_rows() are not
+    represented; use plan_to_raw() for those missions.
+    """
+    from mavsdk.mission import MissionItem
+
+    if len(plan) == 0:
+        return []
+    default_speed = plan.cruise_speed if default_speed is None else default_speed
+    fields = _field_table(plan)
+    nav = np.isin(plan.command, [c for c, spec in COMMANDS.items() if spec.nav and spec.mission])
+    nav_rows = np.flatnonzero(nav)
+    standalone = len(nav_rows) == 0
+    count = 1 if standalone else len(nav_rows)
+    owner = np.maximum(np.cumsum(nav) - 1, 0)
+
+    items = np.full((count, len(MISSION_FIELDS)), np.nan)
+    if not standalone:
+        items[:, :3] = plan.params[nav_rows, 4:7]
+        items[:] = np.where(np.isnan(fields[nav_rows]), items, fields[nav_rows])
+    folded = np.flatnonzero(~nav & np.isin(plan.command, list(COMMANDS)))
+    for column in range(len(MISSION_FIELDS)):
+        rows = folded[~np.isnan(fields[folded, column])]
+        items[owner[rows], column] = fields[rows, column]  # Later rows win.
+
+    # Speed changes persist across items.
+    speed = _FIELD["speed_m_s"]
+    set_here = ~np.isnan(items[:, speed])
+    last = np.maximum.accumulate(np.where(set_here, np.arange(count), -1))
+    items[:, speed] = np.where(last >= 0, items[np.maximum(last, 0), speed], default_speed)
+    takeoff = items[:, _FIELD["vehicle_action"]] == _VEHICLE["TAKEOFF"]
+    items[takeoff & ~set_here, speed] = np.nan
+
+    flags = np.nan_to_num(items[:, [_FIELD["is_fly_through"], _FIELD["camera_action"],
+                                    _FIELD["vehicle_action"]]]).astype(int).tolist()
+    camera = [getattr(MissionItem.CameraAction, name) for name in CAMERA_ACTIONS]
+    vehicle = [getattr(MissionItem.VehicleAction, name) for name in VEHICLE_ACTIONS]
+    values = items.tolist()
+    return [MissionItem(row[0], row[1], row[2], row[3], bool(fly), row[5], row[6], camera[cam],
+                        row[8], row[9], row[10], row[11], row[12], vehicle[act])
+            for row, (fly, cam, act) in zip(values, flags)]
+
+
+def raw_to_mission_items(raw_items, home=True):
+    """Decodes mission_raw items straight to mission items (see plan_to_mission_items)."""
+    return plan_to_mission_items(raw_to_plan(raw_items, home))
+
+
+def _action_codes(values, names):
+    index = {name: i for i, name in enumerate(names)}
+    return np.array([index[getattr(value, "name", str(value))] for value in values], dtype=np.int64)
+
+
+def mission_items_to_plan(items, cruise_speed=None, **plan_kwargs) -> CompiledPlan:
+    """
+    Encodes mavsdk.mission.MissionItem objects as MAVLink rows, laid out the
+    way plan_to_mission_items reads them: the nav row, then a speed change
+    when the speed differs from the one in force, then gimbal, camera and
+    VTOL transition rows. Every item is placed in one vectorized pass.
+
+    plan_to_mission_items(mission_items_to_plan(items)) returns items equal
+    to `items` in every field their commands carry; items with a loiter time
+    come back as not fly-through and NaN speeds as the speed in force.
+    """
+    items = list(items)
+    count = len(items)
+    numeric = [f for f in MISSION_FIELDS if f not in ("camera_action", "vehicle_action")]
+    table = np.array(list(map(attrgetter(*numeric), items)), dtype=np.float64).reshape(count, -1)
+    f = {name: table[:, i] for i, name in enumerate(numeric)}
+    camera = _action_codes([item.camera_action for item in items], CAMERA_ACTIONS)
+    vehicle = _action_codes([item.vehicle_action for item in items], VEHICLE_ACTIONS)
+
+    speed = f["speed_m_s"]
+    finite_speed = ~np.isnan(speed)
+    if cruise_speed is None:
+        cruise_speed = float(speed[finite_speed][0]) if finite_speed.any() else 8.0
+    # Speed in force before each item: the last finite speed of the items before it.
+    last = np.maximum.accumulate(np.where(finite_speed, np.arange(count), -1))
+    before = np.concatenate(([-1], last[:-1])) if count else last
+    in_force = np.where(before >= 0, speed[np.maximum(before, 0)], cruise_speed)
+    takeoff = vehicle == _VEHICLE["TAKEOFF"]
+
+    has_speed = finite_speed & ((speed != in_force) | takeoff)
+    has_gimbal = ~(np.isnan(f["gimbal_pitch_deg"]) & np.isnan(f["gimbal_yaw_deg"]))
+    has_camera = camera != _CAMERA["NONE"]
+    has_transition = np.isin(vehicle, (_VEHICLE["TRANSITION_TO_FW"], _VEHICLE["TRANSITION_TO_MC"]))
+    extra = np.column_stack((has_speed, has_gimbal, has_camera, has_transition)).astype(np.int64)
+    start = np.concatenate(([0], np.cumsum(1 + extra.sum(axis=1))))
+    rows = int(start[-1])
+    nav = start[:-1]
+    slot = nav[:, None] + 1 + np.cumsum(extra, axis=1) - extra  # Row of each DO item.
+
+    command = np.zeros(rows, dtype=np.uint16)
+    frame = np.full(rows, MAV_FRAME_MISSION, dtype=np.uint8)
+    params = np.zeros((rows, 7))
+
+    # Nav rows.
+    loiter = ~np.isnan(f["loiter_time_s"])
+    land = vehicle == _VEHICLE["LAND"]
+    command[nav] = np.select([takeoff, land, loiter],
+                             [MAV_CMD_NAV_TAKEOFF, MAV_CMD_NAV_LAND, MAV_CMD_NAV_LOITER_TIME],
+                             MAV_CMD_NAV_WAYPOINT)
+    frame[nav] = MAV_FRAME_GLOBAL_RELATIVE_ALT
+    waypoint = ~(takeoff | land)
+    hold = np.where(f["is_fly_through"] != 0, 0.0, STOP_HOLD_S)
+    params[nav, 0] = np.where(waypoint, np.where(loiter, f["loiter_time_s"], hold), 0.0)
+    acceptance = f["acceptance_radius_m"]
+    params[nav, 1] = np.where(waypoint & (acceptance > 0), acceptance, 0.0)
+    params[nav, 3] = f["yaw_deg"]
+    params[nav, 4] = f["latitude_deg"]
+    params[nav, 5] = f["longitude_deg"]
+    params[nav, 6] = f["relative_altitude_m"]
+
+    # Speed changes.
+    at = slot[has_speed, 0]
+    command[at] = MAV_CMD_DO_CHANGE_SPEED
+    params[at, 0], params[at, 1], params[at, 2] = 1.0, speed[has_speed], -1.0
+
+    # Gimbal.
+    at = slot[has_gimbal, 1]
+    command[at] = MAV_CMD_DO_MOUNT_CONTROL
+    params[at, 0] = f["gimbal_pitch_deg"][has_gimbal]
+    params[at, 2] = f["gimbal_yaw_deg"][has_gimbal]
+    params[at, 6] = 2.0
+
+    # Camera: trigger distance, photos and video.
+    at, action = slot[has_camera, 2], camera[has_camera]
+    distance = (action == _CAMERA["START_PHOTO_DISTANCE"]) | (action == _CAMERA["STOP_PHOTO_DISTANCE"])
+    photo = (action == _CAMERA["TAKE_PHOTO"]) | (action == _CAMERA["START_PHOTO_INTERVAL"])
+    command[at] = np.select(
+        [distance, photo, action == _CAMERA["STOP_PHOTO_INTERVAL"], action == _CAMERA["START_VIDEO"]],
+        [MAV_CMD_DO_SET_CAM_TRIGG_DIST, MAV_CMD_IMAGE_START_CAPTURE, MAV_CMD_IMAGE_STOP_CAPTURE,
+         MAV_CMD_VIDEO_START_CAPTURE], MAV_CMD_VIDEO_STOP_CAPTURE)
+    params[at, 0] = np.where(action == _CAMERA["START_PHOTO_DISTANCE"],
+                             f["camera_photo_distance_m"][has_camera], 0.0)
+    params[at, 1] = np.where(action == _CAMERA["START_PHOTO_INTERVAL"],
+                             f["camera_photo_interval_s"][has_camera], 0.0)
+    params[at, 2] = np.where(distance | (action == _CAMERA["TAKE_PHOTO"]), 1.0, 0.0)
+
+    # VTOL transitions.
+    at = slot[has_transition, 3]
+    command[at] = MAV_CMD_DO_VTOL_TRANSITION
+    params[at, 0] = np.where(vehicle[has_transition] == _VEHICLE["TRANSITION_TO_FW"], 4.0, 3.0)
+
+    return CompiledPlan(command, frame, params, np.ones(rows, dtype=bool),
+                        cruise_speed=cruise_speed, **plan_kwargs)
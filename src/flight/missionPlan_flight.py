@@ -1,95 +1,39 @@
 import asyncio
-import json
 import sys
 from drone_actions import Drone
-from mavsdk.mission import MissionItem
+from geofence import Geofence
+from plan_compiler import PlanError, compile_plan
 
-MAV_CMD_NAV_WAYPOINT = 16
-MAV_CMD_NAV_TAKEOFF = 22
-
-async def parse_plan_file(file_path): """
-    Parses a QGroundControl .plan file and returns a list of MissionItem objects
-    and a boolean indicating if a takeoff command is present.
+async def parse_plan_file(file_path):
+    """
+    Compiles a QGroundControl .plan file and returns the CompiledPlan, a
+    boolean indicating if a takeoff command is present, and the plan's Geofence.
+
+    Survey ComplexItems are expanded into their transect waypoints, so the spray
+    pattern is part of the uploaded mission. Plans whose waypoints or legs
+    breach their own geoFence are rejected here, before flight; waypoints
+    riding the fence edge are reported, and the live monitor allows them a
+    small margin (geofence.DEFAULT_BREACH_MARGIN_M).
     """
     try:
-        with open(file_path, 'r') as f:
-            plan_data = json.load(f)
+        plan = compile_plan(file_path)
+        fence = Geofence.from_plan(plan)
+        print(fence.validate(plan))
     except FileNotFoundError:
         print(f"Error: Plan file not found at {file_path}")
-        return None, False
-    except json.JSONDecodeError:
-        print(f"Error: Could not decode JSON from {file_path}")
-        return None, False
+        return None, False, None
+    except PlanError as e:
+        print(f"Error: {e}")
+        return None, False, None
 
-    mission_items = []
-    has_takeoff_command = False
-    
-    if 'mission' in plan_data and 'items' in plan_data['mission']:
-        cruise_speed = plan_data['mission'].get('cruiseSpeed', 8.0)
-
-        for i, item in enumerate(plan_data['mission']['items']):
-            item_type = item.get('type')
-            if item_type != 'SimpleItem':
-                continue
-                
-            command = item.get('command')
-            params = item.get('params', [])
-
-            if command == MAV_CMD_NAV_WAYPOINT and len(params) >= 7:
-                lat = params[4]
-                lon = params[5]
-                alt = params[6]
-                
-                mission_items.append(
-                    MissionItem(
-                        lat,
-                        lon,
-                        alt,
-                        cruise_speed,
-                        True,  # is_fly_through
-                        float('nan'), # gimbal_pitch_deg
-                        float('nan'), # gimbal_yaw_deg
-                        MissionItem.CameraAction.NONE,
-                        float('nan'), # loiter_time_s
-                        float('nan'), # camera_photo_interval_s
-                        params[1] if params and len(params) > 1 and params[1] > 0 else float('nan'), # acceptance_radius
-                        float('nan'), # yaw_deg
-                        float('nan'), # camera_photo_distance_m
-                        MissionItem.VehicleAction.NONE
-                    )
-                )
-            elif command == MAV_CMD_NAV_TAKEOFF and len(params) >= 7:
-                if i == 0:
-                    has_takeoff_command = True
-                lat = params[4]
-                lon = params[5]
-                alt = params[6]
-                mission_items.append(
-                    MissionItem(
-                        lat,
-                        lon,
-                        alt,
-                        float('nan'), # speed
-                        False, # is_fly_through
-                        float('nan'), # gimbal_pitch_deg
-                        float('nan'), # gimbal_yaw_deg
-                        MissionItem.CameraAction.NONE,
-                        float('nan'), # loiter_time_s
-                        float('nan'), # camera_photo_interval_s
-                        float('nan'), # acceptance_radius
-                        float('nan'), # yaw_deg
-                        float('nan'), # camera_photo_distance_m
-                        MissionItem.VehicleAction.NONE
-                    )
-                )
-
-    return mission_items, has_takeoff_command
-
-async def run(plan_file):
+    return plan, plan.has_takeoff, fence
+
+async def run(plan_file, system=None):
     """
     This script reads a QGC mission plan, uploads it to the drone, and executes it.
+    Pass `system` (e.g. a fake_system.FakeSystem) to fly it without a real vehicle.
     """
-    drone = Drone()
+    drone = Drone(system=system)
 
     if not await drone.connect():
         print("Failed to connect to the drone. Exiting.")
@@ -97,17 +41,19 @@ async def run(plan_file):
 
     await drone.wait_for_readiness()
 
-    mission_items, has_takeoff_command = await parse_plan_file(plan_file)
+    plan, has_takeoff_command, fence = await parse_plan_file(plan_file)
 
-    if not mission_items:
+    if plan is None or len(plan) == 0:
         print(f"No mission items found or error parsing {plan_file}. Exiting.")
         return
         
-    print(f"Loaded {len(mission_items)} mission items from {plan_file}.")
+    print(f"Loaded {len(plan)} mission items from {plan_file}.")
     if has_takeoff_command:
         print("Mission plan includes a takeoff command.")
 
-    await drone.upload_mission(mission_items)
+    # The CompiledPlan goes up through mission_raw exactly as planned, RTL
+    # and trigger-distance items included.
+    await drone.upload_mission(plan)
 
     await drone.arm()
 
@@ -117,15 +63,15 @@ async def run(plan_file):
 
     await drone.start_mission()
 
-    await drone.monitor_mission_progress()
+    breach = await drone.monitor_mission_progress(fence)
+    if breach is not None:
+        print(f"!! {breach}, aborting mission")
 
     await drone.return_to_launch()
 
     # Wait for the drone to land
-    async for in_air in drone.system.telemetry.in_air():
-        if not in_air:
-            print("--> Drone has landed.")
-            break
+    await drone.wait_for_landed()
+    print("--> Drone has landed.")
     
     await drone.disarm()
 
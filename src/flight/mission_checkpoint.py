@@ -0,0 +1,284 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from geo import latlon_to_ne, ne_to_latlon
+from mav_codec import MAV_CMD_DO_JUMP, command_name
+from mission_estimator import estimate_mission
+from mission_optimizer import STATE_COMMANDS, optimize_plan
+from plan_compiler import (MAV_CMD_DO_SET_CAM_TRIGG_DIST, MAV_CMD_NAV_WAYPOINT, PlanError,
+                           compile_plan)
+
+CHECKPOINT_VERSION = 1
+DEFAULT_CHECKPOINT_PATH = "checkpoint.json"
+
+
+class Checkpoint:
+    """
+    How far a mission got: the mission item in progress (so every item
+    before `current` is complete), the last position on the mission and the
+    last position where the valve was open. Indices refer to the rows of
+    the plan named by `source_hash` and `item_count`, after optimize_plan
+    with `tolerance_m` when that is not None.
+    """
+
+    def __init__(self, source_hash, item_count, current, position=None, sprayed=None,
+                 sprayed_item=None, spraying=False, updated_at=None, tolerance_m=None):
+        self.source_hash = source_hash
+        self.item_count = item_count
+        self.current = current
+        self.position = tuple(position) if position is not None else None  # lat, lon, rel alt
+        self.sprayed = tuple(sprayed) if sprayed is not None else None  # lat, lon
+        self.sprayed_item = sprayed_item
+        self.spraying = spraying
+        self.updated_at = updated_at
+        self.tolerance_m = tolerance_m
+
+    @property
+    def completed(self) -> int:
+        """Index of the last completed mission item (-1 before the first)."""
+        return self.current - 1
+
+    def save(self, path):
+        """Writes the checkpoint as JSON atomically."""
+        data = {"version": CHECKPOINT_VERSION, "source_hash": self.source_hash,
+                "item_count": self.item_count, "current": self.current,
+                "position": self.position, "sprayed": self.sprayed,
+                "sprayed_item": self.sprayed_item, "spraying": self.spraying,
+                "updated_at": self.updated_at, "tolerance_m": self.tolerance_m}
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Reads a checkpoint written by `save`."""
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("version") != CHECKPOINT_VERSION:
+            raise PlanError(f"Checkpoint {path} was written by version {data.get('version')}")
+        return cls(data["source_hash"], data["item_count"], data["current"], data["position"],
+                   data["sprayed"], data["sprayed_item"], data["spraying"], data["updated_at"],
+                   data.get("tolerance_m"))
+
+    def check_plan(self, plan):
+        """Raises PlanError unless the checkpoint was written for `plan`."""
+        if self.source_hash != plan.source_hash or self.item_count != len(plan):
+            raise PlanError("Checkpoint was written for a different plan "
+                            f"({self.item_count} items, hash {self.source_hash})")
+
+    def __str__(self):
+        where = "no position yet" if self.position is None else \
+            f"at {self.position[0]:.7f}, {self.position[1]:.7f}"
+        sprayed = "" if self.sprayed is None else \
+            f", last sprayed {self.sprayed[0]:.7f}, {self.sprayed[1]:.7f} (item {self.sprayed_item})"
+        return f"item {self.current}/{self.item_count} in progress, {where}{sprayed}"
+
+
+class MissionCheckpointer:
+    """
+    Keeps a Checkpoint on disk while a mission flies.
+
+    Position and mission progress come from a TelemetryHub listener; a
+    SprayerController passed this as `checkpoint` reports valve changes
+    through set_spraying(), the same call it makes on a CoverageMap. The
+    file is rewritten at most every `interval_s`, and at once when the
+    mission item advances or the valve closes.
+
+    For a mission built by resume_plan, pass its `item_map`: checkpoints
+    keep referring to the original plan, and nothing is written until the
+    vehicle is back on the original path, so a second interruption resumes
+    from the right place. Pass the optimize_plan tolerance `plan` was built
+    with as `tolerance_m`, so the resume CLI can rebuild the same rows.
+    """
+
+    def __init__(self, path, plan, item_map=None, previous=None, interval_s=1.0, tolerance_m=None):
+        self.path = path
+        self.item_map = None if item_map is None else np.asarray(item_map)
+        self.interval_s = interval_s
+        self.checkpoint = previous or Checkpoint(plan.source_hash, len(plan), 0, tolerance_m=tolerance_m)
+        self.checkpoint.tolerance_m = tolerance_m
+        self.checkpoint.spraying = False
+        self.writes = 0
+        self._on_mission = item_map is None
+        self._last_write = 0.0
+        self._hub = None
+
+    def _original_item(self, current):
+        if self.item_map is None:
+            return current
+        if current >= len(self.item_map):
+            return self.checkpoint.item_count
+        return int(self.item_map[current])
+
+    def write(self):
+        checkpoint = self.checkpoint
+        checkpoint.updated_at = time.time()
+        checkpoint.save(self.path)
+        self.writes += 1
+        self._last_write = time.monotonic()
+
+    def set_spraying(self, is_open):
+        """Valve state changes; a closing valve is checkpointed immediately."""
+        was_open, self.checkpoint.spraying = self.checkpoint.spraying, is_open
+        if was_open and not is_open and self._on_mission:
+            self.write()
+
+    def _on_sample(self, name, timestamp, sample):
+        checkpoint = self.checkpoint
+        if name == "mission_progress":
+            current = self._original_item(int(sample[0]))
+            if current < 0:
+                return
+            self._on_mission = True
+            if current != checkpoint.current:
+                checkpoint.current = current
+                self.write()
+        elif name == "position" and self._on_mission:
+            checkpoint.position = (sample[0], sample[1], sample[3])
+            if checkpoint.spraying:
+                checkpoint.sprayed = (sample[0], sample[1])
+                checkpoint.sprayed_item = checkpoint.current
+            if timestamp - self._last_write >= self.interval_s:
+                self.write()
+
+    def attach(self, hub):
+        """Starts checkpointing from the position and mission_progress samples of a TelemetryHub."""
+        self._hub = hub
+        hub.add_listener(self._on_sample)
+        hub.subscribe("position")
+        hub.subscribe("mission_progress")
+
+    def detach(self):
+        if self._hub is not None:
+            self._hub.remove_listener(self._on_sample)
+            self._hub = None
+        if self._on_mission:
+            self.write()
+
+
+def _resume_point(plan, start, target, lat, lon):
+    """Nearest point to lat/lon on the leg start -> target, with interpolated altitude."""
+    ref_lat, ref_lon = plan.lat[start], plan.lon[start]
+    north, east = latlon_to_ne(np.array([plan.lat[target], lat]), np.array([plan.lon[target], lon]),
+                               ref_lat, ref_lon)
+    leg = np.array([north[0], east[0]])
+    length_sq = float(leg @ leg)
+    t = 0.0 if length_sq == 0.0 else float(np.clip((north[1] * leg[0] + east[1] * leg[1]) / length_sq,
+                                                   0.0, 1.0))
+    point_lat, point_lon = ne_to_latlon(t * leg[0], t * leg[1], ref_lat, ref_lon)
+    alt = plan.alt[start] + t * (plan.alt[target] - plan.alt[start])
+    if plan.frame[start] != plan.frame[target]:
+        alt = plan.alt[target]
+    return t, float(point_lat), float(point_lon), float(alt)
+
+
+def resume_plan(plan, checkpoint, from_sprayed=False):
+    """
+    Builds the part of `plan` a checkpoint left unflown.
+
+    The interrupted leg is the one ending at the first positional item at or
+    after `checkpoint.current`. The new mission is: the original takeoff,
+    the speed and gimbal state in force on that leg, a waypoint at the
+    point of the leg nearest the last position (the last sprayed position
+    with `from_sprayed`), the trigger distance in force, and the rest of
+    the mission from the leg's end. Nothing before that point is flown
+    again, and the trigger only restarts once the vehicle is back on the
+    transect.
+
+    Returns:
+        (resumed CompiledPlan, item_map) where item_map holds each new
+        row's row in `plan`, or -1 for rows leading back to the transect.
+    """
+    checkpoint.check_plan(plan)
+    count = len(plan)
+    positional = np.flatnonzero(plan.waypoint_mask)
+    following = positional[positional >= max(checkpoint.current, 0)]
+    if len(following) == 0:
+        raise PlanError(f"Checkpoint is past the last waypoint ({checkpoint}); nothing to resume")
+    target = int(following[0])
+    before = positional[positional < target]
+    start = int(before[-1]) if len(before) else None
+
+    rows = []
+    if plan.has_takeoff:
+        rows.append(0)
+    trigger = None
+    for command in STATE_COMMANDS:
+        in_force = np.flatnonzero(plan.command[:target] == command)
+        if len(in_force) == 0:
+            continue
+        if command == MAV_CMD_DO_SET_CAM_TRIGG_DIST:
+            trigger = int(in_force[-1])
+        else:
+            rows.append(int(in_force[-1]))
+    rows.sort()
+    item_map = [-1] * len(rows)
+
+    resume = None
+    point = checkpoint.sprayed if from_sprayed and checkpoint.sprayed is not None else checkpoint.position
+    if start is not None and point is not None:
+        t, lat, lon, alt = _resume_point(plan, start, target, point[0], point[1])
+        if t < 1.0:
+            resume = (len(rows), lat, lon, alt)
+            rows.append(target)
+            item_map.append(-1)
+    if trigger is not None:
+        rows.append(trigger)
+        item_map.append(-1)
+    offset = len(rows)
+    rows.extend(range(target, count))
+    item_map.extend(range(target, count))
+
+    resumed = plan.take(np.array(rows, dtype=np.int64))
+    if resume is not None:
+        row, lat, lon, alt = resume
+        resumed.command[row] = MAV_CMD_NAV_WAYPOINT
+        resumed.params[row, :4] = (0.0, 0.0, 0.0, np.nan)
+        resumed.params[row, 4:] = (lat, lon, alt)
+        resumed.autocontinue[row] = True
+    for row in np.flatnonzero(resumed.command == MAV_CMD_DO_JUMP):
+        jump_target = int(resumed.params[row, 0])
+        resumed.params[row, 0] = offset + jump_target - target if jump_target >= target else offset
+    return resumed, np.array(item_map, dtype=np.int64)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the unflown part of a mission from a checkpoint.")
+    parser.add_argument("plan", help="QGroundControl .plan file the checkpoint was written for")
+    parser.add_argument("checkpoint", nargs="?", default=DEFAULT_CHECKPOINT_PATH)
+    parser.add_argument("--from-sprayed", action="store_true",
+                        help="Resume from the last sprayed position instead of the last position")
+    parser.add_argument("--tolerance", type=float, default=None,
+                        help="optimize_plan tolerance the mission was flown with (smart_sprayer's "
+                             "MISSION_TOLERANCE_M); defaults to the one stored in the checkpoint")
+    parser.add_argument("--list", action="store_true", help="Print the resumed items")
+    args = parser.parse_args()
+
+    plan = compile_plan(args.plan)
+    checkpoint = Checkpoint.load(args.checkpoint)
+    print(f"Checkpoint: {checkpoint}")
+    tolerance_m = args.tolerance if args.tolerance is not None else checkpoint.tolerance_m
+    if tolerance_m is not None:
+        plan, report = optimize_plan(plan, tolerance_m)
+        print(f"Optimized: {report}")
+    try:
+        resumed, item_map = resume_plan(plan, checkpoint, args.from_sprayed)
+    except PlanError as e:
+        raise SystemExit(f"Error: {e}")
+    print(f"Full mission: {estimate_mission(plan)}")
+    print(f"Resumed mission: {estimate_mission(resumed)} ({len(resumed)} items)")
+    if args.list:
+        for seq, (command, params, source) in enumerate(zip(resumed.command, resumed.params, item_map)):
+            print(f"{seq:4d} {command_name(command):<24} {params[0]:g} {params[4]:.7f} {params[5]:.7f} "
+                  f"{params[6]:g}  <- {source if source >= 0 else 'new'}")
+
+
+if __name__ == "__main__":
+    main()
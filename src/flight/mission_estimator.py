@@ -0,0 +1,201 @@
+import sys
+
+import numpy as np
+
+from geo import latlon_to_ne
+from plan_compiler import (MAV_CMD_DO_CHANGE_SPEED, MAV_CMD_DO_SET_CAM_TRIGG_DIST,
+                           MAV_CMD_NAV_RETURN_TO_LAUNCH, MAV_CMD_NAV_TAKEOFF, compile_plan)
+
+GRAVITY_M_S2 = 9.80665
+
+
+class VehicleProfile:
+    """
+    Performance numbers of the spray drone used by the estimator.
+
+    Power is modelled as hover power plus a term growing with the square of
+    ground speed; climbing adds the potential energy at `climb_efficiency`.
+    The spray volume is the boom flow while the trigger distance is set
+    plus an optional dose per trigger.
+    """
+
+    def __init__(self, mass_kg=25.0, hover_power_w=3500.0, forward_power_w_per_m2_s2=6.0,
+                 max_accel_m_s2=2.5, climb_rate_m_s=2.5, descent_rate_m_s=1.5,
+                 climb_efficiency=0.7, battery_wh=950.0, reserve_fraction=0.2, tank_l=10.0,
+                 spray_flow_l_min=1.5, dose_ml_per_trigger=0.0):
+        self.mass_kg = mass_kg
+        self.hover_power_w = hover_power_w
+        self.forward_power_w_per_m2_s2 = forward_power_w_per_m2_s2
+        self.max_accel_m_s2 = max_accel_m_s2
+        self.climb_rate_m_s = climb_rate_m_s
+        self.descent_rate_m_s = descent_rate_m_s
+        self.climb_efficiency = climb_efficiency
+        self.battery_wh = battery_wh
+        self.reserve_fraction = reserve_fraction
+        self.tank_l = tank_l
+        self.spray_flow_l_min = spray_flow_l_min
+        self.dose_ml_per_trigger = dose_ml_per_trigger
+
+    @property
+    def usable_wh(self) -> float:
+        return self.battery_wh * (1.0 - self.reserve_fraction)
+
+
+def _forward_fill(mask, values, initial):
+    """For each row, the value of the last masked row at or before it (else `initial`)."""
+    index = np.where(mask, np.arange(len(mask)), -1)
+    np.maximum.accumulate(index, out=index)
+    return np.where(index >= 0, values[np.maximum(index, 0)], initial)
+
+
+def leg_times(distance_m, v_entry, v_exit, v_max, accel):
+    """
+    Acceleration-limited time for every leg at once.
+
+    Each leg accelerates from `v_entry` towards `v_max` and brakes to
+    `v_exit` (trapezoid), or peaks below `v_max` when too short (triangle).
+    """
+    v_max = np.maximum(v_max, 1e-3)
+    ramp = (2.0 * v_max ** 2 - v_entry ** 2 - v_exit ** 2) / (2.0 * accel)
+    cruise = (v_max - v_entry) / accel + (v_max - v_exit) / accel + (distance_m - ramp) / v_max
+    v_peak = np.sqrt(np.maximum((2.0 * accel * distance_m + v_entry ** 2 + v_exit ** 2) / 2.0, 0.0))
+    short = (v_peak - v_entry) / accel + (v_peak - v_exit) / accel
+    return np.where(ramp <= distance_m, cruise, short)
+
+
+class MissionEstimate:
+    """Per-leg and total time, energy and spray volume for a mission."""
+
+    def __init__(self, profile, distance_m, climb_m, speed_m_s, time_s, energy_wh, spray_l,
+                 triggers):
+        self.profile = profile
+        self.distance_m = distance_m
+        self.climb_m = climb_m
+        self.speed_m_s = speed_m_s
+        self.time_s = time_s
+        self.energy_wh = energy_wh
+        self.spray_l = spray_l
+        self.triggers = triggers
+
+    def __len__(self):
+        return len(self.time_s)
+
+    @property
+    def total_time_s(self) -> float:
+        return float(self.time_s.sum())
+
+    @property
+    def total_energy_wh(self) -> float:
+        return float(self.energy_wh.sum())
+
+    @property
+    def total_spray_l(self) -> float:
+        return float(self.spray_l.sum())
+
+    @property
+    def total_distance_m(self) -> float:
+        return float(self.distance_m.sum())
+
+    @property
+    def fits_battery(self) -> bool:
+        return self.total_energy_wh <= self.profile.usable_wh
+
+    @property
+    def fits_tank(self) -> bool:
+        return self.total_spray_l <= self.profile.tank_l
+
+    def __str__(self):
+        minutes, seconds = divmod(self.total_time_s, 60)
+        battery = 100.0 * self.total_energy_wh / self.profile.battery_wh
+        tank = 100.0 * self.total_spray_l / self.profile.tank_l if self.profile.tank_l else 0.0
+        return (f"{len(self)} legs, {self.total_distance_m:.0f} m in {int(minutes)}m{seconds:02.0f}s, "
+                f"{self.total_energy_wh:.0f} Wh ({battery:.0f}% of battery"
+                f"{'' if self.fits_battery else ', OVER RESERVE'}), "
+                f"{self.total_spray_l:.1f} L ({tank:.0f}% of tank{'' if self.fits_tank else ', OVER'}), "
+                f"{int(self.triggers.sum())} triggers")
+
+
+def estimate_mission(plan, profile=None) -> MissionEstimate:
+    """
+    Estimates a CompiledPlan flown from its home position.
+
+    The path is home, takeoff climb, every positional item in order and,
+    if the plan ends in RTL, the flight home and the descent. Speeds follow
+    the plan's cruise speed and DO_CHANGE_SPEED items; the spray state
+    and trigger spacing follow DO_SET_CAM_TRIGG_DIST. Corners slow the
+    vehicle in proportion to the turn angle, and every leg is timed with
+    acceleration-limited kinematics, all vectorized over the legs.
+    """
+    profile = profile or VehicleProfile()
+    command = plan.command
+    rows = np.flatnonzero(plan.waypoint_mask)
+    if plan.home:
+        home_lat, home_lon = plan.home[0], plan.home[1]
+    else:
+        home_lat, home_lon = plan.lat[rows[0]], plan.lon[rows[0]]
+
+    # Per-row state after each DO item, looked up for the row before a leg's
+    # destination so a DO item placed after waypoint k applies to leg k -> k+1.
+    speed_rows = _forward_fill(command == MAV_CMD_DO_CHANGE_SPEED, plan.params[:, 1],
+                               plan.cruise_speed)
+    spacing_rows = _forward_fill(command == MAV_CMD_DO_SET_CAM_TRIGG_DIST, plan.params[:, 0], 0.0)
+    speed_rows = np.where(speed_rows > 0, speed_rows, plan.cruise_speed)
+
+    takeoff_rows = np.flatnonzero(command == MAV_CMD_NAV_TAKEOFF)
+    if len(takeoff_rows):
+        takeoff_alt = plan.alt[takeoff_rows[0]]
+    else:
+        takeoff_alt = plan.alt[rows[0]] if len(rows) else 0.0
+
+    # Path: home on the ground, home at takeoff altitude, every positional
+    # item, then home at the last altitude and on the ground again for RTL.
+    tail = 2 if np.any(command == MAV_CMD_NAV_RETURN_TO_LAUNCH) else 0
+    last_alt = plan.alt[rows[-1]] if len(rows) else takeoff_alt
+    lat = np.concatenate(([home_lat] * 2, plan.lat[rows], [home_lat] * tail))
+    lon = np.concatenate(([home_lon] * 2, plan.lon[rows], [home_lon] * tail))
+    alt = np.concatenate(([0.0, takeoff_alt], plan.alt[rows], [last_alt, 0.0][:tail]))
+    state_row = np.concatenate(([0, 0], np.maximum(rows - 1, 0),
+                                [len(plan) - 1] * tail)).astype(np.int64)
+
+    north, east = latlon_to_ne(np.array(lat), np.array(lon), home_lat, home_lon)
+    alt = np.nan_to_num(alt)
+    dn, de, dz = np.diff(north), np.diff(east), np.diff(alt)
+    distance = np.hypot(dn, de)
+    state = state_row[1:]
+    v_max = speed_rows[state]
+    spacing = spacing_rows[state]
+
+    # Turn angle at each interior point; vertical legs count as full stops.
+    heading = np.arctan2(de, dn)
+    turn = np.abs((np.diff(heading) + np.pi) % (2 * np.pi) - np.pi)
+    moving = distance > 1e-3
+    corner = np.where(moving[:-1] & moving[1:], 1.0 - turn / np.pi, 0.0)
+    corner_speed = corner * np.minimum(v_max[:-1], v_max[1:])
+    # Never faster than the vehicle can reach from rest on the shorter adjacent leg.
+    reachable = np.sqrt(2.0 * profile.max_accel_m_s2 * np.minimum(distance[:-1], distance[1:]))
+    corner_speed = np.minimum(corner_speed, reachable)
+    v_entry = np.concatenate(([0.0], corner_speed))
+    v_exit = np.concatenate((corner_speed, [0.0]))
+
+    horizontal = np.where(moving, leg_times(distance, v_entry, v_exit, v_max,
+                                            profile.max_accel_m_s2), 0.0)
+    vertical = np.where(dz > 0, dz / profile.climb_rate_m_s, -dz / profile.descent_rate_m_s)
+    time_s = np.maximum(horizontal, vertical)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_speed = np.where(time_s > 0, distance / time_s, 0.0)
+    power = profile.hover_power_w + profile.forward_power_w_per_m2_s2 * mean_speed ** 2
+    climb_j = profile.mass_kg * GRAVITY_M_S2 * np.maximum(dz, 0.0) / profile.climb_efficiency
+    energy_wh = (power * time_s + climb_j) / 3600.0
+
+    spraying = spacing > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        triggers = np.where(spraying, np.floor(distance / spacing), 0.0)
+    spray_l = (np.where(spraying, time_s * profile.spray_flow_l_min / 60.0, 0.0)
+               + triggers * profile.dose_ml_per_trigger / 1000.0)
+    return MissionEstimate(profile, distance, dz, v_max, time_s, energy_wh, spray_l, triggers)
+
+
+if __name__ == "__main__":
+    plan_path = sys.argv[1] if len(sys.argv) > 1 else "parker_farm_1.plan"
+    print(estimate_mission(compile_plan(plan_path)))
@@ -0,0 +1,200 @@
+import argparse
+
+import numpy as np
+
+from geo import latlon_to_ne
+from mav_codec import (MAV_CMD_DO_GIMBAL_MANAGER_PITCHYAW, MAV_CMD_DO_JUMP,
+                       MAV_CMD_DO_MOUNT_CONTROL, command_name)
+from mission_sync import estimate_upload_seconds
+from plan_compiler import (MAV_CMD_DO_CHANGE_SPEED, MAV_CMD_DO_SET_CAM_TRIGG_DIST,
+                           MAV_CMD_NAV_WAYPOINT, compile_plan)
+
+# DO commands that only set a state (speed, trigger spacing, gimbal angle);
+# repeating one with the values already in force changes nothing.
+STATE_COMMANDS = (MAV_CMD_DO_CHANGE_SPEED, MAV_CMD_DO_SET_CAM_TRIGG_DIST,
+                  MAV_CMD_DO_MOUNT_CONTROL, MAV_CMD_DO_GIMBAL_MANAGER_PITCHYAW)
+# Params that define each state command's state. DO_SET_CAM_TRIGG_DIST's
+# param3 ("trigger once now") is an action, not state, and is ignored.
+STATE_PARAMS = {MAV_CMD_DO_SET_CAM_TRIGG_DIST: [0, 1]}
+
+DEFAULT_TOLERANCE_M = 0.1
+COLLINEAR_TOLERANCE_M = 0.01
+
+
+def redundant_do_rows(plan):
+    """Rows of state DO items that repeat the values already in force."""
+    redundant = np.zeros(len(plan), dtype=bool)
+    for command in STATE_COMMANDS:
+        rows = np.flatnonzero(plan.command == command)
+        if len(rows) < 2:
+            continue
+        values = np.nan_to_num(plan.params[rows][:, STATE_PARAMS.get(command, slice(0, 7))], nan=np.inf)
+        redundant[rows[1:]] = np.all(values[1:] == values[:-1], axis=1)
+    return redundant
+
+
+def _segment_distance(points, a, b):
+    """Distance from each of `points` (N, 3) to the segment a-b."""
+    ab = b - a
+    length_sq = float(ab @ ab)
+    if length_sq == 0.0:
+        return np.linalg.norm(points - a, axis=1)
+    t = np.clip((points - a) @ ab / length_sq, 0.0, 1.0)
+    return np.linalg.norm(points - (a + t[:, None] * ab), axis=1)
+
+
+def douglas_peucker(points, tolerance_m):
+    """Mask of the points of an (N, 3) chain kept by Douglas-Peucker."""
+    keep = np.zeros(len(points), dtype=bool)
+    if len(points) == 0:
+        return keep
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        distance = _segment_distance(points[first + 1:last], points[first], points[last])
+        worst = int(np.argmax(distance))
+        if distance[worst] > tolerance_m:
+            split = first + 1 + worst
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return keep
+
+
+def path_deviation(points, keep):
+    """Distance from each dropped point of an (N, 3) path to the kept path."""
+    kept = np.flatnonzero(keep)
+    dropped = np.flatnonzero(~keep)
+    if len(dropped) == 0:
+        return np.empty(0)
+    slot = np.searchsorted(kept, dropped)
+    a, b, p = points[kept[slot - 1]], points[kept[slot]], points[dropped]
+    ab = b - a
+    length_sq = np.einsum("ij,ij->i", ab, ab)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = np.nan_to_num(np.clip(np.einsum("ij,ij->i", p - a, ab) / length_sq, 0.0, 1.0))
+    return np.linalg.norm(p - (a + t[:, None] * ab), axis=1)
+
+
+class OptimizationReport:
+    """What optimize_plan removed and what it saves on the link."""
+
+    def __init__(self, items_before, items_after, do_removed, collinear_removed,
+                 simplified_removed, max_deviation_m, tolerance_m, baud):
+        self.items_before = items_before
+        self.items_after = items_after
+        self.do_removed = do_removed
+        self.collinear_removed = collinear_removed
+        self.simplified_removed = simplified_removed
+        self.max_deviation_m = max_deviation_m
+        self.tolerance_m = tolerance_m
+        self.upload_s_before = estimate_upload_seconds(items_before, baud)
+        self.upload_s_after = estimate_upload_seconds(items_after, baud)
+
+    @property
+    def items_saved(self) -> int:
+        return self.items_before - self.items_after
+
+    @property
+    def upload_s_saved(self) -> float:
+        return self.upload_s_before - self.upload_s_after
+
+    def __str__(self):
+        return (f"{self.items_before} -> {self.items_after} items ({self.do_removed} repeated DO, "
+                f"{self.collinear_removed} collinear, {self.simplified_removed} simplified), "
+                f"max path deviation {self.max_deviation_m:.3f} m (tolerance {self.tolerance_m} m), "
+                f"upload ~{self.upload_s_before:.2f}s -> ~{self.upload_s_after:.2f}s")
+
+
+def optimize_plan(plan, tolerance_m=DEFAULT_TOLERANCE_M, baud=115200):
+    """
+    Shrinks a CompiledPlan before upload.
+
+    1. State DO items that repeat the values in force are dropped. For a
+       QGC survey that is every DO_SET_CAM_TRIGG_DIST after the first until
+       the spacing changes; the camera/sprayer keeps its spacing, only the
+       "trigger once now" at each transect start is lost.
+    2. In each chain of plain fly-through waypoints, Douglas-Peucker drops
+       every waypoint whose removal moves the path by at most `tolerance_m`
+       (3-D, metres). Dropped points within COLLINEAR_TOLERANCE_M of the
+       new path are reported as merged collinear legs, the rest as
+       simplified.
+
+    Any remaining DO item, non-waypoint nav item, held waypoint or DO_JUMP
+    target ends a chain, so spray on/off points and jump targets stay where
+    they were. DO_JUMP targets are renumbered.
+
+    Returns:
+        (optimized CompiledPlan, OptimizationReport)
+    """
+    count = len(plan)
+    keep = ~redundant_do_rows(plan)
+    do_removed = int(count - keep.sum())
+
+    jumps = np.flatnonzero(plan.command == MAV_CMD_DO_JUMP)
+    targets = plan.params[jumps, 0].astype(np.int64) if len(jumps) else np.empty(0, np.int64)
+    pinned = np.zeros(count, dtype=bool)
+    pinned[targets[(targets >= 0) & (targets < count)]] = True
+
+    # A chain is a run of kept rows that are plain fly-through waypoints.
+    # Any other kept row ends it, so the waypoints next to a DO item or
+    # another nav item are chain ends and never dropped.
+    ref_lat, ref_lon = (plan.home[0], plan.home[1]) if plan.home else (0.0, 0.0)
+    north, east = latlon_to_ne(plan.lat, plan.lon, ref_lat, ref_lon)
+    xyz = np.column_stack((north, east, plan.alt))
+    movable = ((plan.command == MAV_CMD_NAV_WAYPOINT) & (np.nan_to_num(plan.params[:, 0]) == 0)
+               & plan.autocontinue & ~pinned)
+    rows = np.flatnonzero(keep)
+    chain_id = np.cumsum(~movable[rows] | np.r_[True, plan.frame[rows][1:] != plan.frame[rows][:-1]])
+    rows, chain_id = rows[movable[rows]], chain_id[movable[rows]]
+    starts = np.flatnonzero(np.r_[True, chain_id[1:] != chain_id[:-1]])
+    ends = np.r_[starts[1:], len(rows)]
+
+    deviation = []
+    for start, end in zip(starts, ends):
+        if end - start < 3:
+            continue
+        chain = rows[start:end]
+        chain_keep = douglas_peucker(xyz[chain], tolerance_m)
+        deviation.append(path_deviation(xyz[chain], chain_keep))
+        keep[chain[~chain_keep]] = False
+    deviation = np.concatenate(deviation) if deviation else np.empty(0)
+    collinear_removed = int(np.sum(deviation <= min(COLLINEAR_TOLERANCE_M, tolerance_m)))
+    simplified_removed = len(deviation) - collinear_removed
+    max_deviation = float(deviation.max()) if len(deviation) else 0.0
+
+    optimized = plan.take(np.flatnonzero(keep))
+    if len(jumps):
+        new_index = np.cumsum(keep) - 1
+        kept_rows = np.flatnonzero(keep)
+        for row in np.flatnonzero(optimized.command == MAV_CMD_DO_JUMP):
+            target = int(optimized.params[row, 0])
+            following = kept_rows[kept_rows >= target]
+            optimized.params[row, 0] = new_index[following[0]] if len(following) else len(optimized) - 1
+    report = OptimizationReport(count, len(optimized), do_removed, collinear_removed,
+                                simplified_removed, max_deviation, tolerance_m, baud)
+    return optimized, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shrink a QGC plan's mission before upload.")
+    parser.add_argument("plan", help="QGroundControl .plan file")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE_M,
+                        help="Largest allowed path deviation in metres")
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument("--list", action="store_true", help="Print the optimized items")
+    args = parser.parse_args()
+
+    optimized, report = optimize_plan(compile_plan(args.plan), args.tolerance, args.baud)
+    print(report)
+    if args.list:
+        for seq, (command, params) in enumerate(zip(optimized.command, optimized.params)):
+            print(f"{seq:4d} {command_name(command):<24} {params[0]:g} {params[4]:.7f} "
+                  f"{params[5]:.7f} {params[6]:g}")
+
+
+if __name__ == "__main__":
+    main()
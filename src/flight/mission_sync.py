@@ -0,0 +1,272 @@
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from mav_codec import HOME_ITEMS
+from params import cache_key, hardware_uid
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".mission_cache")
+CACHE_VERSION = 1
+
+# Fields compared between the local and on-vehicle mission. `seq` and
+# `current` are deliberately left out: they describe position, not content.
+RAW_FIELDS = ("frame", "command", "autocontinue", "param1", "param2", "param3", "param4",
+              "x", "y", "z", "mission_type")
+MISSION_FIELDS = ("latitude_deg", "longitude_deg", "relative_altitude_m", "speed_m_s",
+                  "is_fly_through", "gimbal_pitch_deg", "gimbal_yaw_deg", "camera_action",
+                  "loiter_time_s", "camera_photo_interval_s", "acceptance_radius_m", "yaw_deg",
+                  "camera_photo_distance_m", "vehicle_action")
+
+# MAVLink 2 wire sizes: 12 bytes of framing plus the payload of each message
+# in the mission upload handshake.
+MAVLINK_OVERHEAD_BYTES = 12
+MISSION_ITEM_INT_BYTES = 38 + MAVLINK_OVERHEAD_BYTES
+MISSION_REQUEST_INT_BYTES = 5 + MAVLINK_OVERHEAD_BYTES
+MISSION_COUNT_BYTES = 9 + MAVLINK_OVERHEAD_BYTES
+MISSION_ACK_BYTES = 8 + MAVLINK_OVERHEAD_BYTES
+
+
+def estimate_upload_seconds(item_count, baud=115200, round_trip_s=0.0):
+    """
+    Lower bound on the time to upload `item_count` items over a serial link.
+
+    Each item costs a MISSION_REQUEST_INT from the vehicle and a
+    MISSION_ITEM_INT in reply; `round_trip_s` adds per-item link latency.
+    A download is the same handshake in the other direction, so this is
+    its cost too.
+    """
+    if item_count == 0:
+        return 0.0
+    wire_bytes = (MISSION_COUNT_BYTES + MISSION_ACK_BYTES
+                  + item_count * (MISSION_ITEM_INT_BYTES + MISSION_REQUEST_INT_BYTES))
+    return wire_bytes * 10.0 / baud + item_count * round_trip_s
+
+
+def _number(value):
+    value = getattr(value, "value", value)  # Enums compare by value.
+    return float(value)
+
+
+def item_table(items):
+    """Returns an (N, F) float64 table of the compared fields of raw or mission items."""
+    if len(items) == 0:
+        return np.empty((0, len(RAW_FIELDS)))
+    fields = RAW_FIELDS if hasattr(items[0], "command") else MISSION_FIELDS
+    return np.array([[_number(getattr(item, field)) for field in fields] for item in items],
+                    dtype=np.float64).reshape(len(items), len(fields))
+
+
+def mission_hash(table) -> str:
+    """Content hash of an item table; NaNs and signed zeros are canonicalized."""
+    canonical = np.where(np.isnan(table), np.nan, table + 0.0)
+    digest = hashlib.sha256(np.ascontiguousarray(canonical).tobytes())
+    digest.update(str(table.shape).encode())
+    return digest.hexdigest()
+
+
+def first_difference(a, b) -> int:
+    """Index of the first row that differs between two tables (NaN == NaN)."""
+    n = min(len(a), len(b))
+    if a.shape[1:] != b.shape[1:]:
+        return 0
+    same = (a[:n] == b[:n]) | (np.isnan(a[:n]) & np.isnan(b[:n]))
+    differing = np.flatnonzero(~same.all(axis=1))
+    return int(differing[0]) if len(differing) else n
+
+
+class UploadReport:
+    """What an upload did and how long it took."""
+
+    def __init__(self, total_items, sent_items, first_changed, elapsed_s, estimated_link_s,
+                 skipped=False, downloaded_items=None):
+        self.total_items = total_items
+        self.sent_items = sent_items
+        self.first_changed = first_changed
+        self.elapsed_s = elapsed_s  # Including any download.
+        self.estimated_link_s = estimated_link_s  # Download and upload.
+        self.skipped = skipped
+        self.downloaded_items = downloaded_items  # None when compared against the cache.
+
+    @property
+    def tail_only(self) -> bool:
+        """True when only the tail after the current item was sent."""
+        return not self.skipped and self.sent_items < self.total_items
+
+    def __str__(self):
+        downloaded = (f", downloaded {self.downloaded_items} items to compare"
+                      if self.downloaded_items is not None else "")
+        if self.skipped:
+            return (f"Mission unchanged ({self.total_items} items), upload skipped "
+                    f"in {self.elapsed_s:.2f}s (~{self.estimated_link_s:.1f}s on the serial link"
+                    f"{downloaded})")
+        return (f"Sent {self.sent_items}/{self.total_items} items in {self.elapsed_s:.2f}s "
+                f"(first change at item {self.first_changed}, "
+                f"~{self.estimated_link_s:.1f}s on the serial link{downloaded})")
+
+
+class MissionSync:
+    """
+    Uploads missions only when they differ from what the vehicle already has.
+
+    The vehicle's mission is downloaded once and then tracked locally; a
+    `mission_changed` notification from the vehicle drops the local copy so
+    the next upload compares against a fresh download. The last mission
+    uploaded is also kept under `cache_dir`, keyed by the autopilot's
+    hardware UID as ParamSync does, so a new process skips the download
+    too. That copy cannot see a mission another ground station wrote while
+    no MissionSync was watching; pass `refresh=True` to upload() to compare
+    against a download regardless.
+
+    MAVSDK does not expose MAVLink partial mission writes, so a changed tail
+    is sent on its own only when the vehicle has already flown past the
+    unchanged prefix (`current_index`): the tail becomes the new mission and
+    flying resumes from its first item. Otherwise the whole mission is sent.
+
+    Raw missions start with ArduPilot's seq 0 home item (mav_codec.HOME_ITEMS),
+    which the autopilot rewrites with its own home. It is left out of every
+    comparison and index, and kept at seq 0 of a tail upload.
+    """
+
+    def __init__(self, system, baud=115200, vehicle_id=None, cache_dir=DEFAULT_CACHE_DIR):
+        self.system = system
+        self.baud = baud
+        self.vehicle_id = vehicle_id
+        self.cache_dir = cache_dir
+        self._vehicle_tables = {}
+        self._watch_task = None
+        self._identified = False
+
+    async def _watch_changes(self):
+        async for _ in self.system.mission_raw.mission_changed():
+            self._vehicle_tables.clear()
+            for key in ("raw", "mission"):
+                path = self._cache_path(key)
+                if path is not None and os.path.exists(path):
+                    os.remove(path)
+
+    def _start_watch(self):
+        if self._watch_task is None or self._watch_task.done():
+            self._watch_task = asyncio.create_task(self._watch_changes())
+
+    async def _identify(self):
+        """Sets `vehicle_id` from the autopilot's hardware UID, once."""
+        if not self._identified:
+            self._identified = True
+            if self.vehicle_id is None:
+                self.vehicle_id = await hardware_uid(self.system)
+
+    def _cache_path(self, key):
+        if self.cache_dir is None or self.vehicle_id is None:
+            return None
+        return os.path.join(self.cache_dir, f"{cache_key(self.vehicle_id)}.{key}.npz")
+
+    def _load_cached(self, key):
+        path = self._cache_path(key)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                meta = json.loads(str(data["meta"]))
+                table = data["table"]
+        except (OSError, ValueError, KeyError):
+            return None
+        if meta.get("version") != CACHE_VERSION or meta.get("hash") != mission_hash(table):
+            return None
+        return table
+
+    def _store(self, key, table):
+        self._vehicle_tables[key] = table
+        path = self._cache_path(key)
+        if path is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        meta = {"version": CACHE_VERSION, "hash": mission_hash(table), "saved_at": time.time()}
+        with open(tmp_path, "wb") as f:
+            np.savez(f, table=table, meta=np.array(json.dumps(meta)))
+        os.replace(tmp_path, path)
+
+    async def _vehicle_table(self, raw, refresh=False):
+        """Returns (table, items downloaded to get it, or None if it was cached)."""
+        key = "raw" if raw else "mission"
+        if not refresh:
+            table = self._vehicle_tables.get(key)
+            if table is None:
+                table = self._load_cached(key)
+            if table is not None:
+                self._vehicle_tables[key] = table
+                return table, None
+        if raw:
+            downloaded = list(await self.system.mission_raw.download_mission())
+        else:
+            downloaded = list((await self.system.mission.download_mission()).mission_items)
+        table = item_table(downloaded[HOME_ITEMS if raw else 0:])
+        self._store(key, table)
+        return table, len(downloaded)
+
+    async def upload(self, items, current_index=None, refresh=False) -> UploadReport:
+        """
+        Makes the vehicle's mission equal to `items` (mission_raw or mission items).
+
+        A tail upload replaces the vehicle's mission with the home item and
+        the tail, numbered from the start, and leaves the vehicle's current
+        item as it was: the caller must set it to 0 (Drone.upload_mission
+        does), or check `UploadReport.tail_only`.
+
+        Args:
+            items: The full mission; raw items start with the home item.
+            current_index: Item the vehicle is currently flying, for in-field
+                replans; enables tail-only uploads. Like mission progress, it
+                does not count the home item.
+            refresh: Compare against a fresh download, not the cached copy.
+        """
+        items = list(items)
+        raw = len(items) > 0 and hasattr(items[0], "command")
+        home = HOME_ITEMS if raw else 0
+        started = time.monotonic()
+        self._start_watch()
+        await self._identify()
+
+        local = item_table(items[home:])
+        downloaded = None
+        try:
+            vehicle, downloaded = await self._vehicle_table(raw, refresh)
+        except Exception:
+            vehicle = None  # Nothing downloadable; fall back to a full upload.
+        download_s = estimate_upload_seconds(downloaded or 0, self.baud)
+
+        if vehicle is not None and vehicle.shape == local.shape \
+                and mission_hash(vehicle) == mission_hash(local):
+            return UploadReport(len(items), 0, len(items), time.monotonic() - started, download_s,
+                                skipped=True, downloaded_items=downloaded)
+
+        first = first_difference(local, vehicle) if vehicle is not None else 0
+        send = items
+        if current_index is not None and 0 < current_index <= first and current_index < len(local):
+            send = items[:home] + items[home + current_index:]
+            if raw:
+                send = [copy.copy(item) for item in send]
+                for seq, item in enumerate(send):
+                    item.seq = seq
+                    item.current = int(seq == 0)
+
+        if raw:
+            await self.system.mission_raw.upload_mission(send)
+        else:
+            from mavsdk.mission import MissionPlan
+            await self.system.mission.upload_mission(MissionPlan(send))
+        self._store("raw" if raw else "mission", item_table(send[home:]))
+
+        return UploadReport(len(items), len(send), first, time.monotonic() - started,
+                            download_s + estimate_upload_seconds(len(send), self.baud),
+                            downloaded_items=downloaded)
+
+    async def close(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            self._watch_task = None
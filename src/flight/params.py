@@ -0,0 +1,322 @@
+import asyncio
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+# ArduPilot parameter names are at most 16 characters.
+NAME_DTYPE = "<U16"
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".param_cache")
+CACHE_VERSION = 1
+
+# Relative/absolute tolerance for float comparisons. The vehicle stores
+# float32 and .parm files are written with 6 decimals, so exact equality would
+# flag nearly every float parameter as changed.
+FLOAT_RTOL = 1e-6
+FLOAT_ATOL = 1e-6
+
+_LINE = re.compile(r"^\s*([A-Za-z0-9_]+)[\s,]+([-+0-9.eE]+)\s*(?:#.*)?$")
+
+
+class ParamError(ValueError):
+    """Raised when a parameter file cannot be parsed."""
+
+
+class ParamTable:
+    """
+    Parameters as three parallel arrays sorted by name: `names`, `values`
+    (float64) and `is_int`. Sorting makes lookups and diffs a searchsorted or
+    an intersect over the whole set rather than a per-name loop.
+    """
+
+    def __init__(self, names, values, is_int):
+        names = np.asarray(names, dtype=NAME_DTYPE)
+        order = np.argsort(names, kind="stable")
+        self.names = names[order]
+        self.values = np.asarray(values, dtype=np.float64)[order]
+        self.is_int = np.asarray(is_int, dtype=bool)[order]
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return self._index(name) is not None
+
+    def _index(self, name):
+        i = int(np.searchsorted(self.names, name))
+        return i if i < len(self.names) and self.names[i] == name else None
+
+    def get(self, name, default=None):
+        """Returns a parameter value (int for integer parameters), or `default`."""
+        i = self._index(name)
+        if i is None:
+            return default
+        return int(self.values[i]) if self.is_int[i] else float(self.values[i])
+
+    def items(self):
+        for name, value, is_int in zip(self.names.tolist(), self.values.tolist(), self.is_int.tolist()):
+            yield name, int(value) if is_int else value
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Parses a .parm file ("NAME value" per line, as saved by MAVProxy or
+        Mission Planner). Values written without a decimal point are integers.
+
+        Raises:
+            FileNotFoundError: If the file does not exist.
+            ParamError: If a line is not a name/value pair.
+        """
+        names, values, is_int = [], [], []
+        with open(path) as f:
+            for line_number, line in enumerate(f, 1):
+                stripped = line.strip()
+                if not stripped or stripped.startswith("#"):
+                    continue
+                match = _LINE.match(stripped)
+                if match is None:
+                    raise ParamError(f"{path}:{line_number}: cannot parse '{stripped}'")
+                name, text = match.groups()
+                try:
+                    value = float(text)
+                except ValueError:
+                    raise ParamError(f"{path}:{line_number}: bad value '{text}'") from None
+                names.append(name)
+                values.append(value)
+                is_int.append(not any(c in text for c in ".eE"))
+        return cls(names, values, is_int)
+
+    @classmethod
+    def from_all_params(cls, all_params):
+        """Builds a table from mavsdk.param.AllParams (int and float params)."""
+        ints = list(all_params.int_params)
+        floats = list(all_params.float_params)
+        return cls([p.name for p in ints] + [p.name for p in floats],
+                   [p.value for p in ints] + [p.value for p in floats],
+                   [True] * len(ints) + [False] * len(floats))
+
+    def save(self, path):
+        """Writes the table to an .npz file atomically."""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        meta = {"version": CACHE_VERSION, "saved_at": time.time()}
+        with open(tmp_path, "wb") as f:
+            np.savez(f, names=self.names, values=self.values, is_int=self.is_int,
+                     meta=np.array(json.dumps(meta)))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Reads a table written with `save`; returns (table, saved_at)."""
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta.get("version") != CACHE_VERSION:
+                raise ParamError(f"Cached parameters {path} have version {meta.get('version')}")
+            return cls(data["names"], data["values"], data["is_int"]), meta["saved_at"]
+
+    def diff(self, desired):
+        """
+        Compares this (vehicle) table with `desired`.
+
+        Returns:
+            ParamDiff listing the parameters whose desired value differs and
+            the desired names the vehicle does not have.
+        """
+        common, ours, theirs = np.intersect1d(self.names, desired.names, assume_unique=True,
+                                              return_indices=True)
+        current = self.values[ours]
+        wanted = desired.values[theirs]
+        is_int = self.is_int[ours]
+        same = np.where(is_int, np.round(current) == np.round(wanted),
+                        np.isclose(current, wanted, rtol=FLOAT_RTOL, atol=FLOAT_ATOL))
+        changed = ~same
+        unknown = np.setdiff1d(desired.names, self.names, assume_unique=True)
+        return ParamDiff(common[changed], current[changed], wanted[changed], is_int[changed],
+                         unknown.tolist())
+
+
+class ParamDiff:
+    """Parameters to change: parallel arrays of names, current and desired values."""
+
+    def __init__(self, names, current, desired, is_int, unknown):
+        self.names = names
+        self.current = current
+        self.desired = desired
+        self.is_int = is_int
+        self.unknown = unknown
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        for name, current, desired, is_int in zip(self.names.tolist(), self.current.tolist(),
+                                                  self.desired.tolist(), self.is_int.tolist()):
+            if is_int:
+                yield name, int(round(current)), int(round(desired)), True
+            else:
+                yield name, current, desired, False
+
+    def __str__(self):
+        lines = [f"{name:<16} {current!r:>12} -> {desired!r}" for name, current, desired, _ in self]
+        if self.unknown:
+            lines.append(f"Not on vehicle: {', '.join(self.unknown)}")
+        return "\n".join(lines) if lines else "No parameter changes"
+
+
+class ParamWriteReport:
+    """What a parameter sync wrote and how long it took."""
+
+    def __init__(self, written, failed, unknown, elapsed_s):
+        self.written = written
+        self.failed = failed
+        self.unknown = unknown
+        self.elapsed_s = elapsed_s
+
+    @property
+    def ok(self):
+        return not self.failed
+
+    def __str__(self):
+        text = f"Wrote {len(self.written)} parameters in {self.elapsed_s:.2f}s"
+        if self.failed:
+            text += f", {len(self.failed)} failed ({', '.join(self.failed)})"
+        if self.unknown:
+            text += f", {len(self.unknown)} not on vehicle"
+        return text
+
+
+def cache_key(vehicle_id):
+    """File-name-safe form of a vehicle id, for per-vehicle caches."""
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", vehicle_id)
+
+
+async def hardware_uid(system):
+    """
+    The autopilot's hardware UID (info.get_identification), or None when it
+    cannot be read or is empty or all zeros, as on some SITL builds.
+    """
+    try:
+        uid = (await system.info.get_identification()).hardware_uid
+    except Exception:
+        return None
+    return uid if uid and uid.strip("0") else None
+
+
+class ParamSync:
+    """
+    Brings a vehicle's parameters in line with a .parm file.
+
+    The vehicle's full parameter set is fetched with one get_all_params call
+    and cached in memory and under `cache_dir`, so repeated pre-flight checks
+    within `max_age_s` need no link traffic. The disk cache is keyed by the
+    autopilot's hardware UID (info.get_identification), not by how it is
+    connected, so a different vehicle on the same port never reads another's
+    snapshot; without a UID only the in-memory copy is kept. Pass
+    `vehicle_id` to name the vehicle yourself.
+
+    apply() fetches a fresh snapshot by default and writes only the values
+    that differ from it, with at most `max_in_flight` set requests
+    outstanding at once; successful writes update the cached snapshot.
+    """
+
+    def __init__(self, system, vehicle_id=None, cache_dir=DEFAULT_CACHE_DIR,
+                 max_age_s=600.0, max_in_flight=8):
+        self.system = system
+        self.vehicle_id = vehicle_id
+        self.cache_dir = cache_dir
+        self.max_age_s = max_age_s
+        self.max_in_flight = max_in_flight
+        self.cache_path = None
+        self._snapshot = None
+        self._snapshot_time = None
+        self._identified = False
+
+    async def _identify(self):
+        """Sets cache_path from `vehicle_id` or the autopilot's hardware UID, once."""
+        if self._identified:
+            return
+        self._identified = True
+        vehicle_id = self.vehicle_id
+        if vehicle_id is None:
+            vehicle_id = await hardware_uid(self.system)
+            if vehicle_id is None:
+                print("   [Params] Autopilot has no hardware UID, parameters are not cached on disk")
+                return
+            self.vehicle_id = vehicle_id
+        if self.cache_dir is not None:
+            self.cache_path = os.path.join(self.cache_dir, f"{cache_key(vehicle_id)}.npz")
+
+    def _load_cached(self):
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return None
+        try:
+            table, saved_at = ParamTable.load(self.cache_path)
+        except (OSError, ValueError, KeyError):
+            return None
+        if time.time() - saved_at > self.max_age_s:
+            return None
+        self._snapshot_time = saved_at
+        return table
+
+    def _store(self, table):
+        self._snapshot = table
+        self._snapshot_time = time.time()
+        if self.cache_path is not None:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            table.save(self.cache_path)
+
+    async def snapshot(self, refresh=False) -> ParamTable:
+        """Returns the vehicle's parameters, from cache unless `refresh` or stale."""
+        await self._identify()
+        if not refresh:
+            if self._snapshot is not None and time.time() - self._snapshot_time <= self.max_age_s:
+                return self._snapshot
+            cached = self._load_cached()
+            if cached is not None:
+                self._snapshot = cached
+                return cached
+        table = ParamTable.from_all_params(await self.system.param.get_all_params())
+        self._store(table)
+        return table
+
+    async def diff(self, desired, refresh=False) -> ParamDiff:
+        """Diffs the vehicle against `desired` (a ParamTable or .parm path)."""
+        if not isinstance(desired, ParamTable):
+            desired = ParamTable.from_file(desired)
+        return (await self.snapshot(refresh)).diff(desired)
+
+    async def _write(self, semaphore, name, value, is_int):
+        async with semaphore:
+            if is_int:
+                await self.system.param.set_param_int(name, int(value))
+            else:
+                await self.system.param.set_param_float(name, float(value))
+
+    async def apply(self, desired, refresh=True) -> ParamWriteReport:
+        """
+        Writes every parameter that differs from `desired` and returns a
+        report. Unless `refresh` is False the comparison is against values
+        read from the vehicle just now, not the cache.
+        """
+        started = time.monotonic()
+        changes = await self.diff(desired, refresh)
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        entries = [(name, value, is_int) for name, _, value, is_int in changes]
+        results = await asyncio.gather(*(self._write(semaphore, *entry) for entry in entries),
+                                       return_exceptions=True)
+
+        written, failed = [], {}
+        for (name, value, _), result in zip(entries, results):
+            if isinstance(result, BaseException):
+                failed[name] = result
+            else:
+                written.append(name)
+
+        if written:
+            snapshot = self._snapshot
+            index = np.searchsorted(snapshot.names, np.array(written, dtype=NAME_DTYPE))
+            values = snapshot.values.copy()
+            values[index] = [value for name, value, _ in entries if name not in failed]
+            self._store(ParamTable(snapshot.names, values, snapshot.is_int))
+        return ParamWriteReport(written, failed, changes.unknown, time.monotonic() - started)
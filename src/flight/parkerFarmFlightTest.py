@@ -39,10 +39,8 @@ async def run():
     await drone.return_to_launch()
 
     # Wait for the drone to land
-    async for in_air in drone.system.telemetry.in_air():
-        if not in_air:
-            print("--> Drone has landed.")
-            break
+    await drone.wait_for_landed()
+    print("--> Drone has landed.")
     
     await drone.disarm()
 
@@ -0,0 +1,250 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# Bump whenever the on-disk cache layout or the flattening rules change.
+COMPILER_VERSION = 2
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".plan_cache")
+
+MAV_CMD_NAV_WAYPOINT = 16
+MAV_CMD_NAV_LOITER_UNLIM = 17
+MAV_CMD_NAV_LOITER_TURNS = 18
+MAV_CMD_NAV_LOITER_TIME = 19
+MAV_CMD_NAV_RETURN_TO_LAUNCH = 20
+MAV_CMD_NAV_LAND = 21
+MAV_CMD_NAV_TAKEOFF = 22
+MAV_CMD_NAV_LOITER_TO_ALT = 31
+MAV_CMD_DO_JUMP = 177
+MAV_CMD_DO_CHANGE_SPEED = 178
+MAV_CMD_DO_SET_CAM_TRIGG_DIST = 206
+
+MAV_FRAME_MISSION = 2
+MAV_FRAME_GLOBAL_RELATIVE_ALT = 3
+MAV_FRAME_GLOBAL_TERRAIN_ALT = 10
+
+# Nav commands whose params 5-7 hold a real lat/lon/alt the vehicle flies to.
+NAV_POSITION_COMMANDS = (
+    MAV_CMD_NAV_WAYPOINT,
+    MAV_CMD_NAV_LOITER_UNLIM,
+    MAV_CMD_NAV_LOITER_TURNS,
+    MAV_CMD_NAV_LOITER_TIME,
+    MAV_CMD_NAV_LAND,
+    MAV_CMD_NAV_LOITER_TO_ALT,
+)
+
+
+class PlanError(ValueError):
+    """Raised when a .plan file cannot be compiled into mission items."""
+
+
+class CompiledPlan:
+    """
+    Columnar representation of a QGroundControl mission.
+
+    One row per MAVLink mission item, with survey ComplexItems already expanded
+    into their individual waypoints and DO items. `params` holds the seven raw
+    MAVLink params (NaN where QGC wrote null); `lat`, `lon` and `alt` are
+    params 5-7 split out for vectorized geometry.
+    """
+
+    def __init__(self, command, frame, params, autocontinue, cruise_speed=8.0,
+                 hover_speed=5.0, home=None, geofence=None, source_hash=None):
+        self.command = np.asarray(command, dtype=np.uint16)
+        self.frame = np.asarray(frame, dtype=np.uint8)
+        self.params = np.asarray(params, dtype=np.float64).reshape(-1, 7)
+        self.autocontinue = np.asarray(autocontinue, dtype=bool)
+        self.cruise_speed = float(cruise_speed)
+        self.hover_speed = float(hover_speed)
+        self.home = tuple(home) if home is not None else None
+        self.geofence = geofence if geofence is not None else {}
+        self.source_hash = source_hash
+
+    def __len__(self):
+        return len(self.command)
+
+    @property
+    def lat(self):
+        return self.params[:, 4]
+
+    @property
+    def lon(self):
+        return self.params[:, 5]
+
+    @property
+    def alt(self):
+        return self.params[:, 6]
+
+    @property
+    def waypoint_mask(self):
+        """Boolean mask of items that fly to a lat/lon position."""
+        return np.isin(self.command, NAV_POSITION_COMMANDS)
+
+    @property
+    def has_takeoff(self) -> bool:
+        return len(self) > 0 and self.command[0] == MAV_CMD_NAV_TAKEOFF
+
+    @property
+    def has_rtl(self) -> bool:
+        return bool(np.any(self.command == MAV_CMD_NAV_RETURN_TO_LAUNCH))
+
+    def waypoints(self):
+        """Returns an (N, 3) array of lat, lon, alt for every positional item."""
+        return self.params[self.waypoint_mask][:, 4:7]
+
+    def take(self, index):
+        """Returns a new plan holding the selected rows, sharing the metadata."""
+        return CompiledPlan(self.command[index], self.frame[index], self.params[index],
+                            self.autocontinue[index], self.cruise_speed, self.hover_speed,
+                            self.home, self.geofence, self.source_hash)
+
+    def to_mission_raw_items(self):
+        """
+        Builds mavsdk.mission_raw.MissionItem objects for every row.
+
+        This is the lossless path: RTL, trigger-distance and any other DO items
+        are uploaded exactly as they appear in the plan. The items start with
+        ArduPilot's seq 0 home item (see mav_codec.HOME_ITEMS).
+        """
+        from mav_codec import plan_to_raw
+        return plan_to_raw(self)
+
+    def to_mission_items(self):
+        """
+        Builds mavsdk.mission.MissionItem objects for the mission plugin.
+
+        DO_SET_CAM_TRIGG_DIST, DO_CHANGE_SPEED and the other DO items in
+        mav_codec.COMMANDS are folded into the nav item they follow. RTL has
+        no mission-plugin equivalent and is left to the caller (see
+        `has_rtl`); use `to_mission_raw_items` for full fidelity.
+        """
+        from mav_codec import plan_to_mission_items
+        return plan_to_mission_items(self)
+
+    def save(self, path):
+        """Writes the plan to an .npz file atomically."""
+        meta = {
+            "version": COMPILER_VERSION,
+            "cruise_speed": self.cruise_speed,
+            "hover_speed": self.hover_speed,
+            "home": self.home,
+            "geofence": self.geofence,
+            "source_hash": self.source_hash,
+        }
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, command=self.command, frame=self.frame, params=self.params,
+                     autocontinue=self.autocontinue, meta=np.array(json.dumps(meta)))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Reads a plan previously written with `save`."""
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta.get("version") != COMPILER_VERSION:
+                raise PlanError(f"Cached plan {path} was written by compiler version {meta.get('version')}")
+            return cls(data["command"], data["frame"], data["params"], data["autocontinue"],
+                       meta["cruise_speed"], meta["hover_speed"], meta["home"],
+                       meta["geofence"], meta["source_hash"])
+
+
+def _flatten_items(items, out):
+    """Appends every SimpleItem in `items` to `out`, expanding ComplexItems in order."""
+    for item in items:
+        item_type = item.get("type")
+        if item_type == "SimpleItem":
+            out.append(item)
+        elif item_type == "ComplexItem":
+            transect = item.get("TransectStyleComplexItem")
+            if transect is None or "Items" not in transect:
+                raise PlanError(f"Unsupported ComplexItem '{item.get('complexItemType')}'")
+            _flatten_items(transect["Items"], out)
+        else:
+            raise PlanError(f"Unknown mission item type '{item_type}'")
+    return out
+
+
+def _resolve_jumps(simple_items, command, params):
+    """
+    Rewrites DO_JUMP param1 from the target's QGC doJumpId to its row.
+
+    Expanding ComplexItems moves every later item to a new row, so the
+    doJumpId is the only stable reference; rows are what the rest of the
+    repo indexes by (see mission_optimizer and resume_plan).
+    """
+    jumps = np.flatnonzero(command == MAV_CMD_DO_JUMP)
+    if len(jumps) == 0:
+        return
+    row_of = {item["doJumpId"]: row for row, item in enumerate(simple_items) if "doJumpId" in item}
+    for row in jumps:
+        target = row_of.get(int(params[row, 0]))
+        if target is None:
+            raise PlanError(f"DO_JUMP at item {row} targets unknown doJumpId {params[row, 0]:g}")
+        params[row, 0] = target
+
+
+def compile_plan_data(plan_data, source_hash=None) -> CompiledPlan:
+    """Compiles an already-decoded .plan dictionary into a CompiledPlan."""
+    mission = plan_data.get("mission")
+    if not mission or "items" not in mission:
+        raise PlanError("Plan has no mission items")
+
+    simple_items = _flatten_items(mission["items"], [])
+    count = len(simple_items)
+    command = np.fromiter((item["command"] for item in simple_items), dtype=np.uint16, count=count)
+    frame = np.fromiter((item.get("frame", MAV_FRAME_GLOBAL_RELATIVE_ALT) for item in simple_items),
+                        dtype=np.uint8, count=count)
+    autocontinue = np.fromiter((item.get("autoContinue", True) for item in simple_items),
+                               dtype=bool, count=count)
+
+    # QGC always writes seven params; nulls become NaN in a single conversion.
+    raw_params = [(item.get("params") or [])[:7] for item in simple_items]
+    if any(len(p) != 7 for p in raw_params):
+        raise PlanError("Mission item with fewer than 7 params")
+    params = np.array(raw_params, dtype=np.float64).reshape(count, 7)
+    _resolve_jumps(simple_items, command, params)
+
+    return CompiledPlan(command, frame, params, autocontinue,
+                        cruise_speed=mission.get("cruiseSpeed") or 8.0,
+                        hover_speed=mission.get("hoverSpeed") or 5.0,
+                        home=mission.get("plannedHomePosition"),
+                        geofence=plan_data.get("geoFence"),
+                        source_hash=source_hash)
+
+
+def compile_plan(file_path, cache_dir=DEFAULT_CACHE_DIR) -> CompiledPlan:
+    """
+    Compiles a QGroundControl .plan file, using an on-disk cache when possible.
+
+    The cache is keyed by the SHA-256 of the file contents, so an edited plan
+    is recompiled automatically. Pass `cache_dir=None` to disable caching.
+
+    Raises:
+        FileNotFoundError: If the plan file does not exist.
+        PlanError: If the file is not valid JSON or contains unsupported items.
+    """
+    with open(file_path, "rb") as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).hexdigest()
+
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = os.path.join(cache_dir, f"{digest}.npz")
+        if os.path.exists(cache_path):
+            try:
+                return CompiledPlan.load(cache_path)
+            except (OSError, ValueError, KeyError):
+                pass  # Stale or corrupt entry, fall through and rebuild it.
+
+    try:
+        plan_data = json.loads(raw)
+    except json.JSONDecodeError as e:
+        raise PlanError(f"Could not decode JSON from {file_path}: {e}") from e
+
+    plan = compile_plan_data(plan_data, source_hash=digest)
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        plan.save(cache_path)
+    return plan
@@ -0,0 +1,165 @@
+import asyncio
+import json
+import os
+import socket
+import sys
+import tempfile
+
+# Only the standard library is imported here so scripts attaching to a
+# running session_daemon start fast; drone_actions (mavsdk, grpc) is loaded
+# only when no daemon is running.
+
+DEFAULT_SOCKET_PATH = os.path.join(tempfile.gettempdir(), f"sprayer-drone-{os.getuid()}.sock")
+
+
+def socket_path():
+    """SESSION_SOCKET from the environment, else the per-user default."""
+    return os.getenv("SESSION_SOCKET") or DEFAULT_SOCKET_PATH
+
+
+class SessionError(RuntimeError):
+    """A Drone call failed inside the session daemon."""
+
+
+def _remote(method, doc, path_arg=None):
+    """
+    A DroneClient method forwarding `method`; the `path_arg` keyword (or
+    first positional argument), if a string, is made absolute since the
+    daemon may run in another directory.
+    """
+    async def call(self, *args, **kwargs):
+        if path_arg is not None:
+            if args and isinstance(args[0], str):
+                args = (os.path.abspath(args[0]),) + args[1:]
+            elif isinstance(kwargs.get(path_arg), str):
+                kwargs[path_arg] = os.path.abspath(kwargs[path_arg])
+        return await self._call(method, *args, **kwargs)
+    call.__name__ = method
+    call.__doc__ = doc
+    return call
+
+
+class DroneClient:
+    """
+    Drone-compatible handle on a vehicle owned by session_daemon.
+
+    Each method is forwarded over the daemon's Unix socket and the daemon's
+    progress output for the call is printed here. Arguments must be JSON:
+    missions, fences and parameter files are passed as file paths.
+    Results other than numbers, strings and lists (upload and parameter
+    reports, breach events) come back as their str().
+    """
+
+    def __init__(self, path=None):
+        self.path = path or socket_path()
+        self.connection_string = None
+        self._reader = None
+        self._writer = None
+        self._pending = {}
+        self._next_id = 0
+        self._receiver = None
+
+    async def connect(self):
+        """Attaches to the daemon; returns False if none is listening."""
+        try:
+            self._reader, self._writer = await asyncio.open_unix_connection(self.path, limit=2 ** 20)
+        except (FileNotFoundError, ConnectionRefusedError):
+            print(f"--> No drone session on {self.path}")
+            return False
+        self._receiver = asyncio.create_task(self._receive())
+        status = await self._call("status")
+        self.connection_string = status["connection_string"]
+        print(f"--> Attached to drone session on {self.connection_string}")
+        return True
+
+    async def _receive(self):
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                if "output" in message:
+                    sys.stdout.write(message["output"])
+                    continue
+                future = self._pending.pop(message["id"], None)
+                if future is None or future.done():
+                    continue
+                if "error" in message:
+                    future.set_exception(SessionError(message["error"]))
+                else:
+                    future.set_result(message.get("result"))
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(SessionError("Session daemon closed the connection"))
+            self._pending.clear()
+
+    async def _call(self, method, *args, **kwargs):
+        if self._writer is None:
+            raise SessionError("Not attached; call connect() first")
+        if self._receiver.done():
+            raise SessionError("Session daemon closed the connection")
+        self._next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[self._next_id] = future
+        request = {"id": self._next_id, "method": method, "args": args, "kwargs": kwargs}
+        self._writer.write((json.dumps(request) + "\n").encode())
+        await self._writer.drain()
+        return await future
+
+    wait_for_readiness = _remote("wait_for_readiness",
+                                 "Returns as soon as the daemon's cached health allows arming.")
+    sync_params = _remote("sync_params", "Drone.sync_params on a .parm file path.", "parm_file")
+    arm = _remote("arm", "Arms the drone.")
+    takeoff = _remote("takeoff", "Takes off to a specific altitude.")
+    upload_mission = _remote("upload_mission", "Uploads a QGroundControl plan file (path).", "mission")
+    start_mission = _remote("start_mission", "Starts the uploaded mission, optionally at `start_index`.")
+    monitor_mission_progress = _remote(
+        "monitor_mission_progress",
+        "Monitors the mission; `fence` may be a plan file whose geoFence is checked live.", "fence")
+    is_mission_finished = _remote("is_mission_finished", "Checks if the mission is finished.")
+    return_to_launch = _remote("return_to_launch", "Commands the drone to return to the launch position.")
+    hold = _remote("hold", "Sets the drone to hold mode.")
+    land = _remote("land", "Lands the drone.")
+    wait_for_landed = _remote("wait_for_landed", "Waits until the drone reports it is on the ground.")
+    disarm = _remote("disarm", "Disarms the drone.")
+    start_recording = _remote("start_recording", "Starts a flight log written by the daemon.", "path")
+    stop_recording = _remote("stop_recording", "Closes the daemon's flight log.")
+    status = _remote("status", "Connection string and latest armed/in-air/position state.")
+    stop_daemon = _remote("stop", "Shuts the daemon and its vehicle connection down.")
+
+    async def shutdown(self):
+        """Detaches from the daemon; the vehicle connection stays up."""
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+            await self._receiver
+            self._writer = None
+
+
+def _daemon_listening(path):
+    """True if something accepts connections on `path`; a stale socket file is removed."""
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        if os.path.exists(path):
+            os.unlink(path)  # Left behind by a daemon that crashed.
+        return False
+    finally:
+        probe.close()
+    return True
+
+
+def open_drone(path=None):
+    """
+    A DroneClient if a session daemon is listening, else a direct Drone.
+
+    Either way the caller continues with connect() and wait_for_readiness().
+    """
+    path = path or socket_path()
+    if os.path.exists(path) and _daemon_listening(path):
+        return DroneClient(path)
+    from drone_actions import Drone
+    return Drone()
@@ -0,0 +1,188 @@
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import sys
+
+from drone_actions import Drone
+from geofence import Geofence
+from plan_compiler import compile_plan
+from session_client import socket_path
+
+# Drone methods a client may call; everything else (connect, shutdown) is
+# owned by the daemon.
+REMOTE_METHODS = frozenset((
+    "wait_for_readiness", "sync_params", "arm", "takeoff", "upload_mission", "start_mission",
+    "monitor_mission_progress", "is_mission_finished", "return_to_launch", "hold", "land",
+    "wait_for_landed", "disarm", "start_recording", "stop_recording",
+))
+
+# Where print() output of the request running in the current task goes.
+_request_output = contextvars.ContextVar("request_output", default=None)
+
+
+class _SessionStdout:
+    """Copies print() output to the client whose request produced it."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        send = _request_output.get()
+        if send is not None:
+            send(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def _encode(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _encode(v) for k, v in value.items()}
+    return str(value)
+
+
+class SessionDaemon:
+    """
+    Owns one Drone (System connection, TelemetryHub, mission and parameter
+    state) and serves its methods to DroneClients over a Unix socket.
+
+    The drone is connected and waited ready once at startup; the hub keeps
+    every stream it has subscribed running, so a client's
+    wait_for_readiness() is answered from the cached health sample.
+    Requests are newline-delimited JSON and each runs in its own task, so a
+    client can monitor a mission and still command the vehicle.
+    """
+
+    def __init__(self, drone=None, path=None):
+        self.drone = drone if drone is not None else Drone()
+        self.path = path or socket_path()
+        self._server = None
+        self._stopped = None
+
+    async def _check_stale_socket(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            _, writer = await asyncio.open_unix_connection(self.path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(self.path)  # Left behind by a daemon that crashed.
+            return
+        writer.close()
+        raise RuntimeError(f"A session daemon is already running on {self.path}")
+
+    async def serve(self):
+        """Connects the drone, then serves clients until a client sends stop."""
+        await self._check_stale_socket()
+        if not await self.drone.connect():
+            print("Failed to connect to the drone. Exiting.")
+            return
+        await self.drone.wait_for_readiness()
+        self._stopped = asyncio.Event()
+        self._server = await asyncio.start_unix_server(self._handle_client, self.path, limit=2 ** 20)
+        os.chmod(self.path, 0o600)
+        print(f"--> Drone session ready on {self.path}")
+        stdout, sys.stdout = sys.stdout, _SessionStdout(sys.stdout)
+        try:
+            await self._stopped.wait()
+        finally:
+            sys.stdout = stdout
+            self._server.close()
+            await self._server.wait_closed()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            await self.drone.shutdown()
+
+    def status(self):
+        telemetry = self.drone.telemetry
+        position = telemetry.latest.get("position")
+        return {
+            "connection_string": self.drone.connection_string,
+            "armed": telemetry.latest.get("armed"),
+            "in_air": telemetry.latest.get("in_air"),
+            "position": None if position is None else [position.latitude_deg,
+                                                       position.longitude_deg,
+                                                       position.relative_altitude_m],
+        }
+
+    async def _dispatch(self, method, args, kwargs):
+        if method == "status":
+            return self.status()
+        if method == "stop":
+            self._stopped.set()
+            return None
+        if method not in REMOTE_METHODS:
+            raise AttributeError(f"Drone method '{method}' is not available over the session")
+        if method == "monitor_mission_progress":
+            fence = kwargs.pop("fence", args[0] if args else None)
+            if isinstance(fence, str):
+                fence = Geofence.from_plan(compile_plan(fence))
+            return await self.drone.monitor_mission_progress(fence)
+        result = getattr(self.drone, method)(*args, **kwargs)
+        if asyncio.iscoroutine(result):
+            result = await result
+        return result
+
+    async def _run_request(self, writer, request):
+        request_id = request.get("id")
+
+        def send(message):
+            if not writer.is_closing():
+                writer.write((json.dumps(message) + "\n").encode())
+
+        _request_output.set(lambda text: send({"id": request_id, "output": text}))
+        try:
+            result = await self._dispatch(request["method"], list(request.get("args", ())),
+                                          dict(request.get("kwargs", {})))
+            send({"id": request_id, "result": _encode(result)})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            send({"id": request_id, "error": f"{type(e).__name__}: {e}"})
+
+    async def _handle_client(self, reader, writer):
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.create_task(self._run_request(writer, json.loads(line)))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            # A client that detaches mid-call (Ctrl-C) abandons its requests;
+            # the vehicle keeps doing whatever it was last told.
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep one drone connection open for short scripts.")
+    parser.add_argument("--socket", default=None, help="Unix socket path (default: SESSION_SOCKET)")
+    parser.add_argument("--fake", metavar="PLAN", default=None,
+                        help="Serve a fake_system vehicle homed at this plan's home position")
+    parser.add_argument("--speedup", type=float, default=1.0, help="Fake vehicle speedup")
+    args = parser.parse_args()
+
+    drone = None
+    if args.fake:
+        from fake_system import FakeSystem
+        drone = Drone(system=FakeSystem(home=compile_plan(args.fake).home, speedup=args.speedup),
+                      connection_string="fake")
+    asyncio.run(SessionDaemon(drone, args.socket).serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+import argparse
+import asyncio
+import os
+import shlex
+import signal
+import subprocess
+import tempfile
+import time
+
+from connection_manager import DEFAULT_BASE_PORT, FIRST_UDP_PORT, PORT_STRIDE, vehicle_address
+from plan_compiler import compile_plan
+
+# SITL instance i (-I i) serves MAVLink on tcp SITL_FIRST_TCP_PORT + i * PORT_STRIDE.
+SITL_FIRST_TCP_PORT = 5760
+# MAVProxy's second output per vehicle, for QGroundControl; it stays inside
+# the vehicle's PORT_STRIDE block so instances never collide.
+GCS_PORT_OFFSET = 5
+
+ARDUPILOT_DIR = os.getenv("ARDUPILOT_DIR", os.path.expanduser("~/drone/ardupilot"))
+DEFAULT_WORKDIR = os.path.join(tempfile.gettempdir(), f"sprayer-sim-{os.getuid()}")
+
+
+def default_commands():
+    """
+    Command prefix of each stack process; ARDUCOPTER, MAVPROXY and
+    MAVSDK_SERVER in the environment override them (e.g. with stubs).
+    """
+    return {
+        "arducopter": shlex.split(os.getenv(
+            "ARDUCOPTER", os.path.join(ARDUPILOT_DIR, "build", "sitl", "bin", "arducopter"))),
+        "mavproxy": shlex.split(os.getenv("MAVPROXY", "mavproxy.py")),
+        "mavsdk_server": shlex.split(os.getenv("MAVSDK_SERVER", "mavsdk_server")),
+    }
+
+
+def parse_home(text):
+    """'lat,lon' or 'lat,lon,alt,hdg' (as runsim.sh took it) -> 4-tuple of floats."""
+    values = [float(v) for v in text.split(",")]
+    if len(values) == 2:
+        return values[0], values[1], 0.0, 0.0
+    if len(values) == 4:
+        return tuple(values)
+    raise ValueError("Invalid location format. Use 'lat,lon' OR 'lat,lon,alt,hdg'")
+
+
+def plan_home(plan_file):
+    """A plan's plannedHomePosition as a SITL --home tuple (heading 0)."""
+    home = compile_plan(plan_file).home
+    if home is None:
+        raise ValueError(f"{plan_file} has no plannedHomePosition")
+    return float(home[0]), float(home[1]), float(home[2]), 0.0
+
+
+class ManagedProcess:
+    """
+    One process of a sim stack.
+
+    It runs in its own session so stop() takes down anything it spawned,
+    and its output goes to `log_path`. If `ready_port` is set, the process
+    counts as ready once that local TCP port accepts a connection.
+    """
+
+    def __init__(self, name, argv, cwd, log_path, ready_port=None, depends_on=()):
+        self.name = name
+        self.argv = list(argv)
+        self.cwd = cwd
+        self.log_path = log_path
+        self.ready_port = ready_port
+        self.depends_on = tuple(depends_on)
+        self.process = None
+        self.restarts = 0
+
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    @property
+    def returncode(self):
+        return None if self.process is None else self.process.returncode
+
+    async def start(self):
+        with open(self.log_path, "ab") as log:
+            self.process = await asyncio.create_subprocess_exec(
+                *self.argv, cwd=self.cwd, stdin=subprocess.DEVNULL, stdout=log,
+                stderr=subprocess.STDOUT, start_new_session=True)
+
+    async def wait_ready(self, timeout_s):
+        """True once the process is up (and its ready_port open) within `timeout_s`."""
+        deadline = time.monotonic() + timeout_s
+        while self.running:
+            if self.ready_port is None:
+                # Nothing to probe: alive after a short grace period is ready.
+                await asyncio.sleep(min(0.5, timeout_s))
+                return self.running
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", self.ready_port)
+            except OSError:
+                if time.monotonic() > deadline:
+                    return False
+                await asyncio.sleep(0.2)
+                continue
+            writer.close()
+            return True
+        return False
+
+    def _signal(self, sig):
+        try:
+            os.killpg(self.process.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    async def stop(self, timeout_s=5.0):
+        """SIGTERM to the process group, SIGKILL if it is still up after `timeout_s`."""
+        if not self.running:
+            return
+        self._signal(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout_s)
+        except asyncio.TimeoutError:
+            self._signal(signal.SIGKILL)
+            await self.process.wait()
+
+
+class SimStack:
+    """
+    ArduCopter SITL, MAVProxy and optionally mavsdk_server for one simulated
+    vehicle, on ports derived from its index:
+
+        SITL        -I index, tcp 5760 + 10 * index
+        MAVProxy    udp 14540 + 10 * index (vehicle_address), udp +5 for a GCS
+        mavsdk_server   grpc 50051 + index
+
+    Each stack runs in its own directory so eeprom.bin, logs and tlogs of
+    parallel instances stay apart.
+    """
+
+    def __init__(self, index, home=None, speedup=1.0, commands=None, workdir=DEFAULT_WORKDIR,
+                 mavsdk_server=False, model="+"):
+        commands = commands or default_commands()
+        self.index = index
+        self.home = home
+        self.speedup = speedup
+        self.sitl_port = SITL_FIRST_TCP_PORT + index * PORT_STRIDE
+        self.udp_port = FIRST_UDP_PORT + index * PORT_STRIDE
+        self.gcs_port = self.udp_port + GCS_PORT_OFFSET
+        self.grpc_port = DEFAULT_BASE_PORT + index
+        self.address = vehicle_address(index)
+        self.directory = os.path.join(workdir, str(index))
+        self.failed = False
+        os.makedirs(self.directory, exist_ok=True)
+
+        sitl = commands["arducopter"] + ["-S", "-I", str(index), "--model", model,
+                                         "--speedup", f"{speedup:g}"]
+        if home is not None:
+            sitl += ["--home", ",".join(str(v) for v in home)]
+        defaults = os.path.join(ARDUPILOT_DIR, "Tools", "autotest", "default_params", "copter.parm")
+        if os.path.exists(defaults):
+            sitl += ["--defaults", defaults]
+        self.processes = [
+            self._process("arducopter", sitl, ready_port=self.sitl_port),
+            self._process("mavproxy", commands["mavproxy"] + [
+                "--master", f"tcp:127.0.0.1:{self.sitl_port}",
+                "--out", f"udp:127.0.0.1:{self.udp_port}",
+                "--out", f"udp:127.0.0.1:{self.gcs_port}",
+                "--non-interactive"], depends_on=("arducopter",)),
+        ]
+        if mavsdk_server:
+            self.processes.append(self._process("mavsdk_server", commands["mavsdk_server"] + [
+                "-p", str(self.grpc_port), f"udpin://:{self.udp_port}"]))
+
+    def _process(self, name, argv, ready_port=None, depends_on=()):
+        return ManagedProcess(name, argv, self.directory, os.path.join(self.directory, f"{name}.log"),
+                              ready_port, depends_on)
+
+    def dependents(self, name):
+        """Processes that must restart when `name` does, in start order."""
+        names = {name}
+        for process in self.processes:
+            if names.intersection(process.depends_on):
+                names.add(process.name)
+        return [p for p in self.processes if p.name in names]
+
+    def __str__(self):
+        server = f", mavsdk_server :{self.grpc_port}" if len(self.processes) > 2 else ""
+        return (f"sim {self.index}: {self.address} (GCS udp {self.gcs_port}, "
+                f"SITL tcp {self.sitl_port}{server}) in {self.directory}")
+
+
+class SimSupervisor:
+    """
+    Starts several SimStacks, restarts any process that exits, and tears
+    everything down on stop().
+
+    A process that dies is restarted together with everything depending on
+    it (SITL takes its MAVProxy along), after a backoff that doubles with
+    each restart. A stack whose process has needed more than `max_restarts`
+    restarts is marked failed and stopped; the other stacks keep running.
+    """
+
+    def __init__(self, stacks, ready_timeout_s=30.0, health_interval_s=1.0, max_restarts=5,
+                 restart_backoff_s=0.5):
+        self.stacks = list(stacks)
+        self.ready_timeout_s = ready_timeout_s
+        self.health_interval_s = health_interval_s
+        self.max_restarts = max_restarts
+        self.restart_backoff_s = restart_backoff_s
+
+    @classmethod
+    def for_plans(cls, plan_files, speedup=1.0, commands=None, workdir=DEFAULT_WORKDIR,
+                  mavsdk_server=False, **kwargs):
+        """One stack per plan, homed at that plan's plannedHomePosition."""
+        stacks = [SimStack(i, plan_home(plan_file), speedup, commands, workdir, mavsdk_server)
+                  for i, plan_file in enumerate(plan_files)]
+        return cls(stacks, **kwargs)
+
+    @property
+    def addresses(self):
+        """MAVLink addresses of the stacks still running, e.g. for fleet.Fleet."""
+        return [stack.address for stack in self.stacks if not stack.failed]
+
+    async def _launch(self, stack, process):
+        """Starts `process`, retrying with backoff; False once it has used up its restarts."""
+        while True:
+            await process.start()
+            if await process.wait_ready(self.ready_timeout_s):
+                return True
+            await process.stop()
+            print(f"--> [sim {stack.index}] {process.name} not ready "
+                  f"(exit {process.returncode}), see {process.log_path}")
+            process.restarts += 1
+            if process.restarts > self.max_restarts:
+                return False
+            await asyncio.sleep(self.restart_backoff_s * 2 ** (process.restarts - 1))
+
+    async def _start_stack(self, stack):
+        for process in stack.processes:
+            if not await self._launch(stack, process):
+                await self._fail(stack, process)
+                return
+        print(f"--> [sim {stack.index}] ready: {stack}")
+
+    async def _fail(self, stack, process):
+        stack.failed = True
+        print(f"--> [sim {stack.index}] giving up on {process.name} after "
+              f"{self.max_restarts} restarts")
+        await self.stop_stack(stack)
+
+    async def start(self):
+        """Starts every stack in parallel; True if all of them came up."""
+        print(f"--- Starting {len(self.stacks)} simulated vehicles ---")
+        await asyncio.gather(*(self._start_stack(stack) for stack in self.stacks))
+        return not any(stack.failed for stack in self.stacks)
+
+    async def check(self):
+        """One health pass: restarts processes that have exited."""
+        for stack in self.stacks:
+            if stack.failed:
+                continue
+            dead = next((p for p in stack.processes if not p.running), None)
+            if dead is None:
+                continue
+            print(f"--> [sim {stack.index}] {dead.name} exited with {dead.returncode}, restarting")
+            dead.restarts += 1
+            if dead.restarts > self.max_restarts:
+                await self._fail(stack, dead)
+                continue
+            group = stack.dependents(dead.name)
+            for process in reversed(group):
+                await process.stop()
+            await asyncio.sleep(self.restart_backoff_s * 2 ** (dead.restarts - 1))
+            for process in group:
+                if not await self._launch(stack, process):
+                    await self._fail(stack, process)
+                    break
+
+    async def supervise(self, stop_event):
+        """Health-checks every `health_interval_s` until `stop_event` is set."""
+        while not stop_event.is_set():
+            await self.check()
+            if all(stack.failed for stack in self.stacks):
+                print("--> Every simulated vehicle failed")
+                return
+            try:
+                await asyncio.wait_for(stop_event.wait(), self.health_interval_s)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop_stack(self, stack):
+        for process in reversed(stack.processes):
+            await process.stop()
+
+    async def stop(self):
+        """Stops every process, newest first in each stack."""
+        print(f"--- Stopping {len(self.stacks)} simulated vehicles ---")
+        await asyncio.gather(*(self.stop_stack(stack) for stack in self.stacks))
+
+
+async def run(supervisor):
+    """Starts the stacks and supervises them until SIGINT/SIGTERM."""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    try:
+        await supervisor.start()
+        print(f"--> Vehicle addresses: {' '.join(supervisor.addresses)} (Ctrl-C to stop)")
+        await supervisor.supervise(stop_event)
+    finally:
+        await supervisor.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run ArduCopter SITL + MAVProxy stacks (one per vehicle) and keep them up.")
+    parser.add_argument("--plan", action="append", default=[],
+                        help="Home a vehicle at this plan's plannedHomePosition (repeat for more)")
+    parser.add_argument("--count", type=int, default=None,
+                        help="Number of vehicles (default: one per --plan, else 1)")
+    parser.add_argument("--home", default=None, help="'lat,lon' or 'lat,lon,alt,hdg' for every vehicle")
+    parser.add_argument("--speedup", type=float, default=1.0)
+    parser.add_argument("--mavsdk-server", action="store_true",
+                        help="Also run a standalone mavsdk_server per vehicle (grpc 50051 + index); "
+                             "not needed by scripts that start their own System()")
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR)
+    parser.add_argument("--max-restarts", type=int, default=5)
+    args = parser.parse_args()
+
+    count = args.count or max(len(args.plan), 1)
+    if args.home:
+        homes = [parse_home(args.home)] * count
+    elif args.plan:
+        plan_homes = [plan_home(plan_file) for plan_file in args.plan]
+        homes = [plan_homes[i % len(plan_homes)] for i in range(count)]
+    else:
+        homes = [None] * count
+    commands = default_commands()
+    stacks = [SimStack(i, home, args.speedup, commands, args.workdir, args.mavsdk_server)
+              for i, home in enumerate(homes)]
+    asyncio.run(run(SimSupervisor(stacks, max_restarts=args.max_restarts)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,44 @@
 import asyncio
-import sys
-import select
+import os
 from mavsdk import System
+from coverage_map import CoverageMap
+from mission_checkpoint import Checkpoint, MissionCheckpointer, resume_plan
+from mission_estimator import estimate_mission
+from mission_optimizer import optimize_plan
+from mission_sync import MissionSync
+from plan_compiler import compile_plan
+from sprayer_controller import SPRAY_MODE_FLY, SprayerController, keyboard_detections
+from telemetry_hub import TelemetryHub
+from vision_pipeline import DummyDetector, SyntheticFrameSource, VisionPipeline, hub_pose
 
 # --- CONFIGURATION ---
 MISSION_FILE = "parker_farm_1.plan" # Ensure this file exists
 CONNECTION_STR = "udp://:14540" # Simulator
 
-# --- MOCK VISION SYSTEM (Modified for keyboard input) ---
-# In real life, this would be your YOLO/OpenCV function
-def check_keyboard_input():
-    # Check if there's input waiting
-    if select.select([sys.stdin], [], [], 0)[0]:
-        line = sys.stdin.readline().strip()
-        if line == "":  # Enter key pressed
-            return True
-    return False
+SPRAY_ACTUATOR_INDEX = None # e.g. 1 for the spray relay; None simulates the valve
+SPRAY_MODE = SPRAY_MODE_FLY # SPRAY_MODE_HOLD stops over every target
+NOZZLE_LATENCY_S = 0.08 # Time from set_actuator to liquid on the ground
+BOOM_WIDTH_M = 3.0 # Sprayed width across track
+DUPLICATE_RADIUS_M = 0.5 # Detections this close to a treated target are ignored
+COVERAGE_RESOLUTION_M = 0.1 # Cell size of the as-sprayed map
+COVERAGE_FILE = "coverage.npz" # As-sprayed map, diff with: python coverage_map.py a.npz b.npz
+CHECKPOINT_FILE = "checkpoint.json" # Progress written while flying
+RESUME = False # After a battery/tank swap: fly only what CHECKPOINT_FILE left unflown
+MISSION_TOLERANCE_M = 0.1 # Path deviation allowed when shrinking the mission; None uploads it as planned
 
-async def run():
-    drone = System()
+# --- VISION SYSTEM ---
+# "keyboard" simulates a target each time Enter is pressed.
+# "synthetic" runs vision_pipeline on generated frames with the dummy
+# detector, which reports random targets: bench testing only, never on a
+# vehicle carrying chemical. Swap in a real frame source and YOLO/OpenCV
+# detector there.
+DETECTION_SOURCE = "keyboard"
+VISION_WORKERS = 2 # Detector threads
+VISION_BATCH_SIZE = 4 # Frames per detector call
+
+async def run(drone=None):
+    # Pass a fake_system.FakeSystem as `drone` to run without a simulator.
+    drone = drone if drone is not None else System()
     await drone.connect(system_address=CONNECTION_STR)
 
     print("Waiting for drone...")
@@ -27,11 +47,27 @@ async def run():
             print("Drone connected!")
             break
 
-    # 1. SETUP: Import and Upload Mission
-    print("Importing QGC Plan...")
-    mission_data = await drone.mission_raw.import_qgroundcontrol_mission(MISSION_FILE)
-    print(f"Uploading {len(mission_data.mission_items)} items...")
-    await drone.mission_raw.upload_mission(mission_data.mission_items)
+    # 1. SETUP: Compile and Upload Mission (skipped if the drone already has it)
+    print("Compiling QGC Plan...")
+    plan = compile_plan(MISSION_FILE)
+    if MISSION_TOLERANCE_M is not None:
+        plan, report = optimize_plan(plan, MISSION_TOLERANCE_M)
+        print(f"Optimized: {report}")
+    previous, item_map = None, None
+    if RESUME and os.path.exists(CHECKPOINT_FILE):
+        previous = Checkpoint.load(CHECKPOINT_FILE)
+        print(f"Resuming from checkpoint: {previous}")
+        mission, item_map = resume_plan(plan, previous)
+    else:
+        mission = plan
+    estimate = estimate_mission(mission)
+    print(f"Estimate: {estimate}")
+    if not estimate.fits_battery or not estimate.fits_tank:
+        print("WARNING: mission does not fit in one battery/tank, expect to land and refill")
+    mission_items = mission.to_mission_raw_items()
+    print(f"Uploading {len(mission_items)} items...")
+    mission_sync = MissionSync(drone)
+    print(await mission_sync.upload(mission_items))
     
     # 2. LAUNCH
     print("Arming...")
@@ -41,38 +77,44 @@ async def run():
     await drone.mission.start_mission()
 
     # 3. THE SMART LOOP
-    # We poll the vision system constantly while the mission flies
-    while True:
-        # Check if mission is finished
-        mission_progress = await drone.mission.is_mission_finished()
-        if mission_progress:
-            print("Survey Complete!")
-            break
-
-        # --- VISION CHECK ---
-        if check_keyboard_input():
-            print("!!! KEYBOARD INTERRUPT DETECTED - INTERRUPTING MISSION !!!")
-            
-            # A. PAUSE (Switch to Hold Mode)
-            # This freezes the drone in place (GPS Hold)
-            await drone.action.hold()
-            
-            # B. PERFORM ACTION (Spray)
-            print(">>> SPRAYING TARGET...")
-            # Real code: toggle a relay or servo here
-            # await drone.action.set_actuator(1, 0.9) 
-            await asyncio.sleep(2) # Simulate spray duration
-            print(">>> SPRAY COMPLETE.")
-
-            # C. RESUME (Switch back to Mission Mode)
-            # ArduPilot automatically remembers where it was in the mission
-            print("Resuming Mission...")
-            await drone.mission.start_mission()
-
-        # Small sleep to prevent CPU hogging
-        await asyncio.sleep(0.1)
+    # Mission progress, flight mode and detections are streamed into one
+    # event loop, so a target is handled as soon as it is seen.
+    coverage = CoverageMap.from_plan(plan, COVERAGE_RESOLUTION_M, BOOM_WIDTH_M)
+    telemetry = TelemetryHub(drone)
+    checkpoint = MissionCheckpointer(CHECKPOINT_FILE, plan, item_map, previous,
+                                     tolerance_m=MISSION_TOLERANCE_M)
+    checkpoint.attach(telemetry)
+    vision = None
+    if DETECTION_SOURCE == "synthetic":
+        vision = VisionPipeline(SyntheticFrameSource(), DummyDetector(), hub_pose(telemetry),
+                                workers=VISION_WORKERS, batch_size=VISION_BATCH_SIZE)
+        detections = vision.detections()
+    else:
+        detections = keyboard_detections()
+    controller = SprayerController(drone, detections, telemetry=telemetry,
+                                   coverage=coverage,
+                                   checkpoint=checkpoint,
+                                   plan=mission,
+                                   actuator_index=SPRAY_ACTUATOR_INDEX,
+                                   spray_mode=SPRAY_MODE,
+                                   nozzle_latency_s=NOZZLE_LATENCY_S,
+                                   boom_half_width_m=BOOM_WIDTH_M / 2,
+                                   duplicate_radius_m=DUPLICATE_RADIUS_M)
+    coverage.attach(controller.telemetry)
+    await controller.run()
+    coverage.detach()
+    checkpoint.detach()
+    print(f"Targets sprayed: {controller.targets_sprayed} ({controller.targets_held} in hold), "
+          f"skipped: {controller.targets_skipped}, missed: {controller.targets_missed}, "
+          f"already treated: {controller.targets_duplicate}")
+    controller.latency.report()
+    if vision is not None:
+        vision.report()
+    print(f"Coverage: {coverage}")
+    coverage.save(COVERAGE_FILE)
 
     # End
+    await mission_sync.close()
     await drone.action.return_to_launch()
 
 if __name__ == "__main__":
@@ -0,0 +1,418 @@
+import asyncio
+import math
+import sys
+import time
+from collections import deque
+
+import numpy as np
+
+from geo import latlon_to_ne, ne_to_latlon
+from target_index import TargetIndex
+from telemetry_hub import TelemetryHub
+
+EVENT_PROGRESS = "progress"
+EVENT_FLIGHT_MODE = "flight_mode"
+EVENT_DETECTION = "detection"
+# Latency kind for a detection's capture-to-handler time, detector included.
+EVENT_DETECTION_CAPTURE = "detection_capture"
+
+SPRAY_MODE_FLY = "fly"
+SPRAY_MODE_HOLD = "hold"
+
+# Below this ground speed a fly-through trigger cannot be timed reliably.
+MIN_FLY_SPEED_M_S = 0.5
+
+
+class Detection:
+    """A target seen by the vision system, stamped with time.monotonic() at capture."""
+
+    def __init__(self, timestamp=None, latitude_deg=None, longitude_deg=None, confidence=1.0):
+        self.timestamp = time.monotonic() if timestamp is None else timestamp
+        self.latitude_deg = latitude_deg
+        self.longitude_deg = longitude_deg
+        self.confidence = confidence
+
+    def __repr__(self):
+        return (f"Detection(lat={self.latitude_deg}, lon={self.longitude_deg}, "
+                f"confidence={self.confidence:.2f})")
+
+
+class LatencyStats:
+    """Per-event-kind latency samples in milliseconds."""
+
+    def __init__(self):
+        self._samples = {}
+
+    def record(self, kind, latency_ms):
+        self._samples.setdefault(kind, []).append(latency_ms)
+
+    def summary(self):
+        """Returns {kind: {count, p50_ms, p95_ms, max_ms}}."""
+        result = {}
+        for kind, samples in self._samples.items():
+            values = np.asarray(samples)
+            result[kind] = {
+                "count": len(values),
+                "p50_ms": float(np.percentile(values, 50)),
+                "p95_ms": float(np.percentile(values, 95)),
+                "max_ms": float(values.max()),
+            }
+        return result
+
+    def report(self):
+        for kind, stats in self.summary().items():
+            print(f"   [Latency] {kind}: n={stats['count']} p50={stats['p50_ms']:.2f}ms "
+                  f"p95={stats['p95_ms']:.2f}ms max={stats['max_ms']:.2f}ms")
+
+
+def plan_fly_through_spray(vehicle_lat, vehicle_lon, velocity_north, velocity_east,
+                           target_lat, target_lon, nozzle_latency_s, spray_length_m):
+    """
+    Works out when to open and close the valve so the spray lands on a target
+    the vehicle is flying towards at constant velocity.
+
+    The valve window is centred on the moment the boom passes over the target
+    and shifted earlier by the nozzle actuation latency.
+
+    Returns:
+        (open_delay_s, close_delay_s, cross_track_m) relative to now, or None
+        if the vehicle is too slow to time a pass.
+    """
+    speed = math.hypot(velocity_north, velocity_east)
+    if speed < MIN_FLY_SPEED_M_S:
+        return None
+    north, east = latlon_to_ne(target_lat, target_lon, vehicle_lat, vehicle_lon)
+    along_track = (north * velocity_north + east * velocity_east) / speed
+    cross_track = abs(north * velocity_east - east * velocity_north) / speed
+    time_to_target = along_track / speed
+    half_window = 0.5 * spray_length_m / speed
+    return (float(time_to_target - nozzle_latency_s - half_window),
+            float(time_to_target - nozzle_latency_s + half_window),
+            float(cross_track))
+
+
+def _mode_name(flight_mode):
+    return getattr(flight_mode, "name", str(flight_mode))
+
+
+async def keyboard_detections():
+    """
+    Yields a Detection each time Enter is pressed on stdin.
+
+    Stand-in for the YOLO/OpenCV pipeline. Uses the event loop's reader
+    callback, so nothing polls stdin.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    def on_stdin():
+        line = sys.stdin.readline()
+        if line.strip() == "":
+            queue.put_nowait(Detection())
+
+    loop.add_reader(sys.stdin, on_stdin)
+    try:
+        while True:
+            yield await queue.get()
+    finally:
+        loop.remove_reader(sys.stdin)
+
+
+class SprayerController:
+    """
+    Event-driven smart-sprayer loop.
+
+    Mission progress, flight mode and detections are pumped from their async
+    streams into one queue and handled in arrival order, so a detection is
+    acted on as soon as the event loop is free rather than on the next poll.
+    Each event's queue-to-handler latency is recorded in `latency`, and
+    warned about past `max_reaction_ms` for detections; their
+    capture-to-handler latency, which includes the detector, is recorded
+    separately under EVENT_DETECTION_CAPTURE.
+
+    With `actuator_index=None` the valve is only simulated (no set_actuator).
+    A CoverageMap passed as `coverage` is told whenever the valve opens or
+    closes, so it paints the as-sprayed area; a MissionCheckpointer passed as
+    `checkpoint` is told the same, so it records the last sprayed position.
+
+    In fly mode the valve is timed from the latest position and velocity so
+    the vehicle sprays the target without leaving the mission. Targets the
+    boom has already passed or will pass beside are counted in
+    `targets_missed` and left alone: holding would spray wherever the
+    vehicle stops, not on the target. Only targets in a dense cluster, or
+    seen while the vehicle is too slow to time a pass, fall back to
+    hold-and-spray.
+
+    Detections only count while the vehicle flies the mission: not while a
+    hold-and-spray is under way, and, given the uploaded `plan`, not before
+    its first waypoint is reached (takeoff and the transit to the field).
+
+    Every scheduled target is added to `treated`; later detections within
+    `duplicate_radius_m` of one (the same weed on the next frame or the
+    overlapping transect) are dropped before any valve or mode command.
+    """
+
+    def __init__(self, system, detections, telemetry=None, recorder=None, coverage=None,
+                 checkpoint=None, plan=None, spray_duration_s=2.0, actuator_index=None,
+                 actuator_on=0.9, actuator_off=0.0, max_reaction_ms=20.0,
+                 spray_mode=SPRAY_MODE_FLY, nozzle_latency_s=0.08, spray_length_m=1.0,
+                 boom_half_width_m=1.5, camera_lookahead_m=3.0,
+                 cluster_size=4, cluster_window_s=1.0, duplicate_radius_m=0.5):
+        self.system = system
+        self.detections = detections
+        self.telemetry = telemetry if telemetry is not None else TelemetryHub(system)
+        self.recorder = recorder
+        self.coverage = coverage
+        self.checkpoint = checkpoint
+        self.spray_duration_s = spray_duration_s
+        self.spray_mode = spray_mode
+        self.nozzle_latency_s = nozzle_latency_s
+        self.spray_length_m = spray_length_m
+        self.boom_half_width_m = boom_half_width_m
+        self.camera_lookahead_m = camera_lookahead_m
+        self.cluster_size = cluster_size
+        self.cluster_window_s = cluster_window_s
+        self.actuator_index = actuator_index
+        self.actuator_on = actuator_on
+        self.actuator_off = actuator_off
+        self.max_reaction_ms = max_reaction_ms
+        self.treated = TargetIndex(duplicate_radius_m) if duplicate_radius_m else None
+        positional = np.flatnonzero(plan.waypoint_mask) if plan is not None else ()
+        self.first_waypoint = int(positional[0]) if len(positional) else None
+
+        self.latency = LatencyStats()
+        self.flight_mode = None
+        self.progress = None
+        self.targets_sprayed = 0
+        self.targets_skipped = 0
+        self.targets_held = 0
+        self.targets_missed = 0
+        self.targets_duplicate = 0
+        self._recent_detections = deque()
+        self._open_windows = 0
+        self._holding = False
+        self._queue = asyncio.Queue()
+        self._spray_lock = asyncio.Lock()
+        self._spray_tasks = set()
+
+    async def _pump(self, kind, stream):
+        async for value in stream:
+            queued_at = time.monotonic()
+            captured_at = getattr(value, "timestamp", None) if kind == EVENT_DETECTION else None
+            self._queue.put_nowait((kind, value, queued_at,
+                                    captured_at if captured_at is not None else queued_at))
+        if kind == EVENT_PROGRESS:
+            now = time.monotonic()
+            self._queue.put_nowait((kind, None, now, now))  # End of a replayed log.
+
+    async def run(self):
+        """
+        Runs until the mission reports its last item complete, or until the
+        mission progress stream ends (a replayed log ran out).
+        """
+        pumps = [
+            asyncio.create_task(self._pump(EVENT_PROGRESS, self.telemetry.stream("mission_progress"))),
+            asyncio.create_task(self._pump(EVENT_FLIGHT_MODE, self.telemetry.stream("flight_mode"))),
+            asyncio.create_task(self._pump(EVENT_DETECTION, self.detections)),
+        ]
+        self.telemetry.subscribe("position")
+        self.telemetry.subscribe("velocity_ned")
+        try:
+            while True:
+                kind, value, queued_at, captured_at = await self._queue.get()
+                now = time.monotonic()
+                latency_ms = (now - queued_at) * 1000.0
+                self.latency.record(kind, latency_ms)
+
+                if kind == EVENT_PROGRESS:
+                    if value is None:
+                        print("   [Mission] Progress stream ended before the survey completed")
+                        break
+                    self.progress = value
+                    print(f"   [Mission] Waypoint {value.current}/{value.total}")
+                    if value.total > 0 and value.current >= value.total:
+                        print("Survey Complete!")
+                        break
+                elif kind == EVENT_FLIGHT_MODE:
+                    if value != self.flight_mode:
+                        print(f"   [Mode] {_mode_name(value)}")
+                    self.flight_mode = value
+                elif kind == EVENT_DETECTION:
+                    self.latency.record(EVENT_DETECTION_CAPTURE, (now - captured_at) * 1000.0)
+                    if latency_ms > self.max_reaction_ms:
+                        print(f"   [Warning] Detection handled {latency_ms:.1f}ms after it was queued")
+                    self.handle_detection(value)
+        finally:
+            for task in pumps:
+                task.cancel()
+            await asyncio.gather(*pumps, return_exceptions=True)
+            if self._spray_tasks:
+                await asyncio.gather(*self._spray_tasks, return_exceptions=True)
+
+    def handle_detection(self, detection):
+        """Schedules a spray for a detection if the vehicle is flying the mission."""
+        if self._holding:
+            # The hold sprays below the vehicle; anything else seen meanwhile
+            # is found again once the mission resumes.
+            self.targets_skipped += 1
+            print("   [Skip] Detection during a hold")
+            return
+        if _mode_name(self.flight_mode) != "MISSION":
+            self.targets_skipped += 1
+            print(f"   [Skip] Detection outside mission mode ({_mode_name(self.flight_mode)})")
+            return
+        if self.first_waypoint is not None and \
+                (self.progress is None or self.progress.current <= self.first_waypoint):
+            self.targets_skipped += 1
+            print("   [Skip] Detection before the first waypoint")
+            return
+        target = self._locate_target(detection)
+        if target is not None and self.treated is not None:
+            distance = self.treated.nearest_within(*target)
+            if distance is not None:
+                self.targets_duplicate += 1
+                print(f"   [Skip] Target already treated {distance:.2f}m away")
+                return
+        if self.spray_mode == SPRAY_MODE_FLY and target is not None \
+                and not self._is_cluster(detection):
+            window = self._fly_through_window(target)
+            if isinstance(window, str):
+                self.targets_missed += 1
+                print(f"   [Skip] Target {window}, cannot spray it on the fly")
+                return
+            if window is not None:
+                self._mark_treated(target)
+                self._start_task(self._spray_window(*window))
+                return
+        self._mark_treated(target)
+        self.targets_held += 1
+        self._holding = True
+        self._start_task(self._hold_and_spray(detection))
+
+    def _mark_treated(self, target):
+        if target is not None and self.treated is not None:
+            self.treated.add(*target)
+
+    def _start_task(self, coro):
+        task = asyncio.create_task(coro)
+        self._spray_tasks.add(task)
+        task.add_done_callback(self._spray_tasks.discard)
+
+    def _is_cluster(self, detection):
+        """True if this detection completes a dense cluster better handled in hold."""
+        recent = self._recent_detections
+        recent.append(detection.timestamp)
+        while recent and detection.timestamp - recent[0] > self.cluster_window_s:
+            recent.popleft()
+        return len(recent) >= self.cluster_size
+
+    def _vehicle_now(self):
+        """Latest fix dead-reckoned to now: (lat, lon, v_north, v_east), or None."""
+        position = self.telemetry.latest.get("position")
+        velocity = self.telemetry.latest.get("velocity_ned")
+        if position is None or velocity is None:
+            return None
+        v_north = velocity.north_m_s
+        v_east = velocity.east_m_s
+        age = self.telemetry.age("position")
+        lat, lon = ne_to_latlon(v_north * age, v_east * age,
+                                position.latitude_deg, position.longitude_deg)
+        return float(lat), float(lon), v_north, v_east
+
+    def _locate_target(self, detection):
+        """Best estimate of a detection's ground position as (lat, lon), or None."""
+        if detection.latitude_deg is not None:
+            return detection.latitude_deg, detection.longitude_deg
+        vehicle = self._vehicle_now()
+        if vehicle is None:
+            return None
+        vehicle_lat, vehicle_lon, v_north, v_east = vehicle
+        speed = math.hypot(v_north, v_east)
+        if speed < MIN_FLY_SPEED_M_S:
+            # Hovering: the target is what the camera sees below the vehicle.
+            return vehicle_lat, vehicle_lon
+        # Untagged detections are assumed to be camera_lookahead_m ahead of
+        # where the vehicle was when the frame was captured.
+        back = time.monotonic() - detection.timestamp
+        ahead = self.camera_lookahead_m / speed
+        target_lat, target_lon = ne_to_latlon(v_north * (ahead - back), v_east * (ahead - back),
+                                              vehicle_lat, vehicle_lon)
+        return float(target_lat), float(target_lon)
+
+    def _fly_through_window(self, target):
+        """
+        Returns (open_delay_s, close_delay_s) for a fly-through spray; None
+        without a fix or below MIN_FLY_SPEED_M_S, where only a hold can
+        spray; or why the boom cannot reach the target ("already passed",
+        "off the boom").
+        """
+        vehicle = self._vehicle_now()
+        if vehicle is None:
+            return None
+        vehicle_lat, vehicle_lon, v_north, v_east = vehicle
+        window = plan_fly_through_spray(vehicle_lat, vehicle_lon, v_north, v_east,
+                                        target[0], target[1],
+                                        self.nozzle_latency_s, self.spray_length_m)
+        if window is None:
+            return None
+        open_delay, close_delay, cross_track = window
+        if close_delay <= 0:
+            return "already passed"
+        if cross_track > self.boom_half_width_m:
+            return f"off the boom ({cross_track:.1f}m to the side)"
+        return max(open_delay, 0.0), close_delay
+
+    async def _spray_window(self, open_delay_s, close_delay_s):
+        await asyncio.sleep(open_delay_s)
+        await self._open_valve()
+        print(f">>> SPRAYING ON THE FLY ({(close_delay_s - open_delay_s) * 1000:.0f}ms)")
+        try:
+            await asyncio.sleep(close_delay_s - open_delay_s)
+        finally:
+            await self._close_valve()
+        self.targets_sprayed += 1
+
+    async def set_valve(self, is_open):
+        value = self.actuator_on if is_open else self.actuator_off
+        if self.recorder is not None:
+            position = self.telemetry.latest.get("position")
+            lat, lon = ((position.latitude_deg, position.longitude_deg) if position is not None
+                        else (float("nan"), float("nan")))
+            self.recorder.record_event("spray", (value, lat, lon))
+        if self.coverage is not None:
+            self.coverage.set_spraying(is_open)
+        if self.checkpoint is not None:
+            self.checkpoint.set_spraying(is_open)
+        if self.actuator_index is None:
+            return
+        await self.system.action.set_actuator(self.actuator_index, value)
+
+    async def _open_valve(self):
+        # Spray windows may overlap; the valve stays open until the last closes.
+        self._open_windows += 1
+        if self._open_windows == 1:
+            await self.set_valve(True)
+
+    async def _close_valve(self):
+        self._open_windows -= 1
+        if self._open_windows == 0:
+            await self.set_valve(False)
+
+    async def _hold_and_spray(self, detection):
+        async with self._spray_lock:
+            try:
+                print("!!! TARGET DETECTED - INTERRUPTING MISSION !!!")
+                # Freeze in GPS hold, spray, then let ArduPilot resume where it was.
+                await self.system.action.hold()
+                print(">>> SPRAYING TARGET...")
+                await self._open_valve()
+                try:
+                    await asyncio.sleep(self.spray_duration_s)
+                finally:
+                    await self._close_valve()
+                print(">>> SPRAY COMPLETE.")
+                self.targets_sprayed += 1
+                print("Resuming Mission...")
+                await self.system.mission.start_mission()
+            finally:
+                self._holding = False
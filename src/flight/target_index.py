@@ -0,0 +1,71 @@
+import math
+
+import numpy as np
+
+from geo import METERS_PER_DEGREE
+
+
+class TargetIndex:
+    """
+    Grid-hash index of treated target locations in local metres.
+
+    Cells are `radius_m` on a side and keyed by integer (east, north) cell
+    coordinates, so a radius query only looks at the 3x3 block of cells
+    around the point and costs the same however many targets are stored.
+    The local frame is anchored at the first target added.
+    """
+
+    def __init__(self, radius_m=0.5):
+        if radius_m <= 0:
+            raise ValueError("Duplicate radius must be positive")
+        self.radius_m = float(radius_m)
+        self._radius_sq = self.radius_m * self.radius_m
+        self._cells = {}
+        self._count = 0
+        self._ref = None
+
+    def __len__(self):
+        return self._count
+
+    def _to_local(self, lat, lon):
+        if self._ref is None:
+            self._ref = (lat, lon, METERS_PER_DEGREE * math.cos(math.radians(lat)))
+        ref_lat, ref_lon, lon_scale = self._ref
+        return (lon - ref_lon) * lon_scale, (lat - ref_lat) * METERS_PER_DEGREE
+
+    def _key(self, x, y):
+        return math.floor(x / self.radius_m), math.floor(y / self.radius_m)
+
+    def add(self, lat, lon):
+        """Records a treated target."""
+        x, y = self._to_local(lat, lon)
+        self._cells.setdefault(self._key(x, y), []).append((x, y))
+        self._count += 1
+
+    def nearest_within(self, lat, lon):
+        """Distance in metres to the closest treated target within the radius, or None."""
+        if self._ref is None:
+            return None
+        x, y = self._to_local(lat, lon)
+        cx, cy = self._key(x, y)
+        best = None
+        for i in (cx - 1, cx, cx + 1):
+            for j in (cy - 1, cy, cy + 1):
+                for tx, ty in self._cells.get((i, j), ()):
+                    d = (tx - x) * (tx - x) + (ty - y) * (ty - y)
+                    if d <= self._radius_sq and (best is None or d < best):
+                        best = d
+        return None if best is None else math.sqrt(best)
+
+    def contains(self, lat, lon) -> bool:
+        """True if a treated target lies within the radius of (lat, lon)."""
+        return self.nearest_within(lat, lon) is not None
+
+    def points(self):
+        """Returns an (N, 2) array of every treated target's lat/lon."""
+        if self._ref is None:
+            return np.empty((0, 2))
+        ref_lat, ref_lon, lon_scale = self._ref
+        local = np.array([p for cell in self._cells.values() for p in cell])
+        return np.column_stack((ref_lat + local[:, 1] / METERS_PER_DEGREE,
+                                ref_lon + local[:, 0] / lon_scale))
@@ -0,0 +1,241 @@
+import asyncio
+import time
+
+import numpy as np
+
+# Queued to stream() consumers when the source stream ends.
+_END = object()
+
+# name -> (plugin, sample fields). Streams with fields also keep a ring buffer
+# of recent samples; an empty tuple means the value itself is the sample.
+STREAMS = {
+    "connection_state": ("core", None),
+    "health": ("telemetry", None),
+    "flight_mode": ("telemetry", ()),
+    "armed": ("telemetry", ()),
+    "in_air": ("telemetry", ()),
+    "position": ("telemetry", ("latitude_deg", "longitude_deg",
+                               "absolute_altitude_m", "relative_altitude_m")),
+    "velocity_ned": ("telemetry", ("north_m_s", "east_m_s", "down_m_s")),
+    "attitude_euler": ("telemetry", ("roll_deg", "pitch_deg", "yaw_deg")),
+    "battery": ("telemetry", ("voltage_v", "remaining_percent")),
+    "mission_progress": ("mission", ("current", "total")),
+}
+
+
+def sample_fields(name):
+    """Names of the numeric columns stored for a stream (("value",) for scalars)."""
+    fields = STREAMS[name][1]
+    return fields if fields else ("value",)
+
+
+def sample_values(name, value):
+    """Extracts the numeric sample of a stream value as a tuple of floats."""
+    fields = STREAMS[name][1]
+    if not fields:
+        return (float(getattr(value, "value", value)),)  # Enums (flight_mode) by value.
+    return tuple(getattr(value, field) for field in fields)
+
+
+class RingBuffer:
+    """Fixed-size history of timestamped numeric samples, preallocated up front."""
+
+    def __init__(self, capacity, width):
+        self.capacity = capacity
+        self._data = np.full((capacity, width + 1), np.nan)
+        self._count = 0
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def append(self, timestamp, values):
+        row = self._data[self._count % self.capacity]
+        row[0] = timestamp
+        row[1:] = values
+        self._count += 1
+
+    def snapshot(self):
+        """Returns (timestamps, values) in chronological order as copies."""
+        if self._count <= self.capacity:
+            data = self._data[:self._count].copy()
+        else:
+            start = self._count % self.capacity
+            data = np.concatenate((self._data[start:], self._data[:start]))
+        return data[:, 0], data[:, 1:]
+
+
+class TelemetryHub:
+    """
+    One subscription per telemetry stream, shared by every consumer.
+
+    Each stream is subscribed on first use. The hub keeps the latest value and
+    its receive time (time.monotonic()), a ring buffer of recent numeric
+    samples, and wakes any consumers waiting on a condition or iterating over
+    the stream. Consumers never open extra gRPC streams to mavsdk_server.
+
+    With an instrumentation.Metrics as `metrics`, every wait_for() is timed
+    under "wait_for.<stream>".
+    """
+
+    def __init__(self, system, history=512, queue_size=64, metrics=None):
+        self.system = system
+        self.metrics = metrics
+        self.history_size = history
+        self.queue_size = queue_size
+        self.latest = {}
+        self.latest_time = {}
+        self.message_counts = {}
+        self._buffers = {}
+        self._tasks = {}
+        self._waiters = {}
+        self._subscribers = {}
+        self._listeners = []
+        self.ended = set()
+
+    def subscribe(self, name):
+        """Starts the shared subscription for `name` if it is not running yet."""
+        if name not in STREAMS:
+            raise KeyError(f"Unknown telemetry stream '{name}'")
+        if name in self.ended:
+            return
+        task = self._tasks.get(name)
+        if task is None or task.done():
+            self._tasks[name] = asyncio.create_task(self._pump(name))
+
+    async def _pump(self, name):
+        plugin, fields = STREAMS[name]
+        stream = getattr(getattr(self.system, plugin), name)()
+        try:
+            async for value in stream:
+                self._publish(name, value, fields is not None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            for future, _ in self._waiters.pop(name, []):
+                if not future.done():
+                    future.set_exception(e)
+            raise
+        self._end(name)
+
+    def _end(self, name):
+        """The source stream finished (end of a replayed log): release every consumer."""
+        self.ended.add(name)
+        for future, _ in self._waiters.pop(name, []):
+            if not future.done():
+                future.set_exception(EOFError(f"Telemetry stream '{name}' ended"))
+        for queue in self._subscribers.get(name, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(_END)
+
+    def _publish(self, name, value, numeric):
+        now = time.monotonic()
+        self.latest[name] = value
+        self.latest_time[name] = now
+        self.message_counts[name] = self.message_counts.get(name, 0) + 1
+
+        if numeric:
+            sample = sample_values(name, value)
+            buffer = self._buffers.get(name)
+            if buffer is None:
+                buffer = self._buffers[name] = RingBuffer(self.history_size, len(sample))
+            buffer.append(now, sample)
+            for listener in self._listeners:
+                listener(name, now, sample)
+
+        waiters = self._waiters.get(name)
+        if waiters:
+            remaining = []
+            for future, predicate in waiters:
+                if future.done():
+                    continue
+                if predicate(value):
+                    future.set_result(value)
+                else:
+                    remaining.append((future, predicate))
+            self._waiters[name] = remaining
+
+        for queue in self._subscribers.get(name, ()):
+            if queue.full():
+                queue.get_nowait()  # Drop the oldest sample for slow consumers.
+            queue.put_nowait(value)
+
+    def add_listener(self, listener):
+        """Registers listener(name, timestamp, sample) for every numeric sample."""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def get(self, name, default=None):
+        """Returns the most recent value of a stream without waiting."""
+        self.subscribe(name)
+        return self.latest.get(name, default)
+
+    def age(self, name) -> float:
+        """Seconds since the last sample of `name` arrived (inf if none yet)."""
+        received = self.latest_time.get(name)
+        return float("inf") if received is None else time.monotonic() - received
+
+    def history(self, name):
+        """Returns (timestamps, samples) from the stream's ring buffer."""
+        buffer = self._buffers.get(name)
+        if buffer is None:
+            return np.empty(0), np.empty((0, 0))
+        return buffer.snapshot()
+
+    async def wait_for(self, name, predicate=bool, timeout=None):
+        """
+        Waits until a sample of `name` satisfies `predicate` and returns it.
+
+        The latest cached value is checked first, so conditions that already
+        hold return immediately.
+        """
+        if self.metrics is not None:
+            with self.metrics.timer(f"wait_for.{name}"):
+                return await self._wait_for(name, predicate, timeout)
+        return await self._wait_for(name, predicate, timeout)
+
+    async def _wait_for(self, name, predicate, timeout):
+        self.subscribe(name)
+        value = self.latest.get(name)
+        if name in self.latest and predicate(value):
+            return value
+        if name in self.ended:
+            raise EOFError(f"Telemetry stream '{name}' ended")
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(name, []).append((future, predicate))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            if not future.done():
+                future.cancel()
+
+    async def stream(self, name, include_latest=True):
+        """
+        Async iterator over new samples of `name`, for any number of
+        consumers. It only finishes if the source stream does (a replay).
+        """
+        self.subscribe(name)
+        queue = asyncio.Queue(self.queue_size)
+        if include_latest and name in self.latest:
+            queue.put_nowait(self.latest[name])
+        if name in self.ended:
+            queue.put_nowait(_END)
+        self._subscribers.setdefault(name, []).append(queue)
+        try:
+            while True:
+                value = await queue.get()
+                if value is _END:
+                    return
+                yield value
+        finally:
+            self._subscribers[name].remove(queue)
+
+    async def close(self):
+        """Cancels every subscription."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
@@ -0,0 +1,229 @@
+import math
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from geo import METERS_PER_DEGREE, longitude_scale
+from plan_compiler import MAV_FRAME_GLOBAL_RELATIVE_ALT, MAV_FRAME_GLOBAL_TERRAIN_ALT
+
+DEFAULT_TERRAIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "terrain")
+
+# ArduPilot AP_Terrain on-disk layout: each 2048-byte IO block holds one
+# 28x32 grid (north x east) that overlaps its neighbours by one 4x4 square,
+# so consecutive blocks start 24 and 28 grid points apart.
+IO_BLOCK_SIZE = 2048
+GRID_BLOCK_SIZE_X = 28
+GRID_BLOCK_SIZE_Y = 32
+GRID_BLOCK_SPACING_X = 24
+GRID_BLOCK_SPACING_Y = 28
+GRID_BLOCK_FULL_BITMAP = (1 << 56) - 1
+GRID_BLOCK_VERSION = 1
+
+GRID_BLOCK_DTYPE = np.dtype([
+    ("bitmap", "<u8"),
+    ("lat", "<i4"),
+    ("lon", "<i4"),
+    ("crc", "<u2"),
+    ("version", "<u2"),
+    ("spacing", "<u2"),
+    ("height", "<i2", (GRID_BLOCK_SIZE_X, GRID_BLOCK_SIZE_Y)),
+    ("grid_idx_x", "<u2"),
+    ("grid_idx_y", "<u2"),
+    ("lon_degrees", "<i2"),
+    ("lat_degrees", "i1"),
+])
+
+
+def tile_name(lat_degrees: int, lon_degrees: int) -> str:
+    """Returns the ArduPilot file name for the 1x1 degree tile, e.g. S36E149.DAT."""
+    return "%c%02d%c%03d.DAT" % ("S" if lat_degrees < 0 else "N", abs(lat_degrees),
+                                 "W" if lon_degrees < 0 else "E", abs(lon_degrees))
+
+
+class TerrainTile:
+    """
+    A memory-mapped ArduPilot terrain .DAT file covering one degree square.
+
+    Grid blocks are viewed in place through a structured dtype; only the block
+    headers are read up front to build a (grid_idx_x, grid_idx_y) lookup table.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._mmap = np.memmap(path, dtype=np.uint8, mode="r")
+        count = self._mmap.size // IO_BLOCK_SIZE
+        self.blocks = np.ndarray((count,), dtype=GRID_BLOCK_DTYPE, buffer=self._mmap,
+                                 strides=(IO_BLOCK_SIZE,))
+
+        valid = ((self.blocks["version"] == GRID_BLOCK_VERSION)
+                 & (self.blocks["bitmap"] == GRID_BLOCK_FULL_BITMAP))
+        block_ids = np.flatnonzero(valid)
+        if len(block_ids) == 0:
+            raise ValueError(f"No complete terrain blocks in {path}")
+
+        first = self.blocks[block_ids[0]]
+        self.lat_degrees = int(first["lat_degrees"])
+        self.lon_degrees = int(first["lon_degrees"])
+        self.spacing = float(first["spacing"])
+
+        grid_x = self.blocks["grid_idx_x"][block_ids].astype(np.intp)
+        grid_y = self.blocks["grid_idx_y"][block_ids].astype(np.intp)
+        self._lookup = np.full((grid_x.max() + 1, grid_y.max() + 1), -1, dtype=np.intp)
+        self._lookup[grid_x, grid_y] = block_ids
+        self._heights = self.blocks["height"]
+        self.block_count = len(block_ids)
+
+    def heights(self, lat, lon):
+        """
+        Bilinear-interpolated terrain height (metres AMSL) at each lat/lon.
+
+        Points outside the tile or in blocks that have not been downloaded
+        come back as NaN.
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+
+        # Same maths as AP_Terrain::calculate_grid_info, vectorized.
+        north = (lat - self.lat_degrees) * METERS_PER_DEGREE
+        east = ((lon - self.lon_degrees) * METERS_PER_DEGREE
+                * longitude_scale((lat + self.lat_degrees) * 0.5))
+        idx_x = np.floor(north / self.spacing)
+        idx_y = np.floor(east / self.spacing)
+        frac_x = north / self.spacing - idx_x
+        frac_y = east / self.spacing - idx_y
+
+        grid_x = idx_x // GRID_BLOCK_SPACING_X
+        grid_y = idx_y // GRID_BLOCK_SPACING_Y
+        inside = ((grid_x >= 0) & (grid_x < self._lookup.shape[0])
+                  & (grid_y >= 0) & (grid_y < self._lookup.shape[1]))
+        block = np.full(lat.shape, -1, dtype=np.intp)
+        block[inside] = self._lookup[grid_x[inside].astype(np.intp), grid_y[inside].astype(np.intp)]
+        found = block >= 0
+
+        result = np.full(lat.shape, np.nan)
+        if not found.any():
+            return result
+
+        b = block[found]
+        x = (idx_x[found] % GRID_BLOCK_SPACING_X).astype(np.intp)
+        y = (idx_y[found] % GRID_BLOCK_SPACING_Y).astype(np.intp)
+        fx = frac_x[found]
+        fy = frac_y[found]
+        h = self._heights
+        h00 = h[b, x, y]
+        h01 = h[b, x, y + 1]
+        h10 = h[b, x + 1, y]
+        h11 = h[b, x + 1, y + 1]
+        avg1 = (1.0 - fx) * h00 + fx * h10
+        avg2 = (1.0 - fx) * h01 + fx * h11
+        result[found] = (1.0 - fy) * avg1 + fy * avg2
+        return result
+
+    def close(self):
+        """Drops the memory map. The tile must not be used afterwards."""
+        self._heights = None
+        self.blocks = None
+        mm = getattr(self._mmap, "_mmap", None)
+        self._mmap = None
+        if mm is not None:
+            mm.close()
+
+
+class TerrainDatabase:
+    """
+    Terrain heights from a directory of ArduPilot .DAT tiles.
+
+    Tiles are opened on demand and kept in an LRU of at most `max_open_tiles`
+    memory maps.
+    """
+
+    def __init__(self, directory=DEFAULT_TERRAIN_DIR, max_open_tiles=4):
+        self.directory = directory
+        self.max_open_tiles = max_open_tiles
+        self._tiles = OrderedDict()
+
+    def tile(self, lat_degrees: int, lon_degrees: int):
+        """Returns the open TerrainTile for a degree square, or None if there is no file."""
+        key = (lat_degrees, lon_degrees)
+        if key in self._tiles:
+            self._tiles.move_to_end(key)
+            return self._tiles[key]
+
+        path = os.path.join(self.directory, tile_name(lat_degrees, lon_degrees))
+        tile = TerrainTile(path) if os.path.exists(path) else None
+        self._tiles[key] = tile
+        while len(self._tiles) > self.max_open_tiles:
+            _, evicted = self._tiles.popitem(last=False)
+            if evicted is not None:
+                evicted.close()
+        return tile
+
+    def heights(self, lat, lon):
+        """Terrain height (metres AMSL) for arrays of lat/lon; NaN where unknown."""
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        lat, lon = np.broadcast_arrays(lat, lon)
+        result = np.full(lat.shape, np.nan)
+
+        lat_deg = np.floor(lat).astype(np.int64)
+        lon_deg = np.floor(lon).astype(np.int64)
+        keys = np.stack([lat_deg.ravel(), lon_deg.ravel()], axis=1)
+        if keys.shape[0] == 0:
+            return result
+        unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.reshape(lat.shape)
+        for i, (tile_lat, tile_lon) in enumerate(unique_keys):
+            tile = self.tile(int(tile_lat), int(tile_lon))
+            if tile is None:
+                continue
+            mask = inverse == i
+            result[mask] = tile.heights(lat[mask], lon[mask])
+        return result
+
+    def height(self, lat: float, lon: float) -> float:
+        """Terrain height (metres AMSL) at a single point; NaN where unknown."""
+        tile = self.tile(math.floor(lat), math.floor(lon))
+        if tile is None:
+            return float("nan")
+        return float(tile.heights(np.array([lat]), np.array([lon]))[0])
+
+    def agl(self, lat, lon, amsl):
+        """Height above ground for arrays of lat/lon/AMSL altitude."""
+        return np.asarray(amsl, dtype=np.float64) - self.heights(lat, lon)
+
+    def mission_agl(self, plan, home_amsl=None):
+        """
+        Height above ground of every positional item of a CompiledPlan.
+
+        Relative-altitude items are referenced to `home_amsl`, which defaults to
+        the plan's plannedHomePosition altitude. Terrain-frame items already
+        carry their height above ground.
+        """
+        if home_amsl is None:
+            if plan.home is None:
+                raise ValueError("Plan has no home position; pass home_amsl")
+            home_amsl = plan.home[2]
+        mask = plan.waypoint_mask
+        frame = plan.frame[mask]
+        lat, lon, alt = plan.lat[mask], plan.lon[mask], plan.alt[mask]
+
+        amsl = np.where(frame == MAV_FRAME_GLOBAL_RELATIVE_ALT, alt + home_amsl, alt)
+        agl = amsl - self.heights(lat, lon)
+        return np.where(frame == MAV_FRAME_GLOBAL_TERRAIN_ALT, alt, agl)
+
+    def boom_clearance_ok(self, lat: float, lon: float, amsl: float, boom_drop_m: float,
+                          min_clearance_m: float) -> bool:
+        """
+        Single-sample check that the spray boom, hanging `boom_drop_m` below the
+        vehicle, stays at least `min_clearance_m` above the ground. Unknown terrain
+        is treated as a failed check.
+        """
+        clearance = amsl - boom_drop_m - self.height(lat, lon)
+        return clearance >= min_clearance_m
+
+    def close(self):
+        for tile in self._tiles.values():
+            if tile is not None:
+                tile.close()
+        self._tiles.clear()
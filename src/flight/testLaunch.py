@@ -1,12 +1,13 @@
 import asyncio
-from drone_actions import Drone
+from session_client import open_drone
 
 async def run():
     # -- Parameters
     takeoff_altitude = 5  # meters
     hover_duration = 10    # seconds
 
-    drone = Drone()
+    # Attaches to a running session_daemon if there is one.
+    drone = open_drone()
     await drone.connect()
     await drone.wait_for_readiness()
     await drone.arm()
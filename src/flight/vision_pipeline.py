@@ -0,0 +1,282 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from geo import ne_to_latlon
+from sprayer_controller import Detection, LatencyStats
+
+
+class Frame:
+    """An image with the monotonic capture time and the vehicle pose at capture."""
+
+    def __init__(self, index, timestamp, image, pose):
+        self.index = index
+        self.timestamp = timestamp
+        self.image = image
+        self.pose = pose
+
+
+class Pose:
+    """Vehicle position and heading used to georeference a frame."""
+
+    def __init__(self, latitude_deg, longitude_deg, relative_altitude_m, yaw_deg):
+        self.latitude_deg = latitude_deg
+        self.longitude_deg = longitude_deg
+        self.relative_altitude_m = relative_altitude_m
+        self.yaw_deg = yaw_deg
+
+
+def hub_pose(hub):
+    """
+    Returns a pose provider reading the latest position and attitude from a
+    TelemetryHub. Safe to call from the capture thread: it only reads the
+    hub's latest-value cache.
+    """
+    hub.subscribe("position")
+    hub.subscribe("attitude_euler")
+
+    def pose():
+        position = hub.latest.get("position")
+        if position is None:
+            return None
+        attitude = hub.latest.get("attitude_euler")
+        return Pose(position.latitude_deg, position.longitude_deg, position.relative_altitude_m,
+                    attitude.yaw_deg if attitude is not None else 0.0)
+    return pose
+
+
+class CameraModel:
+    """
+    Nadir-pointing pinhole camera, image top towards the vehicle's nose.
+
+    `forward_offset_m` is how far ahead of the GPS antenna the camera sits.
+    """
+
+    def __init__(self, width=640, height=480, hfov_deg=70.0, forward_offset_m=0.0):
+        self.width = width
+        self.height = height
+        self.hfov_deg = hfov_deg
+        self.forward_offset_m = forward_offset_m
+
+    def georeference(self, u, v, pose):
+        """Maps pixel arrays (u right, v down) to ground lat/lon arrays."""
+        altitude = max(pose.relative_altitude_m, 0.1)
+        metres_per_pixel = 2.0 * altitude * math.tan(math.radians(self.hfov_deg) / 2.0) / self.width
+        forward = (self.height / 2.0 - np.asarray(v, dtype=np.float64)) * metres_per_pixel \
+            + self.forward_offset_m
+        right = (np.asarray(u, dtype=np.float64) - self.width / 2.0) * metres_per_pixel
+        yaw = math.radians(pose.yaw_deg)
+        north = forward * math.cos(yaw) - right * math.sin(yaw)
+        east = forward * math.sin(yaw) + right * math.cos(yaw)
+        return ne_to_latlon(north, east, pose.latitude_deg, pose.longitude_deg)
+
+
+class SyntheticFrameSource:
+    """
+    Grey noise frames with a few bright square "weeds" at random positions,
+    produced at up to `fps` (None for as fast as possible).
+    """
+
+    def __init__(self, width=640, height=480, fps=30.0, targets_per_frame=2, target_px=8, seed=0):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.targets_per_frame = targets_per_frame
+        self.target_px = target_px
+        self._rng = np.random.default_rng(seed)
+        self._background = self._rng.integers(0, 96, (height, width), dtype=np.uint8)
+        self._next_time = None
+
+    def read(self):
+        """Returns the next frame as an (H, W) uint8 array."""
+        if self.fps:
+            now = time.monotonic()
+            if self._next_time is None:
+                self._next_time = now
+            if self._next_time > now:
+                time.sleep(self._next_time - now)
+            self._next_time += 1.0 / self.fps
+        image = self._background.copy()
+        size = self.target_px
+        for _ in range(self.targets_per_frame):
+            y = int(self._rng.integers(0, self.height - size))
+            x = int(self._rng.integers(0, self.width - size))
+            image[y:y + size, x:x + size] = 255
+        return image
+
+    def close(self):
+        pass
+
+
+class DummyDetector:
+    """
+    Stand-in for the YOLO model: finds bright blocks with numpy.
+
+    Each batch also sleeps `batch_ms + frame_ms * len(batch)` to mimic the
+    fixed and per-image cost of accelerator inference, which is what makes
+    batching pay off.
+    """
+
+    def __init__(self, threshold=200, block_px=16, batch_ms=4.0, frame_ms=1.0):
+        self.threshold = threshold
+        self.block_px = block_px
+        self.batch_ms = batch_ms
+        self.frame_ms = frame_ms
+
+    def detect_batch(self, images):
+        """Returns, per image, an (N, 3) array of pixel u, v and confidence."""
+        if self.batch_ms or self.frame_ms:
+            time.sleep((self.batch_ms + self.frame_ms * len(images)) / 1000.0)
+        stack = np.stack(images)
+        batch, height, width = stack.shape
+        b = self.block_px
+        blocks = stack[:, :height - height % b, :width - width % b]
+        peaks = blocks.reshape(batch, height // b, b, width // b, b).max(axis=(2, 4))
+        frame, row, col = np.nonzero(peaks >= self.threshold)
+        found = np.column_stack(((col + 0.5) * b, (row + 0.5) * b,
+                                 peaks[frame, row, col] / 255.0))
+        return [found[frame == i] for i in range(batch)]
+
+
+class VisionPipeline:
+    """
+    Capture thread -> bounded drop-oldest frame queue -> worker threads
+    running a detector on batches -> georeferenced Detections on the asyncio
+    loop.
+
+    The capture thread stamps each frame with time.monotonic() and the pose
+    from `pose_provider` at the moment it is read. When the workers fall
+    behind, the oldest queued frame is dropped so the queue never adds more
+    than `queue_size` frames of lag. Workers take up to `batch_size` frames,
+    waiting at most `batch_timeout_s` for a batch to fill.
+    """
+
+    def __init__(self, source, detector, pose_provider, camera=None, queue_size=4, workers=2,
+                 batch_size=4, batch_timeout_s=0.005, min_confidence=0.5):
+        self.source = source
+        self.detector = detector
+        self.pose_provider = pose_provider
+        self.camera = camera or CameraModel(getattr(source, "width", 640),
+                                            getattr(source, "height", 480))
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_timeout_s = batch_timeout_s
+        self.min_confidence = min_confidence
+
+        self.frames_captured = 0
+        self.frames_dropped = 0
+        self.frames_processed = 0
+        self.batches = 0
+        self.latency = LatencyStats()
+
+        self._frames = deque(maxlen=queue_size)
+        self._ready = threading.Condition()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._loop = None
+        self._queue = None
+
+    def start(self):
+        """Starts the capture and worker threads; call from the event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._stopping.clear()
+        self._threads = [threading.Thread(target=self._capture, name="capture", daemon=True)]
+        self._threads += [threading.Thread(target=self._work, name=f"detector-{i}", daemon=True)
+                          for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        """Stops every thread and waits for them to exit."""
+        self._request_stop()
+        self._join()
+
+    def _request_stop(self):
+        self._stopping.set()
+        with self._ready:
+            self._ready.notify_all()
+
+    def _join(self):
+        # A worker may be inside a slow detector call; this can block.
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self.source.close()
+
+    def _capture(self):
+        index = 0
+        while not self._stopping.is_set():
+            image = self.source.read()
+            if image is None:
+                break
+            frame = Frame(index, time.monotonic(), image, self.pose_provider())
+            index += 1
+            with self._ready:
+                if len(self._frames) == self._frames.maxlen:
+                    self.frames_dropped += 1
+                self._frames.append(frame)
+                self.frames_captured += 1
+                self._ready.notify()
+        self._stopping.set()
+        with self._ready:
+            self._ready.notify_all()
+
+    def _take_batch(self):
+        with self._ready:
+            while not self._frames and not self._stopping.is_set():
+                self._ready.wait()
+            if not self._frames:
+                return []
+            deadline = time.monotonic() + self.batch_timeout_s
+            while len(self._frames) < self.batch_size and not self._stopping.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._ready.wait(remaining):
+                    break
+            return [self._frames.popleft() for _ in range(min(self.batch_size, len(self._frames)))]
+
+    def _work(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            results = self.detector.detect_batch([frame.image for frame in batch])
+            detections = []
+            for frame, found in zip(batch, results):
+                found = found[found[:, 2] >= self.min_confidence]
+                if frame.pose is None or len(found) == 0:
+                    continue
+                lat, lon = self.camera.georeference(found[:, 0], found[:, 1], frame.pose)
+                detections += [Detection(frame.timestamp, float(a), float(o), float(c))
+                               for a, o, c in zip(lat, lon, found[:, 2])]
+            self._loop.call_soon_threadsafe(self._deliver, len(batch), detections)
+
+    def _deliver(self, frame_count, detections):
+        self.frames_processed += frame_count
+        self.batches += 1
+        now = time.monotonic()
+        for detection in detections:
+            self.latency.record("detection", (now - detection.timestamp) * 1000.0)
+            self._queue.put_nowait(detection)
+
+    async def detections(self):
+        """Async iterator of Detections; starts the pipeline if needed."""
+        if not self._threads:
+            self.start()
+        try:
+            while True:
+                yield await self._queue.get()
+        finally:
+            # Joining waits out the detector threads; keep it off the event loop.
+            self._request_stop()
+            await asyncio.to_thread(self._join)
+
+    def report(self):
+        print(f"   [Vision] captured={self.frames_captured} processed={self.frames_processed} "
+              f"dropped={self.frames_dropped} batches={self.batches}")
+        self.latency.report()